@@ -3,39 +3,97 @@ import configparser
 import re
 from .log_stuff import init_logger
 from . import config_file
-import svgwrite
 import random
-from .stars import Star, get_random_stars
+import math
+from .stars import StarTable, get_random_stars, get_float_list, STAR_RNG_LEGACY
 from .quadrant import Quadrant
 from .constellations import get_constellations
 from .dso import get_galaxies, get_clusters, DSO_GLOBULAR_CLUSTER, DSO_OPEN_CLUSTER
+from .clipping import get_expanded_box, get_visible_circles, clip_polylines
+from .renderers import get_renderer, log_layer_sizes, LAYER_BOX, LAYER_GRID, LAYER_CONSTELLATIONS, LAYER_GALAXIES, \
+                        LAYER_OPEN_CLUSTERS, LAYER_GLOBULAR_CLUSTERS, LAYER_STARS, LAYER_NAMES, STAR_PATHS_OFF, \
+                        LOD_MODE_BACKGROUND, SVG_DENSITY
+import collections
+import numpy
 #from svgwrite import pt
 pt = 1
 
 draw_all_quadrants = False
+# automatic neighbor band width, in constellation segments
+_neighbor_band_segments = 8.0
+# galaxy glyphs, one per eccentricity step, the eccentricities of consecutive steps differ by this factor
+_galaxy_eccentricity_ratio = 1.02
 
 log = init_logger()
 
-def generate_chart(filename, config):
+class Chart:
+    # Everything which is generated for a chart, ready to be written by any renderer
+    def __init__(self, config):
+        self.config = config
+        self.width = config.box_size.width if not draw_all_quadrants else config.box_size.width * 3
+        self.height = config.box_size.height if not draw_all_quadrants else config.box_size.height * 3
+        # legacy seeds must reproduce the older charts, their stars are not rounded to float32
+        self.star_table = StarTable(float_dtype = numpy.float64 if config.star_rng == STAR_RNG_LEGACY else numpy.float32)
+        self.central_quadrant = None
+        self.quadrants = []
+        self.master_rows = None
+        self.child_rows = None
+        self.constellations = None
+        self.galaxies = None
+        self.open_clusters = None
+        self.globular_clusters = None
+        # written SVG document, only if generate_chart was asked to keep it
+        self.svg_document = None
+        # files of the ladder of charts with fewer stars
+        self.ladder_files = []
+
+def generate_chart(filename, config, keep_document = False):
+    # With keep_document the SVG document (bytes) is returned as chart.svg_document too
     log.info("Creating chart %s"%(filename,))
-    
-    box_w = config.box_size.width if not draw_all_quadrants else config.box_size.width * 3
-    box_h = config.box_size.height if not draw_all_quadrants else config.box_size.height * 3
+
+    chart = build_chart(config)
+
+    renderer = get_renderer(config.output_renderer, filename, size = (chart.width*pt, chart.height*pt),
+                            precision = config.output_precision, minify = config.output_minify,
+                            compression_level = config.output_compression_level, keep_document = keep_document)
+    write_chart(chart, renderer)
+
+    log.info("Writting file %s"%(filename,))
+    renderer.save()
+    log_layer_sizes(renderer)
+    chart.svg_document = renderer.document
+
+    if config.output_ladder > 0:
+        # the same sky with the brightest N, 2N, 4N... stars
+        root, extension = os.path.splitext(filename)
+        for step in range(config.output_ladder_steps):
+            star_limit = config.output_ladder << step
+            ladder_filename = "%s.stars%i%s"%(root, star_limit, extension)
+            renderer = get_renderer(config.output_renderer, ladder_filename, size = (chart.width*pt, chart.height*pt),
+                                    precision = config.output_precision, minify = config.output_minify,
+                                    compression_level = config.output_compression_level)
+            write_chart(chart, renderer, star_limit = star_limit)
+            log.info("Writting file %s"%(ladder_filename,))
+            renderer.save()
+            log_layer_sizes(renderer)
+            chart.ladder_files.append(ladder_filename)
+
+    return chart
+
+def build_chart(config):
+    chart = Chart(config)
     box_offset = 0 if not draw_all_quadrants else 1
-        
-    dwg = svgwrite.Drawing(filename=filename, debug=True, size = (box_w*pt, box_h*pt))
 
     # Master quadrant
-    central_quadrant = None
     if config.add_neighbor_quadrants:
-        central_quadrant = Quadrant(id = "C", config = config, x = box_offset + 0, y = box_offset + 0)
-    master_stars = _get_chart(dwg, config, quadrant = central_quadrant)
-    
+        chart.central_quadrant = Quadrant(id = "C", config = config, x = box_offset + 0, y = box_offset + 0)
+    chart.master_rows = _get_stars(config, chart.star_table, quadrant = chart.central_quadrant)
+
     if config.add_neighbor_quadrants:
-        log.info("Writting neighbor quadrants")
-        
-        quadrants = []
-        
+        log.info("Adding neighbor quadrants")
+
+        quadrants = chart.quadrants
+
         quadrants.append(Quadrant(id = "E",  config = config, x = box_offset + 1,   y = box_offset + 0 ))
         quadrants.append(Quadrant(id = "SE", config = config, x = box_offset + 1,   y = box_offset + -1))
         quadrants.append(Quadrant(id = "S",  config = config, x = box_offset + 0,   y = box_offset + -1))
@@ -44,256 +102,464 @@ def generate_chart(filename, config):
         quadrants.append(Quadrant(id = "NW", config = config, x = box_offset + -1,  y = box_offset + 1 ))
         quadrants.append(Quadrant(id = "N",  config = config, x = box_offset + 0,   y = box_offset + 1 ))
         quadrants.append(Quadrant(id = "NE", config = config, x = box_offset + 1,   y = box_offset + 1 ))
-        
-        child_stars = []
-        for quadrant in quadrants:
-            child_stars.extend(_get_chart(dwg, config, quadrant = quadrant, master_stars = master_stars))
-        
-        quadrants.append(central_quadrant)
-      
-    constellations = None
+
+        if draw_all_quadrants:
+            chart.star_table.set_neighbor_quadrants(chart.central_quadrant, quadrants)
+            chart.child_rows = chart.star_table.add_child_stars(chart.master_rows, in_band_only = False)
+        else:
+            # child stars are created on demand, only inside the neighbor band
+            neighbor_band = _get_neighbor_band(config)
+            if neighbor_band != None:
+                log.info("Neighbor band: %.1f"%(neighbor_band, ))
+            chart.star_table.set_neighbor_quadrants(chart.central_quadrant, quadrants, band = neighbor_band)
+
+        quadrants.append(chart.central_quadrant)
+
+    if config.add_constellations:
+        log.info("Adding constellations")
+        chart.constellations = get_constellations(config, chart.star_table, chart.quadrants)
+
+    if config.add_galaxies:
+        log.info("Adding galaxies")
+        chart.galaxies = get_galaxies(config, chart.central_quadrant)
+
+    if config.add_open_clusters:
+        log.info("Adding open clusters")
+        chart.open_clusters = get_clusters(config, chart.central_quadrant, cluster_type = DSO_OPEN_CLUSTER)
+
+    if config.add_globular_clusters:
+        log.info("Adding globular clusters")
+        chart.globular_clusters = get_clusters(config, chart.central_quadrant, cluster_type = DSO_GLOBULAR_CLUSTER)
+
+    return chart
+
+def write_chart(chart, renderer, star_limit = None):
+    # star_limit is the number of the brightest stars to write, None to write all of them
+    config = chart.config
+
+    box_quadrants = [chart.central_quadrant]
+    if config.add_neighbor_quadrants and draw_all_quadrants:
+        box_quadrants.extend(chart.quadrants[:-1])
+    for quadrant in box_quadrants:
+        _write_box(renderer, config, quadrant)
+
+    # objects (or parts of them) outside of the chart are not written
+    clip_box = (0, 0, chart.width*pt, chart.height*pt) if config.output_clip_to_box else None
+
     if config.add_constellations:
         log.info("Writting constellations into the final chart")
-        constellations = _add_constellations(dwg, config, master_stars, quadrants)
+        _write_constellations(renderer, config, chart.star_table, chart.constellations, clip_box)
 
     if config.add_galaxies:
-        _add_galaxies(dwg, config, central_quadrant)
-    
+        _write_galaxies(renderer, config, _get_visible_dsos(chart.galaxies, config.galaxies_stroke_width, clip_box))
+
     if config.add_open_clusters:
-        _add_open_clusters(dwg, config, central_quadrant)
-        
+        _write_open_clusters(renderer, config, _get_visible_dsos(chart.open_clusters, config.open_clusters_stroke_width, clip_box))
+
     if config.add_globular_clusters:
-        _add_globular_clusters(dwg, config, central_quadrant)
-        
+        _write_globular_clusters(renderer, config, _get_visible_dsos(chart.globular_clusters, config.globular_clusters_stroke_width, clip_box))
+
     # now write the stars here
     log.info("Writting stars into the final chart")
-    stars_group = dwg.add(dwg.g(id='stars_group_central'))
-    draw_stars = []
-    draw_stars.extend(master_stars)
-    if config.add_neighbor_quadrants and draw_all_quadrants:
-        draw_stars.extend(child_stars)
-    
-    for star in draw_stars:
-        if star.constellation == None or star.constellation.custom_color == None:
-            fill = star.color.get_hex_rgb()
-            fill_opacity = star.color.get_float_alpha()
-        else:
-            fill = star.constellation.custom_color.get_hex_rgb()
-            fill_opacity = star.constellation.custom_color.get_float_alpha()
-        
-        circle = dwg.circle(center = (star.w*pt, star.h*pt), 
-                            r = star.size*pt, 
-                            fill = fill,
-                            fill_opacity = fill_opacity,
-                            )
-        stars_group.add(circle)
-    
+    star_rows, faint_star_rows = _get_lod_star_rows(config, chart.star_table, get_drawn_star_rows(chart), star_limit)
+    _write_stars(renderer, config, chart.star_table, star_rows, faint_star_rows)
+
     if config.add_constellations:
         log.info("Writting constellation names into the final chart")
-        _add_constellation_names(dwg, constellations, config)
-    
-    log.info("Writting file %s"%(filename,))
-    dwg.save()
-    
-def _add_galaxies(dwg, config, central_quadrant):
-    log.info("Adding galaxies")
-    galaxies = get_galaxies(config, central_quadrant)
-    
-    galaxies_dwg = dwg.add(dwg.g(id='galaxies', 
-                                 stroke=config.galaxies_stroke_color.get_hex_rgb(), 
-                                 stroke_opacity = config.galaxies_stroke_color.get_float_alpha(),
-                                 stroke_width = config.galaxies_stroke_width,
-                                 fill = config.galaxies_fill_color.get_hex_rgb(),
-                                 fill_opacity = config.galaxies_fill_color.get_float_alpha()))
-    
-    for galaxy in galaxies:
-        rx = galaxy.size
-        ry = galaxy.size * galaxy.params["eccentricity"]
-        galaxies_dwg.add(dwg.ellipse(center=(galaxy.w*pt, galaxy.h*pt), 
-                                     r=(rx*pt, ry*pt),
-                                     # it is necessary to specify the center of rotation, otherwise it seems to use the same center for the whole group
-                                     transform="rotate(%i %i %i)"%(galaxy.params["rotate"], galaxy.w*pt, galaxy.h*pt)))
-        
-    return galaxies
-
-def _add_open_clusters(dwg, config, central_quadrant):
-    log.info("Adding open clusters")
-    open_clusters = get_clusters(config, central_quadrant, cluster_type = DSO_OPEN_CLUSTER)
-    
-    open_clusters_dwg = dwg.add(dwg.g(id='open_clusters', 
-                                 stroke=config.open_clusters_stroke_color.get_hex_rgb(), 
-                                 stroke_opacity = config.open_clusters_stroke_color.get_float_alpha(),
-                                 stroke_width = config.open_clusters_stroke_width,
-                                 fill = config.open_clusters_fill_color.get_hex_rgb(),
-                                 fill_opacity = config.open_clusters_fill_color.get_float_alpha()))
-    
-    for open_cluster in open_clusters:
-        dash_size = config.open_clusters_stroke_dash_size*pt
-        open_clusters_dwg.add(dwg.circle(center=(open_cluster.w*pt, open_cluster.h*pt), 
-                                     r=open_cluster.size*pt).dasharray([dash_size, dash_size]))
-        
-    return open_clusters
-    
-def _add_globular_clusters(dwg, config, central_quadrant):
-    log.info("Adding globular clusters")
-    globular_clusters = get_clusters(config, central_quadrant, cluster_type = DSO_GLOBULAR_CLUSTER)
-    
-    globular_clusters_dwg = dwg.add(dwg.g(id='globular_clusters', 
-                                 stroke=config.globular_clusters_stroke_color.get_hex_rgb(), 
-                                 stroke_opacity = config.globular_clusters_stroke_color.get_float_alpha(),
-                                 stroke_width = config.globular_clusters_stroke_width,
-                                 fill = config.globular_clusters_fill_color.get_hex_rgb(),
-                                 fill_opacity = config.globular_clusters_fill_color.get_float_alpha()))
-    
-    for globular_cluster in globular_clusters:
-        cluster_group = globular_clusters_dwg.add(dwg.g(id='globular_cluster_%s'%(globular_cluster.id, ), ))
-        
-        cluster_group.add(dwg.circle(center=(globular_cluster.w*pt, globular_cluster.h*pt), 
-                                     r=globular_cluster.size*0.75*pt))
-        lv_w = globular_cluster.w
-        lv_h_start = globular_cluster.h - globular_cluster.size
-        lv_h_end   = globular_cluster.h + globular_cluster.size
-        
-        lh_h = globular_cluster.h
-        lh_w_start = globular_cluster.w - globular_cluster.size
-        lh_w_end   = globular_cluster.w + globular_cluster.size
-        
-        cluster_group.add(dwg.line(start=(lv_w*pt, lv_h_start*pt), end=(lv_w*pt, lv_h_end*pt)))
-        cluster_group.add(dwg.line(start=(lh_w_start*pt, lh_h*pt), end=(lh_w_end*pt, lh_h*pt)))
-        
-    return globular_clusters
-    
-def _add_constellations(dwg, config, master_stars, quadrants):
-    log.info("Adding constellations")
-
-    constellations = get_constellations(config, master_stars, quadrants)
-    
-    constellations_dwg = dwg.add(dwg.g(id='constellations', 
-                                       stroke=config.constellation_stroke_color.get_hex_rgb(), 
-                                       stroke_opacity = config.constellation_stroke_color.get_float_alpha(),
-                                       stroke_width = config.constellation_stroke_width,
-                                       fill = "none"))
-    
+        _write_constellation_names(renderer, config, chart.constellations)
+
+def _get_neighbor_band(config):
+    # None for the whole neighbor quadrants
+    if config.neighbor_band != "auto":
+        return config.neighbor_band
+    if not config.add_constellations:
+        return 0
+    # Estimate the segment length out of the mean spacing between the stars which are used
+    # for the constellations. A constellation which crosses the border does not reach
+    # further than a few segments into the neighbor quadrant
+    const_star_count = (sum(config.constellation_count_range) / 2) * (sum(config.constellation_star_count_range) / 2)
+    area = config.box_size.width * config.box_size.height
+    segment_length = 2 * math.sqrt(area / (const_star_count * math.pi))
+    return min(segment_length * _neighbor_band_segments, max(config.box_size))
+
+def get_drawn_star_rows(chart):
+    rows = []
+    rows.extend(chart.master_rows)
+    if chart.config.add_neighbor_quadrants and draw_all_quadrants:
+        rows.extend(chart.child_rows)
+    return rows
+
+def get_star_colors(star_table, rows):
+    # fill and fill opacity of every star, stars of constellations with a custom color take it
+    fills = []
+    fill_opacities = []
+    for row in rows:
+        constellation = star_table.get_constellation(row)
+        if constellation == None or constellation.custom_color == None:
+            palette_id = star_table.palette_id[row]
+            fills.append(star_table.palette.get_hex_rgb(palette_id))
+            fill_opacities.append(star_table.palette.get_opacity(palette_id))
+        else:
+            fills.append(constellation.custom_color.get_hex_rgb())
+            fill_opacities.append(constellation.custom_color.get_float_alpha())
+    return fills, fill_opacities
+
+def get_constellation_chains(constellations):
+    # master constellation -> chains (star ids, is closed) of the constellation and its copies
+    chains = collections.OrderedDict()
     for constellation in constellations:
-        for segment in constellation.segments:
-            const_points = []
-            for star_id in segment.star_ids:
-                star = constellation.star_dict[star_id]
-                const_points.append((star.w, star.h))
-            
+        master = constellation if constellation.master_constellation == None else constellation.master_constellation
+        if master not in chains:
+            chains[master] = []
+        for chain in constellation.get_chains():
+            chains[master].append((chain.star_ids, chain.is_closed))
+    return chains
+
+def _get_lod_star_rows(config, star_table, rows, star_limit = None):
+    # Level of detail of the stars, returns the rows of the stars to write and of the faint stars which are
+    # merged into the background image. The stars of the constellations are always written
+    rows = numpy.asarray(rows, dtype = numpy.int64)
+    in_constellation = star_table.get_constellation_mask(rows)
+    selected = numpy.ones(len(rows), dtype = bool)
+    faint = numpy.zeros(len(rows), dtype = bool)
+    if star_limit != None:
+        # the brightest stars are the biggest ones
+        brightest = numpy.zeros(len(rows), dtype = bool)
+        brightest[numpy.argsort(-star_table.size[rows], kind = "stable")[:star_limit]] = True
+        selected &= brightest | in_constellation
+    if config.output_lod_resolution > 0:
+        pixel_diameter = 2 * star_table.size[rows]*pt * (config.output_lod_resolution / SVG_DENSITY)
+        small = selected & ~in_constellation & (pixel_diameter < config.output_lod_min_diameter)
+        if config.output_lod_mode == LOD_MODE_BACKGROUND:
+            faint = small
+        selected &= ~small
+    if not selected.all():
+        log.info("Writting %i out of %i stars, %i merged into the background"%(int(selected.sum()), len(rows), int(faint.sum())))
+    return rows[selected].tolist(), rows[faint].tolist()
+
+def _write_stars(renderer, config, star_table, rows, faint_rows = ()):
+    fills, fill_opacities = get_star_colors(star_table, rows)
+
+    style = {}
+    if config.output_minify and len(rows) > 0 and config.output_star_paths == STAR_PATHS_OFF:
+        # the most used star color goes to the group, the renderer does not repeat it for every star
+        style["fill"] = _get_most_common(fills)
+        style["fill_opacity"] = _get_most_common(fill_opacities)
+
+    renderer.begin_layer(LAYER_STARS, id='stars_group_central', **style)
+    if len(faint_rows) > 0:
+        faint_fills, faint_fill_opacities = get_star_colors(star_table, faint_rows)
+        renderer.add_star_image(x = get_float_list(star_table.w[faint_rows]*pt),
+                                y = get_float_list(star_table.h[faint_rows]*pt),
+                                r = get_float_list(star_table.size[faint_rows]*pt),
+                                fill = faint_fills,
+                                fill_opacity = faint_fill_opacities,
+                                resolution = config.output_lod_resolution)
+    if config.output_star_paths != STAR_PATHS_OFF and len(rows) > 0:
+        # one path per (size class, color)
+        size_classes, radii = _get_size_classes(star_table.size[rows], config.output_star_size_classes)
+        buckets = {}
+        for index, bucket in enumerate(zip(size_classes.tolist(), fills, [str(v) for v in fill_opacities])):
+            buckets.setdefault(bucket, []).append(index)
+        log.info("Writting %i stars as %i paths"%(len(rows), len(buckets)))
+        w = star_table.w[rows]*pt
+        h = star_table.h[rows]*pt
+        # small stars first, the big ones are drawn on top
+        for bucket in sorted(buckets):
+            size_class, fill, fill_opacity = bucket
+            renderer.add_dots(x = get_float_list(w[buckets[bucket]]),
+                              y = get_float_list(h[buckets[bucket]]),
+                              r = radii[size_class]*pt,
+                              color = fill,
+                              opacity = fill_opacity,
+                              mode = config.output_star_paths)
+    elif config.output_star_size_classes == 0 or len(rows) == 0:
+        renderer.add_circles(cx = get_float_list(star_table.w[rows]*pt),
+                             cy = get_float_list(star_table.h[rows]*pt),
+                             r = get_float_list(star_table.size[rows]*pt),
+                             fill = fills,
+                             fill_opacity = fill_opacities)
+    else:
+        # one glyph per size class
+        size_classes, radii = _get_size_classes(star_table.size[rows], config.output_star_size_classes)
+        renderer.begin_definitions()
+        for size_class in numpy.unique(size_classes).tolist():
+            renderer.add_circle(center = (0, 0), r = radii[size_class]*pt, id = "star_size_%i"%(size_class, ))
+        renderer.end_definitions()
+        hrefs = ["star_size_%i"%(size_class, ) for size_class in range(len(radii))]
+        renderer.add_uses(href = [hrefs[size_class] for size_class in size_classes.tolist()],
+                          x = get_float_list(star_table.w[rows]*pt),
+                          y = get_float_list(star_table.h[rows]*pt),
+                          fill = fills,
+                          fill_opacity = fill_opacities)
+    renderer.end_layer()
+
+def _get_size_classes(sizes, count):
+    # Splits the sizes into count classes of the same width, returns the class of every size and the
+    # radius of every class (the mean size of its items)
+    sizes = numpy.asarray(sizes, dtype = numpy.float64)
+    size_min = sizes.min()
+    size_range = sizes.max() - size_min
+    if size_range == 0:
+        size_classes = numpy.zeros(len(sizes), dtype = numpy.int64)
+    else:
+        size_classes = numpy.minimum(((sizes - size_min) * (count / size_range)).astype(numpy.int64), count - 1)
+    class_count = numpy.bincount(size_classes, minlength = count)
+    class_sum = numpy.bincount(size_classes, weights = sizes, minlength = count)
+    radii = numpy.divide(class_sum, class_count, out = numpy.zeros(count), where = class_count > 0)
+    return size_classes, radii.tolist()
+
+def _get_star_points(star_table, star_ids):
+    star_ids = numpy.asarray(star_ids, dtype = numpy.int64)
+    return list(zip(get_float_list(star_table.w[star_ids]), get_float_list(star_table.h[star_ids])))
+
+def _get_unscaled(value, scale):
+    # value to set on a scaled glyph instance so it is drawn with the original value (stroke width, dashes)
+    return "%.4g"%(value / scale, )
+
+def _get_most_common(values):
+    return collections.Counter(values).most_common(1)[0][0]
+
+def _get_visible_dsos(dsos, stroke_width, clip_box):
+    if clip_box == None or len(dsos) == 0:
+        return dsos
+    visible = get_visible_circles([dso.w*pt for dso in dsos], [dso.h*pt for dso in dsos], [dso.size*pt for dso in dsos],
+                                  get_expanded_box(clip_box, stroke_width))
+    log.info("Culled %i out of %i DSOs of type %s"%(len(dsos) - int(visible.sum()), len(dsos), dsos[0].dso_type))
+    return [dso for dso, is_visible in zip(dsos, visible.tolist()) if is_visible]
+
+def _write_galaxies(renderer, config, galaxies):
+    log.info("Writting galaxies")
+    renderer.begin_layer(LAYER_GALAXIES, id='galaxies',
+                         stroke=config.galaxies_stroke_color.get_hex_rgb(),
+                         stroke_opacity = config.galaxies_stroke_color.get_float_alpha(),
+                         stroke_width = config.galaxies_stroke_width,
+                         fill = config.galaxies_fill_color.get_hex_rgb(),
+                         fill_opacity = config.galaxies_fill_color.get_float_alpha())
+
+    if config.output_dso_glyphs:
+        # unit size galaxies, one per eccentricity step. The steps are relative, so the axis ratio of
+        # every galaxy is off by 1% at most, also for the flattest ones
+        eccentricity_steps = [int(round(-math.log(galaxy.params["eccentricity"], _galaxy_eccentricity_ratio))) for galaxy in galaxies]
+        renderer.begin_definitions()
+        for step in sorted(set(eccentricity_steps)):
+            renderer.add_ellipse(center=(0, 0), r=(1, float("%.4g"%(_galaxy_eccentricity_ratio**-step, ))), id = "galaxy_%i"%(step, ))
+        renderer.end_definitions()
+
+        for galaxy, step in zip(galaxies, eccentricity_steps):
+            renderer.add_use("galaxy_%i"%(step, ),
+                             insert=(galaxy.w*pt, galaxy.h*pt),
+                             rotate=galaxy.params["rotate"],
+                             scale=galaxy.size*pt,
+                             stroke_width=_get_unscaled(config.galaxies_stroke_width, galaxy.size*pt))
+    else:
+        for galaxy in galaxies:
+            rx = galaxy.size
+            ry = galaxy.size * galaxy.params["eccentricity"]
+            renderer.add_ellipse(center=(galaxy.w*pt, galaxy.h*pt),
+                                 r=(rx*pt, ry*pt),
+                                 # it is necessary to specify the center of rotation, otherwise it seems to use the same center for the whole group
+                                 transform="rotate(%i %i %i)"%(galaxy.params["rotate"], galaxy.w*pt, galaxy.h*pt))
+    renderer.end_layer()
+
+def _write_open_clusters(renderer, config, open_clusters):
+    log.info("Writting open clusters")
+    dash_size = config.open_clusters_stroke_dash_size*pt
+    style = {}
+    if config.output_minify and not config.output_dso_glyphs:
+        # same dash for every cluster, write it just once
+        style["stroke_dasharray"] = "%s %s"%(dash_size, dash_size)
+
+    renderer.begin_layer(LAYER_OPEN_CLUSTERS, id='open_clusters',
+                         stroke=config.open_clusters_stroke_color.get_hex_rgb(),
+                         stroke_opacity = config.open_clusters_stroke_color.get_float_alpha(),
+                         stroke_width = config.open_clusters_stroke_width,
+                         fill = config.open_clusters_fill_color.get_hex_rgb(),
+                         fill_opacity = config.open_clusters_fill_color.get_float_alpha(),
+                         **style)
+
+    if config.output_dso_glyphs:
+        renderer.begin_definitions()
+        renderer.add_circle(center=(0, 0), r=1, id="open_cluster")
+        renderer.end_definitions()
+
+        for open_cluster in open_clusters:
+            scaled_dash_size = _get_unscaled(dash_size, open_cluster.size*pt)
+            renderer.add_use("open_cluster",
+                             insert=(open_cluster.w*pt, open_cluster.h*pt),
+                             scale=open_cluster.size*pt,
+                             stroke_width=_get_unscaled(config.open_clusters_stroke_width, open_cluster.size*pt),
+                             stroke_dasharray="%s %s"%(scaled_dash_size, scaled_dash_size))
+    else:
+        for open_cluster in open_clusters:
+            renderer.add_circle(center=(open_cluster.w*pt, open_cluster.h*pt),
+                                r=open_cluster.size*pt,
+                                stroke_dasharray="%s %s"%(dash_size, dash_size))
+    renderer.end_layer()
+
+def _write_globular_clusters(renderer, config, globular_clusters):
+    log.info("Writting globular clusters")
+    renderer.begin_layer(LAYER_GLOBULAR_CLUSTERS, id='globular_clusters',
+                         stroke=config.globular_clusters_stroke_color.get_hex_rgb(),
+                         stroke_opacity = config.globular_clusters_stroke_color.get_float_alpha(),
+                         stroke_width = config.globular_clusters_stroke_width,
+                         fill = config.globular_clusters_fill_color.get_hex_rgb(),
+                         fill_opacity = config.globular_clusters_fill_color.get_float_alpha())
+
+    if config.output_dso_glyphs:
+        renderer.begin_definitions()
+        renderer.begin_group(id="globular_cluster")
+        renderer.add_circle(center=(0, 0), r=0.75)
+        renderer.add_line(start=(0, -1), end=(0, 1))
+        renderer.add_line(start=(-1, 0), end=(1, 0))
+        renderer.end_group()
+        renderer.end_definitions()
+
+        for globular_cluster in globular_clusters:
+            renderer.add_use("globular_cluster",
+                             insert=(globular_cluster.w*pt, globular_cluster.h*pt),
+                             scale=globular_cluster.size*pt,
+                             stroke_width=_get_unscaled(config.globular_clusters_stroke_width, globular_cluster.size*pt))
+    else:
+        for globular_cluster in globular_clusters:
+            renderer.begin_group(id='globular_cluster_%s'%(globular_cluster.id, ))
+
+            renderer.add_circle(center=(globular_cluster.w*pt, globular_cluster.h*pt),
+                                r=globular_cluster.size*0.75*pt)
+            lv_w = globular_cluster.w
+            lv_h_start = globular_cluster.h - globular_cluster.size
+            lv_h_end   = globular_cluster.h + globular_cluster.size
+
+            lh_h = globular_cluster.h
+            lh_w_start = globular_cluster.w - globular_cluster.size
+            lh_w_end   = globular_cluster.w + globular_cluster.size
+
+            renderer.add_line(start=(lv_w*pt, lv_h_start*pt), end=(lv_w*pt, lv_h_end*pt))
+            renderer.add_line(start=(lh_w_start*pt, lh_h*pt), end=(lh_w_end*pt, lh_h*pt))
+            renderer.end_group()
+    renderer.end_layer()
+
+def _write_constellations(renderer, config, star_table, constellations, clip_box = None):
+    renderer.begin_layer(LAYER_CONSTELLATIONS, id='constellations',
+                         stroke=config.constellation_stroke_color.get_hex_rgb(),
+                         stroke_opacity = config.constellation_stroke_color.get_float_alpha(),
+                         stroke_width = config.constellation_stroke_width,
+                         fill = "none",
+                         # round joins for the chained paths, the sharp angles would end in long miters
+                         stroke_linejoin = "round" if config.output_constellation_paths else None)
+
+    if config.output_constellation_paths:
+        # one path per constellation, including its copies
+        for constellation, chains in get_constellation_chains(constellations).items():
+            if len(chains) == 0:
+                continue
+            chains = [(_get_star_points(star_table, star_ids), is_closed) for star_ids, is_closed in chains]
+            if clip_box != None:
+                chains = clip_polylines(chains, get_expanded_box(clip_box, config.constellation_stroke_width))
+                if len(chains) == 0:
+                    continue
             kwargs = {}
-            
             if constellation.custom_color != None:
                 kwargs["stroke"] = constellation.custom_color.get_hex_rgb()
                 kwargs["stroke_opacity"] = constellation.custom_color.get_float_alpha()
-            
-            # Finally, make a polygon with the chosen stars
-            if segment.is_closed:
-                constellations_dwg.add(dwg.polygon(points = const_points, **kwargs))
-            else:
-                constellations_dwg.add(dwg.polyline(points = const_points, **kwargs))
-        
-    return constellations
-    
-def _add_constellation_names(dwg, constellations, config):
-    const_names = dwg.add(dwg.g(id='constellation_names', 
-                                stroke='none',
-                                fill=config.constellation_name_font.color.get_hex_rgb(),
-                                fill_opacity=config.constellation_name_font.color.get_float_alpha(),
-                                font_size=config.constellation_name_font.size*pt,
-                                font_family=config.constellation_name_font.font_family))
-    
+            renderer.add_path(chains, **kwargs)
+    else:
+        for constellation in constellations:
+            polylines = []
+            for segment in constellation.segments:
+                polylines.append((_get_star_points(star_table, segment.star_ids), segment.is_closed))
+            if clip_box != None:
+                polylines = clip_polylines(polylines, get_expanded_box(clip_box, config.constellation_stroke_width))
+
+            for const_points, is_closed in polylines:
+                kwargs = {}
+
+                if constellation.custom_color != None:
+                    kwargs["stroke"] = constellation.custom_color.get_hex_rgb()
+                    kwargs["stroke_opacity"] = constellation.custom_color.get_float_alpha()
+
+                # Finally, make a polygon with the chosen stars
+                if is_closed:
+                    renderer.add_polygon(points = const_points, **kwargs)
+                else:
+                    renderer.add_polyline(points = const_points, **kwargs)
+    renderer.end_layer()
+
+def _write_constellation_names(renderer, config, constellations):
+    renderer.begin_layer(LAYER_NAMES, id='constellation_names',
+                         stroke='none',
+                         fill=config.constellation_name_font.color.get_hex_rgb(),
+                         fill_opacity=config.constellation_name_font.color.get_float_alpha(),
+                         font_size=config.constellation_name_font.size*pt,
+                         font_family=config.constellation_name_font.font_family)
+
     for constellation in constellations:
         if config.constellation_name_enable:
             kwargs = {}
             if constellation.custom_color != None:
                 kwargs["fill"] = constellation.custom_color.get_hex_rgb()
                 kwargs["fill_opacity"] = constellation.custom_color.get_float_alpha()
-            
+
             w, h = constellation.get_mean_position()
-            const_names.add(dwg.text(constellation.get_display_name(),
-                                     insert=(w*pt, h*pt),
-                                     text_anchor="middle",
-                                     **kwargs,
-                                     )
-        )
-    
-def _get_chart(dwg, config, quadrant = None, master_stars = None):
-    #assert quadrant == None or master_stars != None
-    
+            renderer.add_text(constellation.get_display_name(),
+                              insert=(w*pt, h*pt),
+                              text_anchor="middle",
+                              **kwargs,
+                              )
+    renderer.end_layer()
+
+def _write_box(renderer, config, quadrant = None):
     q_w = 0 if quadrant == None else quadrant.w
     q_h = 0 if quadrant == None else quadrant.h
-    
-    
-    # stars
-    if master_stars == None or draw_all_quadrants:
-    
-        # out box
-        out_box = dwg.add(dwg.g(id='out_box', 
-                                stroke=config.box_stroke_color.get_hex_rgb(), 
-                                stroke_opacity=config.box_stroke_color.get_float_alpha(), 
-                                fill=config.box_fill_color.get_hex_rgb(), 
-                                fill_opacity=config.box_fill_color.get_float_alpha(), 
-                                stroke_width = config.box_stroke_width))
-        out_box.add(dwg.polygon(points=[((0 + q_w)*pt,         (0 + q_h)*pt), 
-                                        ((0 + q_w)*pt,         (config.box_size.height + q_h)*pt),
-                                        ((config.box_size.width + q_w)*pt, (config.box_size.height + q_h)*pt),
-                                        ((config.box_size.width + q_w)*pt, (0 + q_h)*pt)]))
-        
-        # grid
-        if config.add_grid and (config.grid_line_count_horizontal != 0 or config.grid_line_count_vertical != 0):
-            grid = dwg.add(dwg.g(id='grid', 
-                                 stroke=config.grid_stroke_color.get_hex_rgb(),
-                                 stroke_opacity=config.grid_stroke_color.get_float_alpha(),
-                                 stroke_width = config.grid_stroke_width))
-            # Horizontal lines
-            sep = config.box_size.height / (1 + config.grid_line_count_vertical)
-            for i in range(0, config.grid_line_count_vertical):
-                grid.add(dwg.line(start=((0 + q_w)*pt, (sep + sep*i + q_h)*pt), end=((config.box_size.width + q_w)*pt, (sep + sep*i + q_h)*pt)))
-            # Vertical lines
-            sep = config.box_size.width / (1 + config.grid_line_count_horizontal)
-            for i in range(0, config.grid_line_count_horizontal):
-                grid.add(dwg.line(start=((sep + sep*i + q_w)*pt, (0 + q_h)*pt), end=((sep + sep*i + q_w)*pt, (config.box_size.height + q_h)*pt)))
-        
-    if master_stars == None:
-    
-        log.info("Adding %i stars to central quadrant %s"%(config.star_count, quadrant))
-        min_size = config.star_size_range[0]
-        max_size = config.star_size_range[1]
-    
-        if config.star_random_seed != None:
-            random.seed(config.star_random_seed)
-    
-        generated_stars = get_random_stars(min_size = min_size,
-                                           max_size = max_size,
-                                           max_w = config.box_size.width,
-                                           max_h = config.box_size.height,
-                                           color = config.star_color,
-                                           star_count = config.star_count,
-                                           size_random_count = config.star_size_random_count,
-                                           size_distribution_power = config.star_size_distribution_power,
-                                           quadrant = quadrant)
-        
-    else:
-        generated_stars = []
-        #log.info("Writting %i stars to quadrant %s"%(len(master_stars), quadrant))
-        #stars_group = dwg.add(dwg.g(id='stars_group_q%s'%(quadrant.id,)))
-        for master_star in master_stars:
-            #w, h = quadrant.adjust_coordinates(master_star.w, master_star.h)
-        
-            child_star = Star(master_star = master_star, 
-                              quadrant = quadrant)
-            generated_stars.append(child_star)
-        
-            #log.debug("%s (out of %s)"%(child_star, master_star))
-            #log.debug("w: %i, h: %i"%(w, h))
-            
-            
-            #circle = dwg.circle(center = (child_star.w, child_star.h), 
-            #                    r = child_star.size*pt, 
-            #                    fill = child_star.color.get_hex_rgb(),
-            #                    fill_opacity = child_star.color.get_float_alpha())
-            #stars_group.add(circle)
-            
-    return generated_stars
-    
+
+    # out box
+    renderer.begin_layer(LAYER_BOX, id='out_box',
+                         stroke=config.box_stroke_color.get_hex_rgb(),
+                         stroke_opacity=config.box_stroke_color.get_float_alpha(),
+                         fill=config.box_fill_color.get_hex_rgb(),
+                         fill_opacity=config.box_fill_color.get_float_alpha(),
+                         stroke_width = config.box_stroke_width)
+    renderer.add_polygon(points=[((0 + q_w)*pt,         (0 + q_h)*pt),
+                                 ((0 + q_w)*pt,         (config.box_size.height + q_h)*pt),
+                                 ((config.box_size.width + q_w)*pt, (config.box_size.height + q_h)*pt),
+                                 ((config.box_size.width + q_w)*pt, (0 + q_h)*pt)])
+    renderer.end_layer()
+
+    # grid
+    if config.add_grid and (config.grid_line_count_horizontal != 0 or config.grid_line_count_vertical != 0):
+        renderer.begin_layer(LAYER_GRID, id='grid',
+                             stroke=config.grid_stroke_color.get_hex_rgb(),
+                             stroke_opacity=config.grid_stroke_color.get_float_alpha(),
+                             stroke_width = config.grid_stroke_width)
+        # Horizontal lines
+        sep = config.box_size.height / (1 + config.grid_line_count_vertical)
+        for i in range(0, config.grid_line_count_vertical):
+            renderer.add_line(start=((0 + q_w)*pt, (sep + sep*i + q_h)*pt), end=((config.box_size.width + q_w)*pt, (sep + sep*i + q_h)*pt))
+        # Vertical lines
+        sep = config.box_size.width / (1 + config.grid_line_count_horizontal)
+        for i in range(0, config.grid_line_count_horizontal):
+            renderer.add_line(start=((sep + sep*i + q_w)*pt, (0 + q_h)*pt), end=((sep + sep*i + q_w)*pt, (config.box_size.height + q_h)*pt))
+        renderer.end_layer()
+
+def _get_stars(config, star_table, quadrant = None):
+    log.info("Adding %i stars to central quadrant %s"%(config.star_count, quadrant))
+    min_size = config.star_size_range[0]
+    max_size = config.star_size_range[1]
+
+    if config.star_random_seed != None and config.star_rng == STAR_RNG_LEGACY:
+        random.seed(config.star_random_seed)
+
+    return get_random_stars(star_table,
+                            min_size = min_size,
+                            max_size = max_size,
+                            max_w = config.box_size.width,
+                            max_h = config.box_size.height,
+                            color = config.star_color,
+                            star_count = config.star_count,
+                            size_random_count = config.star_size_random_count,
+                            size_distribution_power = config.star_size_distribution_power,
+                            quadrant = quadrant,
+                            rng = config.star_rng,
+                            seed = config.star_random_seed,
+                            color_index_resolution = config.star_color_index_resolution)
+
@@ -0,0 +1,93 @@
+import numpy
+from .log_stuff import init_logger
+
+log = init_logger()
+
+# Culling and clipping of the chart objects against a box (x0, y0, x1, y1), so the copies of the
+# objects in the neighbor quadrants are only written as far as they can be seen.
+
+def get_expanded_box(box, margin):
+    return (box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin)
+
+def get_visible_circles(x, y, r, box):
+    # mask of the circles (or any object within a radius r) which touch the box
+    x = numpy.asarray(x, dtype = numpy.float64)
+    y = numpy.asarray(y, dtype = numpy.float64)
+    r = numpy.asarray(r, dtype = numpy.float64)
+    return (x + r >= box[0]) & (x - r <= box[2]) & (y + r >= box[1]) & (y - r <= box[3])
+
+def clip_polylines(polylines, box):
+    # Clips polylines, a list of (points, is_closed), to the box. Returns the visible pieces as
+    # (points, is_closed), a polyline may be split into several pieces or disappear. Only closed
+    # polylines which are completely inside of the box stay closed.
+    #
+    # The segments of all the polylines are clipped at once (Liang-Barsky).
+    segment_points = []
+    for points, is_closed in polylines:
+        points = [(float(x), float(y)) for x, y in points]
+        if is_closed and len(points) > 2:
+            points.append(points[0])
+        segment_points.append(points)
+    starts = [p for points in segment_points for p in points[:-1]]
+    ends = [p for points in segment_points for p in points[1:]]
+    if len(starts) == 0:
+        return [(points, is_closed) for points, is_closed in polylines if len(points) > 0 and _is_point_inside(points[0], box)]
+    t_start, t_end, visible = _clip_segments(numpy.array(starts), numpy.array(ends), box)
+    t_start = t_start.tolist()
+    t_end = t_end.tolist()
+    visible = visible.tolist()
+
+    pieces = []
+    first_segment = 0
+    for points, (original_points, is_closed) in zip(segment_points, polylines):
+        segment_count = len(points) - 1
+        segments = range(first_segment, first_segment + segment_count)
+        first_segment += segment_count
+        if all([visible[s] and t_start[s] == 0 and t_end[s] == 1 for s in segments]):
+            if segment_count > 0:
+                pieces.append((original_points, is_closed))
+            continue
+
+        polyline_pieces = []
+        current = None
+        for index, s in enumerate(segments):
+            if not visible[s]:
+                current = None
+                continue
+            start = points[index] if t_start[s] == 0 else _get_point(points[index], points[index + 1], t_start[s])
+            end = points[index + 1] if t_end[s] == 1 else _get_point(points[index], points[index + 1], t_end[s])
+            if current == None or t_start[s] > 0:
+                current = [start]
+                polyline_pieces.append(current)
+            current.append(end)
+            if t_end[s] < 1:
+                current = None
+        # a closed polyline which goes through the box border continues from its last piece to its first one
+        if is_closed and len(polyline_pieces) > 1 and polyline_pieces[0][0] == points[0] and polyline_pieces[-1][-1] == points[-1]:
+            polyline_pieces[0] = polyline_pieces.pop() + polyline_pieces[0][1:]
+        pieces.extend([(piece, False) for piece in polyline_pieces])
+    return pieces
+
+def _clip_segments(starts, ends, box):
+    # parameters (t_start, t_end) of the visible part of every segment and the mask of the visible ones
+    dx = ends[:, 0] - starts[:, 0]
+    dy = ends[:, 1] - starts[:, 1]
+    t_start = numpy.zeros(len(starts))
+    t_end = numpy.ones(len(starts))
+    outside = numpy.zeros(len(starts), dtype = bool)
+    for p, q in ((-dx, starts[:, 0] - box[0]),
+                 (dx, box[2] - starts[:, 0]),
+                 (-dy, starts[:, 1] - box[1]),
+                 (dy, box[3] - starts[:, 1])):
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            r = q / p
+        t_start = numpy.where(p < 0, numpy.maximum(t_start, r), t_start)
+        t_end = numpy.where(p > 0, numpy.minimum(t_end, r), t_end)
+        outside |= (p == 0) & (q < 0)
+    return t_start, t_end, ~outside & (t_start <= t_end)
+
+def _get_point(start, end, t):
+    return (start[0] + t * (end[0] - start[0]), start[1] + t * (end[1] - start[1]))
+
+def _is_point_inside(point, box):
+    return box[0] <= point[0] <= box[2] and box[1] <= point[1] <= box[3]
@@ -1,4 +1,5 @@
 import re
+import numpy
 from .log_stuff import init_logger
 
 log = init_logger()
@@ -67,6 +68,10 @@ class Color:
             return txt
         raise Exception("No hex value defined for color %s"%(repr(self.color_name), ))
     
+    def get_packed_rgba(self):
+        assert self.has_rgb, "No RGBA value defined for color %s"%(repr(self.color_name), )
+        return (self.red << 24) | (self.green << 16) | (self.blue << 8) | self.alpha
+    
     def get_100_alpha(self):
         return int(self.alpha / 2.55)
     
@@ -78,10 +83,8 @@ class Color:
                                               opacity = self.get_float_alpha())
     
     def clone(self):
-        new_color = Color(self._color_txt)
-        if self.has_rgb:
-            new_color.has_rgb = True
-            new_color.set_rgb_val(self.get_hex_rgba())
+        new_color = Color.__new__(Color)
+        new_color.__dict__.update(self.__dict__)
         return new_color
     
     def __repr__(self):
@@ -100,65 +103,60 @@ class Color:
         # color_index <-0.4,+2.0> 
         assert type(color_index) in (int, float)
         assert self.color_name in COLORS_FROM_START_INDEX
-        ci = float(color_index)
-        if (ci < -0.4): 
-            ci = -0.4 
-        if (ci > 2.0):
-            ci =  2.0
-        # R
-        if (( ci >= -0.40 ) and ( ci < 0.00 )):
-            t = (ci + 0.40) / (0.00 + 0.40)
-            r = 0.61 + (0.11 * t) + ( 0.1 * t * t)
-        elif ((ci >= 0.00 ) and ( ci < 0.40)):
-            t = (ci - 0.00) / (0.40 - 0.00)
-            r = 0.83 + (0.17 * t)
-        elif ((ci >= 0.40 ) and ( ci <= 2.10)):
-            t = (ci - 0.40) / (2.10 - 0.40)
-            r = 1.00
-        #G
-        if (( ci >= -0.40 ) and ( ci < 0.00 )):
-            t = (ci + 0.40) / (0.00 + 0.40)
-            g = 0.70 + (0.07 * t) + (0.1 * t * t )
-        elif (( ci >= 0.00) and ( ci < 0.40)):
-            t = (ci - 0.00) / (0.40 - 0.00)
-            g = 0.87 + (0.11 * t)
-        elif (( ci >= 0.40) and ( ci < 1.60)):
-            t = (ci - 0.40) / (1.60 - 0.40)
-            g = 0.98 - (0.16 * t)
-        elif (( ci >= 1.60 ) and ( ci <= 2.00)):
-            t = (ci - 1.60) / (2.00 - 1.60)
-            g = 0.82 - (0.5 * t * t)
-        # B     
-        if (( ci >= -0.40) and ( ci < 0.40)):
-            t = (ci + 0.40) /(0.40 + 0.40)
-            b = 1.00
-        elif (( ci >= 0.40) and ( ci <1.50)):
-            t = (ci - 0.40) / (1.50 - 0.40)
-            b = 1.00 - (0.47 * t) + (0.1 * t * t )
-        elif (( ci >= 1.50) and ( ci <=1.94)):
-            t = (ci - 1.50) / (1.94 - 1.50)
-            b = 0.63 - (0.6 * t * t )
-        else:
-            b = 0
-        #return (r, g, b)
-        
-        if self.color_name == COLOR_RANDOM_COLOR_INDEX:        
-            color = "#%02X%02X%02X"%(int(r*255),
-                                     int(g*255),
-                                     int(b*255))
-        elif self.color_name == COLOR_RANDOM_COLOR_INDEX_INVERTED:        
-            color = "#%02X%02X%02X"%(int(r*255) ^ 0xFF,
-                                     int(g*255) ^ 0xFF,
-                                     int(b*255) ^ 0xFF)
-        elif self.color_name == COLOR_RANDOM_COLOR_INDEX_INVERTED_LIGHT: 
-            v = []
-            for c in (r, g, b):
-                c = (int(r*255) ^ 0xFF)
-                c = int( 255 - ((255-c) * 0.3))
-                v.append(c)
+        rgb = get_star_color_index_rgb(self.color_name, numpy.array([float(color_index)]))
+        self.has_rgb = True
+        self.red   = int(rgb[0, 0])
+        self.green = int(rgb[0, 1])
+        self.blue  = int(rgb[0, 2])
+        self.alpha = 0xFF
 
-            color = "#%02X%02X%02X"%(tuple(v))
-        else:
-            raise Exception("Internal error")
-        self.set_rgb_val(color)
+def get_star_color_index_rgb(color_name, color_index):
+    # 8 bit RGB values (one row per star) for an array of star color indexes
+    # color_index <-0.4,+2.0> 
+    assert color_name in COLORS_FROM_START_INDEX
+    ci = numpy.clip(numpy.asarray(color_index, dtype = numpy.float64), -0.4, 2.0)
+    # R
+    r = numpy.select([( ci >= -0.40 ) & ( ci < 0.00 ),
+                      ( ci >= 0.00 ) & ( ci < 0.40),
+                      ],
+                     [0.61 + (0.11 * ((ci + 0.40) / (0.00 + 0.40))) + ( 0.1 * ((ci + 0.40) / (0.00 + 0.40)) * ((ci + 0.40) / (0.00 + 0.40))),
+                      0.83 + (0.17 * ((ci - 0.00) / (0.40 - 0.00))),
+                      ],
+                     1.00)
+    # G
+    g = numpy.select([( ci >= -0.40 ) & ( ci < 0.00 ),
+                      ( ci >= 0.00) & ( ci < 0.40),
+                      ( ci >= 0.40) & ( ci < 1.60),
+                      ],
+                     [0.70 + (0.07 * ((ci + 0.40) / (0.00 + 0.40))) + (0.1 * ((ci + 0.40) / (0.00 + 0.40)) * ((ci + 0.40) / (0.00 + 0.40)) ),
+                      0.87 + (0.11 * ((ci - 0.00) / (0.40 - 0.00))),
+                      0.98 - (0.16 * ((ci - 0.40) / (1.60 - 0.40))),
+                      ],
+                     0.82 - (0.5 * ((ci - 1.60) / (2.00 - 1.60)) * ((ci - 1.60) / (2.00 - 1.60))))
+    # B     
+    b = numpy.select([( ci >= -0.40) & ( ci < 0.40),
+                      ( ci >= 0.40) & ( ci <1.50),
+                      ( ci >= 1.50) & ( ci <=1.94),
+                      ],
+                     [1.00,
+                      1.00 - (0.47 * ((ci - 0.40) / (1.50 - 0.40))) + (0.1 * ((ci - 0.40) / (1.50 - 0.40)) * ((ci - 0.40) / (1.50 - 0.40)) ),
+                      0.63 - (0.6 * ((ci - 1.50) / (1.94 - 1.50)) * ((ci - 1.50) / (1.94 - 1.50)) ),
+                      ],
+                     0)
     
+    rgb = numpy.stack([(r*255).astype(numpy.int64), 
+                       (g*255).astype(numpy.int64), 
+                       (b*255).astype(numpy.int64)], axis = 1)
+    if color_name == COLOR_RANDOM_COLOR_INDEX:        
+        return rgb
+    elif color_name == COLOR_RANDOM_COLOR_INDEX_INVERTED:        
+        return rgb ^ 0xFF
+    elif color_name == COLOR_RANDOM_COLOR_INDEX_INVERTED_LIGHT: 
+        # all the channels come out of the red one, keep it that way so older charts look the same
+        c = rgb[:, 0] ^ 0xFF
+        c = (255 - ((255-c) * 0.3)).astype(numpy.int64)
+        return numpy.stack([c, c, c], axis = 1)
+    raise Exception("Internal error")
+
+def color_from_packed_rgba(rgba):
+    return Color("#%08X"%(rgba, ))
@@ -4,8 +4,12 @@ import collections
 import random
 from .log_stuff import init_logger
 from .constellation_algorithms.algorithms import KNOWN_ALGORITHMS
+from .constellation_algorithms.delaunay import DELAUNAY_TRIANGULATION_COPIES, KNOWN_DELAUNAY_TRIANGULATIONS
 from .constellations_common import KNOWN_NAME_DISPLAY_STYLES
 from .color import Color, COLOR_RANDOM_COLOR_INDEX
+from .stars import KNOWN_STAR_RNGS, STAR_RNG_LEGACY
+from .renderers import KNOWN_RENDERERS, RENDERER_VALIDATED, KNOWN_LAYERS, DEFAULT_COMPRESSION_LEVEL, KNOWN_STAR_PATHS, STAR_PATHS_OFF, \
+                       KNOWN_LOD_MODES, LOD_MODE_DROP
 import svgwrite
 
 log = init_logger()
@@ -78,6 +82,17 @@ class ConfigFile:
             v = int(v)
         return v
     
+    def _read_precision(self, config, section, option, fallback):
+        v = config.get(section, option, fallback = None)
+        if v == None:
+            return fallback
+        v = v.strip().lower()
+        if v == "full":
+            return None
+        v = int(v)
+        assert v >= 0, "%s.%s must be 'full' or >= 0, not %i"%(section, option, v)
+        return v
+    
     def _read_file_none(self, config, section, option):
         v = config.get(section, option).strip().lower()
         if v == "none":
@@ -98,12 +113,67 @@ class ConfigFile:
         self.add_globular_clusters = config.getboolean("main", "add_globular_clusters")
         self.add_constellations = config.getboolean("main", "add_constellations")
         self.add_neighbor_quadrants = config.getboolean("main", "add_neighbor_quadrants")
+        # neighbor_band, None for the whole neighbor quadrants, "auto" to derive it from the constellations
+        neighbor_band = config.get("main", "neighbor_band", fallback = "full").strip().lower()
+        if neighbor_band == "full":
+            self.neighbor_band = None
+        elif neighbor_band == "auto":
+            self.neighbor_band = neighbor_band
+        else:
+            self.neighbor_band = float(neighbor_band)
+            assert self.neighbor_band >= 0, "main.neighbor_band must be 'full', 'auto' or >= 0, not %s"%(neighbor_band,)
+        
+        # output parameters
+        # output_renderer
+        self.output_renderer = config.get("output", "renderer", fallback = RENDERER_VALIDATED).strip()
+        assert self.output_renderer in KNOWN_RENDERERS, "Invalid value for output.renderer: %s. Valid: %s"%(self.output_renderer, ", ".join(KNOWN_RENDERERS))
+        # output_precision, number of decimals per layer, None for full precision
+        precision = self._read_precision(config, "output", "precision", None)
+        self.output_precision = {}
+        for layer in KNOWN_LAYERS:
+            self.output_precision[layer] = self._read_precision(config, "output", "%s_precision"%(layer, ), precision)
+        # output_minify
+        self.output_minify = config.getboolean("output", "minify", fallback = False)
+        # output_dso_glyphs
+        self.output_dso_glyphs = config.getboolean("output", "dso_glyphs", fallback = False)
+        # output_star_size_classes, 0 to draw every star with its own size
+        self.output_star_size_classes = config.getint("output", "star_size_classes", fallback = 0)
+        assert self.output_star_size_classes >= 0, "output.star_size_classes must be >= 0, not %i"%(self.output_star_size_classes,)
+        # output_star_paths
+        self.output_star_paths = config.get("output", "star_paths", fallback = STAR_PATHS_OFF).strip().lower()
+        assert self.output_star_paths in KNOWN_STAR_PATHS, "Invalid value for output.star_paths: %s. Valid: %s"%(self.output_star_paths, ", ".join(KNOWN_STAR_PATHS))
+        assert self.output_star_paths == STAR_PATHS_OFF or self.output_star_size_classes > 0, "output.star_paths requires output.star_size_classes > 0"
+        # output_constellation_paths
+        self.output_constellation_paths = config.getboolean("output", "constellation_paths", fallback = False)
+        # output_clip_to_box
+        self.output_clip_to_box = config.getboolean("output", "clip_to_box", fallback = False)
+        # output_lod_resolution, DPI, 0 to draw every star
+        self.output_lod_resolution = config.getint("output", "lod_resolution", fallback = 0)
+        assert self.output_lod_resolution >= 0, "output.lod_resolution must be >= 0, not %i"%(self.output_lod_resolution,)
+        # output_lod_min_diameter, in pixels
+        self.output_lod_min_diameter = config.getfloat("output", "lod_min_diameter", fallback = 1.0)
+        assert self.output_lod_min_diameter > 0, "output.lod_min_diameter must be > 0, not %s"%(self.output_lod_min_diameter,)
+        # output_lod_mode
+        self.output_lod_mode = config.get("output", "lod_mode", fallback = LOD_MODE_DROP).strip().lower()
+        assert self.output_lod_mode in KNOWN_LOD_MODES, "Invalid value for output.lod_mode: %s. Valid: %s"%(self.output_lod_mode, ", ".join(KNOWN_LOD_MODES))
+        # output_ladder, star count of the first extra chart, 0 for no extra charts
+        self.output_ladder = config.getint("output", "ladder", fallback = 0)
+        assert self.output_ladder >= 0, "output.ladder must be >= 0, not %i"%(self.output_ladder,)
+        # output_ladder_steps
+        self.output_ladder_steps = config.getint("output", "ladder_steps", fallback = 3)
+        assert self.output_ladder_steps >= 1, "output.ladder_steps must be >= 1, not %i"%(self.output_ladder_steps,)
+        # output_compression_level, for svgz files
+        self.output_compression_level = config.getint("output", "compression_level", fallback = DEFAULT_COMPRESSION_LEVEL)
+        assert 1 <= self.output_compression_level <= 9, "output.compression_level must be in the range 1 to 9, not %i"%(self.output_compression_level,)
         
         # Star parameters
         # star_count
         self.star_count = config.getint("star", "count")
         # star_color
         self.star_color = Color(config.get("star", "color").strip())
+        # star_color_index_resolution
+        self.star_color_index_resolution = config.getint("star", "color_index_resolution", fallback = 0)
+        assert self.star_color_index_resolution == 0 or self.star_color_index_resolution >= 2, "star.color_index_resolution must be 0 or >= 2, not %i"%(self.star_color_index_resolution,)
         # star_size_distribution_power
         self.star_size_distribution_power = config.getfloat("star", "size_distribution_power")
         assert self.star_size_distribution_power >= 1.0, "star.size_distribution_power must be >= 1.0, not %i"%(self.star_size_distribution_power,)
@@ -115,6 +185,9 @@ class ConfigFile:
         self.star_size_range.sort()
         #star_random_seed
         self.star_random_seed = self._read_int_none(config, "star", "random_seed")
+        #star_rng
+        self.star_rng = config.get("star", "rng", fallback = STAR_RNG_LEGACY).strip()
+        assert self.star_rng in KNOWN_STAR_RNGS, "Invalid value for star.rng: %s. Valid: %s"%(self.star_rng, ", ".join(KNOWN_STAR_RNGS))
         
         # box parameters
         # box_size
@@ -139,6 +212,9 @@ class ConfigFile:
             # algorithm
             self.constellation_algorithm = config.get("constellation", "algorithm").strip()
             assert self.constellation_algorithm in KNOWN_ALGORITHMS, "Invalid value for constellation.algorithm: %s. Valid: %s"%(self.constellation_algorithm, ", ".join(KNOWN_ALGORITHMS))
+            # delaunay_triangulation
+            self.constellation_delaunay_triangulation = config.get("constellation", "delaunay_triangulation", fallback = DELAUNAY_TRIANGULATION_COPIES).strip()
+            assert self.constellation_delaunay_triangulation in KNOWN_DELAUNAY_TRIANGULATIONS, "Invalid value for constellation.delaunay_triangulation: %s. Valid: %s"%(self.constellation_delaunay_triangulation, ", ".join(KNOWN_DELAUNAY_TRIANGULATIONS))
             # name_display_style
             self.constellation_name_display_style = name = config.get("constellation", "name_display_style").strip()
             assert self.constellation_name_display_style in KNOWN_NAME_DISPLAY_STYLES, "Invalid value for constellation.name_display_style: %s. Valid: %s"%(self.constellation_name_display_style, ", ".join(KNOWN_NAME_DISPLAY_STYLES))
@@ -148,6 +224,7 @@ class ConfigFile:
                 self.constellation_name_random_seed = self._read_int_none(config, "constellation", "name_random_seed")
                 self.constellation_name_font = Font(config, alias = config.get("constellation", "name_font"))
                 self.constellation_name_custom_source = self._read_file_none(config, "constellation", "name_custom_source")
+                self.constellation_name_unique_across_charts = config.getboolean("constellation", "name_unique_across_charts", fallback = False)
             
         # grid parameters
         if self.add_grid:
@@ -1,10 +1,10 @@
 from ..log_stuff import init_logger
-from ..constellations_common import Constellation, get_distances_to_stars, get_random_star
+from ..constellations_common import Constellation, AvailableStars, get_star_index
 import random
 
 log = init_logger()
 
-def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
+def get_constellations(config, star_table, sorted_master_rows, quadrants, **kwargs):
         
     # Determine the number of stars to use per constellation
     star_counts = []
@@ -15,13 +15,16 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         star_counts.append(star_count)
     
     total_star_count = sum(star_counts)
-    selected_master_stars = sorted_master_stars[-total_star_count:]
+    selected_master_rows = sorted_master_rows[-total_star_count:]
     
     # Add all child stars into the mix
-    selected_all_stars = []
-    for ms in selected_master_stars:
-        selected_all_stars.append(ms)
-        selected_all_stars.extend(ms.childs)
+    selected_all_rows = []
+    for master_row in selected_master_rows:
+        selected_all_rows.append(int(master_row))
+        selected_all_rows.extend(star_table.get_child_rows(master_row))
+    
+    star_index = get_star_index(star_table, selected_all_rows)
+    available_stars = AvailableStars(star_table, selected_all_rows)
     
     constellations = []
     # fun beggins here
@@ -29,27 +32,26 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         log.info("Doing constellation %i with %i stars"%(const_num, star_counts[const_num]))
         
         # pick a random star to start with
-        base_star = get_random_star(selected_all_stars, must_be_master = True)
-        if base_star == None:
+        base_row = available_stars.get_random_star(must_be_master = True)
+        if base_row == None:
             break
-        log.debug("base star: %s"%(base_star,))
-        constellation = Constellation(quadrants = quadrants, name_display_style = config.constellation_name_display_style)
+        log.debug("base star: %s"%(star_table.get_star(base_row),))
+        constellation = Constellation(star_table = star_table, quadrants = quadrants, name_display_style = config.constellation_name_display_style)
         constellations.append(constellation)
-        constellation.add_star(base_star)
+        constellation.add_star(base_row)
         
-        last_star = base_star
-        while len(constellation.stars) < star_counts[const_num]:
+        last_row = base_row
+        while len(constellation.star_rows) < star_counts[const_num]:
             # Calculate the distances to the rest of stars
-            distances = get_distances_to_stars(last_star, selected_all_stars, skip_taken_stars = True)
-            assert len(distances) > 0, "failed to find any non-taken star"
-            d_keys = list(distances.keys())
-            d_keys.sort()
-            star = random.choice(distances[d_keys[0]])
+            # Find the nearest stars to the last one
+            min_distance, nearest_rows = star_index.get_nearest(star_table.w[last_row], star_table.h[last_row], skip_taken = True, exclude_row = last_row)
+            assert len(nearest_rows) > 0, "failed to find any non-taken star"
+            row = random.choice(nearest_rows)
             
-            star.take()
-            log.debug("star %i: %s"%(len(constellation.stars), star))
+            star_table.take(row)
+            log.debug("star %i: %s"%(len(constellation.star_rows), star_table.get_star(row)))
             
-            constellation.add_star(star)
-            last_star = star
+            constellation.add_star(row)
+            last_row = row
     
     return constellations
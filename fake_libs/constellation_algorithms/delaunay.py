@@ -4,16 +4,24 @@ from ..constellations_common import *
 import math
 import operator
 import random
+import numpy
 from scipy.spatial import Delaunay
 
 add_debug_colors = False
-debug_color_index = 0
 
 log = init_logger()
 
-def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
-    global debug_color_index
-    global nodes
+# copies: the selected master stars and all their child stars are triangulated
+# periodic: only the master stars and the copies in a thin margin around the box are triangulated,
+#           the neighbors of every master star (and their quadrant offsets) are applied to all its copies
+DELAUNAY_TRIANGULATION_COPIES = "copies"
+DELAUNAY_TRIANGULATION_PERIODIC = "periodic"
+KNOWN_DELAUNAY_TRIANGULATIONS = (DELAUNAY_TRIANGULATION_COPIES,
+                                 DELAUNAY_TRIANGULATION_PERIODIC,
+                                )
+
+def get_constellations(config, star_table, sorted_master_rows, quadrants, **kwargs):
+    debug_color_index = 0
         
     # Determine the number of stars to use per constellation
     star_counts = []
@@ -24,65 +32,25 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         star_counts.append(star_count)
 
     total_star_count = sum(star_counts)
-    selected_master_stars = sorted_master_stars[-total_star_count:]
+    selected_master_rows = sorted_master_rows[-total_star_count:]
     
     # Add all child stars into the mix
-    all_stars_dict = {}
-    all_available_stars = []
-    for ms in selected_master_stars:
-        all_available_stars.append(ms)
-        all_available_stars.extend(ms.childs)
-        
-    for star in all_available_stars:
-        all_stars_dict[star.id] = star
+    all_available_rows = []
+    for master_row in selected_master_rows:
+        all_available_rows.append(int(master_row))
+        all_available_rows.extend(star_table.get_child_rows(master_row))
         
     if add_debug_colors:
-        for star in all_available_stars:
-            star.color.set_rgb_val("#00FF00FF")
-            star.size = config.star_size_range[1]
+        star_table.palette_id[all_available_rows] = star_table.palette.add_color(Color("#00FF00FF"))
+        star_table.size[all_available_rows] = config.star_size_range[1]
     
-    available_stars = all_available_stars
-    
-    points_dict = {}
-    for star in available_stars:
-        c = (star.w, star.h)
-        points_dict[c] = star
-        #star.take()
-        
-    points = list(points_dict.keys())
-        
-    tri = Delaunay(points)
-    
-    # Draw the debug constellation with the full array of lines
-    #debug_constellation = Constellation(quadrants = quadrants, name_display_style = config.constellation_name_display_style)
-    #for star in available_stars:
-    #    debug_constellation.add_star(star)
-    #for triangle in tri.simplices:
-    #    star_ids = []
-    #    for index in triangle:
-    #        star_ids.append(points_dict[points[index]].id)
-    #    debug_constellation.draw_segment(star_ids, is_closed = True)
-    #    #debug_constellation.set_as_debug_constellation()
+    available_stars = AvailableStars(star_table, all_available_rows)
     
     # Create a map of the valid transitions
-    nodes = {}
-    
-    for star in available_stars:
-        nodes[star.id] = Node(star)
-    
-    for triangle in tri.simplices:
-        star_ids = []
-        for index in triangle:
-            star_ids.append(points_dict[points[index]].id)
-        for src_star_id, dst_star_ids in ( (star_ids[0], (star_ids[1], star_ids[2])),
-                                        (star_ids[1], (star_ids[2], star_ids[0])),
-                                        (star_ids[2], (star_ids[0], star_ids[1]))
-                                       ):
-            src_star = all_stars_dict[src_star_id]
-            dst_stars = [all_stars_dict[dsid] for dsid in dst_star_ids]
-            node = nodes[src_star.id]
-            for dst_star in dst_stars:
-                node.add_valid_node(nodes[dst_star.id])
+    if config.constellation_delaunay_triangulation == DELAUNAY_TRIANGULATION_PERIODIC:
+        graph = _get_periodic_graph(config, star_table, selected_master_rows, all_available_rows)
+    else:
+        graph = _get_graph(star_table, all_available_rows)
     
     constellations = []
     # fun beggins here
@@ -92,17 +60,14 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
     pending_lone_star = None
     
     #    sqrt(A/(N*p)
-    max_dist_takeover_stars = 2 * math.sqrt( (config.box_size.width * config.box_size.height) / (len(selected_master_stars) * math.pi) ) * (0.2 + random.random() * 0.2 )
+    max_dist_takeover_stars = 2 * math.sqrt( (config.box_size.width * config.box_size.height) / (len(selected_master_rows) * math.pi) ) * (0.2 + random.random() * 0.2 )
 #    print (max_dist_takeover_stars)
     
     while True:
         if pending_lone_star == None:
             const_num += 1
             
-            # Filter out taken stars
-            available_stars = get_available_stars(available_stars)
-            
-            master_av_stars = count_available_master_stars(available_stars)
+            master_av_stars = available_stars.count_masters()
             
             log.info("Creating constellation %i out of %i possible stars"%(const_num, master_av_stars))
             
@@ -115,46 +80,32 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
             # need to make sure the proper copy of the star is added to the proper constellation, otherwise 
             # weird things happen
             # The easiest way to do that is to compare only against stars which have been assigned to a constellation
-            assigned_stars = []
-            for star in all_available_stars:
-                if star.taken and star.constellation != None:
-                    assigned_stars.append(star)
-            
             star_copies_to_assing = None
             if pending_lone_star != None:
-                log.info("Looking for nearby costellation for lone star %s"%(pending_lone_star,))
-                star_copies_to_assing = []
-                star_copies_to_assing.append(pending_lone_star.master_star)
-                star_copies_to_assing.extend(pending_lone_star.master_star.childs)
+                log.info("Looking for nearby costellation for lone star %s"%(star_table.get_star(pending_lone_star),))
+                star_copies_to_assing = star_table.get_peer_rows(pending_lone_star)
             else:
-                log.info("Looking for nearby constellation for last standing star %s"%(available_stars[0].master_star,))
-                star_copies_to_assing = available_stars
+                star_copies_to_assing = available_stars.get_rows().tolist()
+                log.info("Looking for nearby constellation for last standing star %s"%(star_table.get_star(star_table.master[star_copies_to_assing[0]]),))
             
             min_d = None
             min_const = None
-            min_star = None
-            for star in star_copies_to_assing:
+            min_row = None
+            for row in star_copies_to_assing:
                 # Need to compare only against which have a valid constellation assigned
-                all_neighbor_stars = [node.star for node in nodes[star.id].valid_nodes()]
-                valid_neighbor_stars = []
-                for ns in all_neighbor_stars:
-                    if ns.taken and ns.constellation != None:
-                        valid_neighbor_stars.append(ns)
-                if len(valid_neighbor_stars) == 0: continue
-                #print (valid_neighbor_stars)
-                #print([s.master_star.id for s in valid_neighbor_stars])
-                #print(star.id)
-                d = get_distances_to_stars(star, valid_neighbor_stars, skip_taken_stars = False)
-                #print (d)
-                d_keys = list(d.keys())
-                d_keys.sort()
-                if min_d == None or d_keys[0] < min_d:
-                    min_d = d_keys[0]
-                    min_const = d[d_keys[0]][0].constellation
-                    min_star = star
+                valid_neighbor_rows = []
+                for neighbor_row in graph.valid_rows(row):
+                    if star_table.is_taken(neighbor_row) and star_table.get_constellation(neighbor_row) != None:
+                        valid_neighbor_rows.append(neighbor_row)
+                if len(valid_neighbor_rows) == 0: continue
+                d, nearest_rows = get_nearest_stars(star_table, row, valid_neighbor_rows, skip_taken_stars = False)
+                if min_d == None or d < min_d:
+                    min_d = d
+                    min_const = star_table.get_constellation(nearest_rows[0])
+                    min_row = row
             
-            min_star.take()
-            min_const.add_star(min_star)
+            star_table.take(min_row)
+            min_const.add_star(min_row)
             
             if pending_lone_star != None:
                 pending_lone_star = None
@@ -163,10 +114,10 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
                 break
                 
         # pick a random star to start with
-        base_star = get_random_star(available_stars, must_be_master = True)
-        log.debug("base star: %s"%(base_star,))
-        constellation = Constellation(quadrants = quadrants, name_display_style = config.constellation_name_display_style)
-        constellation.add_star(base_star)
+        base_row = available_stars.get_random_star(must_be_master = True)
+        log.debug("base star: %s"%(star_table.get_star(base_row),))
+        constellation = Constellation(star_table = star_table, quadrants = quadrants, name_display_style = config.constellation_name_display_style)
+        constellation.add_star(base_row)
         
         if add_debug_colors:
             constellation.custom_color = Color(debug_colors[debug_color_index])
@@ -174,20 +125,16 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         
         tgt_star_count = random.randint(config.constellation_star_count_range[0], config.constellation_star_count_range[1])
         
-        while len(constellation.stars) < tgt_star_count:
+        while len(constellation.star_rows) < tgt_star_count:
             min_dist = None
             min_dist_star = None
             # Calculate the distances from every star on the constellation to any neighbor star of those stars
-            for star in constellation.stars:
-                neighbor_stars = [node.star for node in nodes[star.id].valid_nodes()]
-                distances = get_distances_to_stars(star, neighbor_stars, skip_taken_stars = True)
-            
-                d_keys = list(distances.keys())
-                if len(d_keys) == 0:
+            for row in constellation.star_rows:
+                neighbor_rows = graph.valid_rows(row)
+                local_min_dist, nearest_rows = get_nearest_stars(star_table, row, neighbor_rows, skip_taken_stars = True)
+                if len(nearest_rows) == 0:
                     break
-                d_keys.sort()
-                local_min_dist = d_keys[0]
-                local_min_dist_star = random.choice(distances[local_min_dist])
+                local_min_dist_star = random.choice(nearest_rows)
                 
                 if min_dist == None or local_min_dist < min_dist:
                     min_dist = local_min_dist
@@ -197,12 +144,12 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
             if min_dist == None:
                 break
             
-            min_dist_star.take()
-            log.debug("star %i: %s"%(len(constellation.stars), min_dist_star))
+            star_table.take(min_dist_star)
+            log.debug("star %i: %s"%(len(constellation.star_rows), star_table.get_star(min_dist_star)))
             
             constellation.add_star(min_dist_star)
 
-        if len(constellation.stars) > 1:
+        if len(constellation.star_rows) > 1:
             # Now, we need to append any nearby stars which is not taken yet
             #segment_sizes = {}
             #for star in constellation.stars:
@@ -223,22 +170,21 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
             while True:
                 taken_stars = 0
     #            for star in constellation.stars:
-                stars = []
-                stars.extend(constellation.stars)
-                #print(len(stars))
-                for star in stars:
-                    #print("star %s has %i nodes"%(star.id, len(nodes[star.id].nodes)))
-                    for node in nodes[star.id].valid_nodes():
+                rows = []
+                rows.extend(constellation.star_rows)
+                #print(len(rows))
+                for row in rows:
+                    #print("star %s has %i nodes"%(row, len(nodes[row].nodes)))
+                    for neighbor_row, segment_size in zip(*graph.valid_edges(row)):
                         # If this valid node goes outside of this constellation
-                        if node.id in constellation.star_dict:
+                        if constellation.has_star(neighbor_row):
                             continue
-                        if node.star.taken:
+                        if star_table.is_taken(neighbor_row):
                             continue
-                        segment_size = get_distance_star_to_star(star, node.star)
                         if segment_size < max_dist_takeover_stars:
-                            node.star.take()
-                            #print("Taking star %s"%(node_star.id))
-                            constellation.add_star(node.star)
+                            star_table.take(neighbor_row)
+                            #print("Taking star %s"%(neighbor_row))
+                            constellation.add_star(neighbor_row)
                             taken_stars += 1
                 #print(taken_stars)
                 if taken_stars == 0:
@@ -247,32 +193,31 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         
             constellations.append(constellation)
         else:
-            star = constellation.stars[0]
-            log.warning("No stars to connect to %s, assigning to nearest constellation"%(star,))
-            star.untake()
+            row = constellation.star_rows[0]
+            log.warning("No stars to connect to %s, assigning to nearest constellation"%(star_table.get_star(row),))
+            star_table.untake(row)
             const_num -= 1
-            pending_lone_star = star
+            pending_lone_star = row
         
 
     ### Draw constellations
         
     # for the time being draw all the valid connections
-    _add_2_connections_per_node(constellations)
+    _add_2_connections_per_node(graph, constellations)
         # loop # 2, make sure all stars are connected to each other
     
-    _remove_triple_connections_per_node(constellations)
+    _remove_triple_connections_per_node(graph, constellations)
         # some stuff may be missing here
     
-    _connect_all_stars(constellations)
+    _connect_all_stars(graph, constellations)
     
     # Finally, draw all the connected segments
     for constellation in constellations:
         log.debug("Drawing constellation %s"%(constellation,))
         drawn_segments = []
-        for star in constellation.stars:
-            node = nodes[star.id]
-            for remote_node in node.connected_nodes():
-                segment_ids = [node.id, remote_node.id]
+        for row in constellation.star_rows:
+            for remote_row in graph.connected_rows(row):
+                segment_ids = [row, remote_row]
                 segment_ids.sort()
                 segment_id = "%s_%s"%(tuple(segment_ids))
                 if segment_id not in drawn_segments:
@@ -281,84 +226,116 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
     
     return constellations
 
-def _connect_all_stars(constellations):
-    global discovered_node_ids
+def _get_graph(star_table, rows):
+    # Triangulation of the stars and all their copies
+    rows = numpy.asarray(rows, dtype = numpy.int64)
+    points = numpy.column_stack((star_table.w[rows].astype(numpy.float64), star_table.h[rows].astype(numpy.float64)))
+    tri = Delaunay(points)
+    log.info("Delaunay triangulation of %i stars"%(len(points), ))
+    
+    # every triangle links each of its stars to the other two
+    simplices = tri.simplices
+    pairs = [rows[simplices[:, [src, dst]]] for src, dst in ((0, 1), (0, 2), (1, 2), (1, 0), (2, 0), (2, 1))]
+    pairs = numpy.stack(pairs, axis = 1).reshape(-1, 2)
+    graph = _StarGraph(star_table, rows, pairs)
+    if len(tri.coplanar) == 0:
+        return graph
+    
+    # Stars at the same position as another one are left out of the triangulation, they get the
+    # neighbors of that one
+    coplanar_pairs = []
+    for index, simplex, vertex in tri.coplanar.tolist():
+        coplanar_pairs.extend([(rows[index], neighbor_row) for neighbor_row in graph.valid_rows(rows[vertex]) if neighbor_row != rows[index]])
+    return _StarGraph(star_table, rows, numpy.concatenate((pairs, numpy.array(coplanar_pairs, dtype = numpy.int64).reshape(-1, 2))))
+
+def _get_periodic_graph(config, star_table, master_rows, rows):
+    # Periodic triangulation of the master stars. The chart wraps around, so the master stars are
+    # triangulated together with their copies in a margin around the box, and every edge of a master
+    # star is kept as (neighbor master star, quadrant offset). Then every row is linked to the copy
+    # of each neighbor in the quadrant at that offset from its own, when that copy is in rows.
+    master_rows = numpy.asarray(master_rows, dtype = numpy.int64)
+    neighbors = get_periodic_delaunay_neighbors(config, star_table, master_rows)
+    
+    master_indexes = dict([(master_row, index) for index, master_row in enumerate(master_rows.tolist())])
+    copy_rows = {}
+    row_positions = []
+    for row in rows:
+        quadrant = star_table.get_quadrant(row)
+        x, y = (0, 0) if quadrant == None else (quadrant.x, quadrant.y)
+        index = master_indexes[int(star_table.master[row])]
+        copy_rows[(index, x, y)] = row
+        row_positions.append((row, index, x, y))
+    
+    pairs = []
+    for row, index, x, y in row_positions:
+        for neighbor, dx, dy in neighbors[index]:
+            remote_row = copy_rows.get((neighbor, x + dx, y + dy))
+            if remote_row != None:
+                pairs.append((row, remote_row))
+    return _StarGraph(star_table, rows, numpy.array(pairs, dtype = numpy.int64).reshape(-1, 2))
+
+def _connect_all_stars(graph, constellations):
+    # Joins the connected groups of stars of every constellation, shortest valid segments first
     for constellation in constellations:
-        base_node = nodes[constellation.stars[0].id]
-        while True:
-            discovered_node_ids = []
-            _discover_connected_nodes(base_node)
-            if len(discovered_node_ids) == len(constellation.stars):
-                log.debug("All nodes are connected for %s"%(constellation,))
-                break
-            else:
-                log.debug("%i nodes are still not connected for constellation %s"%(-len(discovered_node_ids) + len(constellation.stars), 
-                                                                                   constellation))
-                disconnected_nodes = []
-                # Make a list if disconnected nodes
-                for star in constellation.stars:
-                    if star.id not in discovered_node_ids:
-                        disconnected_nodes.append(nodes[star.id])
-                
-                # need to make one connection from the disconnected to the connected group
-                connection_made = False
-                for discovered_node_id in discovered_node_ids:
-                    discovered_node = nodes[discovered_node_id]
-                    for disconnected_node in disconnected_nodes:
-                        if discovered_node.is_valid_node(disconnected_node):
-                            discovered_node.connect_to(disconnected_node)
-                            connection_made = True
-                            break
-                    if connection_made:
-                        break
+        star_rows = constellation.star_rows
+        star_indexes = dict([(row, index) for index, row in enumerate(star_rows)])
+        groups = DisjointSets(len(star_rows))
+        edges = graph.get_edges_between(star_rows)
+        src_rows = graph.rows[graph.get_source_vertices(edges)].tolist()
+        dst_rows = graph.rows[graph.indices[edges]].tolist()
+        for src_row, dst_row, connected in zip(src_rows, dst_rows, (graph.connections[edges] != 0).tolist()):
+            if connected:
+                groups.union(star_indexes[src_row], star_indexes[dst_row])
+        if groups.count == 1:
+            log.debug("All nodes are connected for %s"%(constellation,))
+            continue
+        
+        log.debug("%i groups of nodes are not connected for constellation %s"%(groups.count, constellation))
+        for edge in numpy.argsort(graph.lengths[edges], kind = "stable").tolist():
+            if groups.union(star_indexes[src_rows[edge]], star_indexes[dst_rows[edge]]):
+                graph.connect(src_rows[edge], dst_rows[edge])
+                if groups.count == 1:
+                    break
+        if groups.count > 1:
+            log.warning("%i groups of stars can't be connected for constellation %s"%(groups.count, constellation))
             
-def _discover_connected_nodes(node):
-    global discovered_node_ids
-    if node.id in discovered_node_ids: 
-        return
-    discovered_node_ids.append(node.id)
-    for child in node.connected_nodes():
-        _discover_connected_nodes(child)
-
-def _remove_triple_connections_per_node(constellations):
+def _remove_triple_connections_per_node(graph, constellations):
     for constellation in constellations:
         # Finally, remove triple connections (which happen from both sides)
-        for star in constellation.stars:
-            node = nodes[star.id]
-            remote_nodes = node.connected_nodes()
+        for row in constellation.star_rows:
+            remote_rows = graph.connected_rows(row)
 
             index = 0
-            while node.count_connected_nodes() > 2 and index < len(remote_nodes):
-                remote_node = remote_nodes[index]
-                if remote_node.count_connected_nodes() > 2:
-                    node.disconnect_from(remote_node)
+            while graph.count_connected(row) > 2 and index < len(remote_rows):
+                remote_row = remote_rows[index]
+                if graph.count_connected(remote_row) > 2:
+                    graph.disconnect(row, remote_row)
                 index += 1
                 
-def _add_2_connections_per_node(constellations):
+def _add_2_connections_per_node(graph, constellations):
     for constellation in constellations:
-        log.debug("loop 1 for constellation %s (which contains stars %s)"%(constellation, ", ".join(str(star.id) for star in constellation.stars)))
+        log.debug("loop 1 for constellation %s (which contains stars %s)"%(constellation, ", ".join(str(row) for row in constellation.star_rows)))
         # loop 1. Make sure all stars have at least two connections        
-        for star in constellation.stars:
-            log.debug("Checking star %s"%(star.id, ))
+        for row in constellation.star_rows:
+            log.debug("Checking star %s"%(row, ))
             remote_nodes = {}
-            node = nodes[star.id]
 
             # previous stars in the loop may have been already connected to this node
-            if node.count_connected_nodes() < 2:
-                for remote_node in node.valid_nodes():
+            if graph.count_connected(row) < 2:
+                for remote_row in graph.valid_rows(row):
                     # If this valid node goes outside of this constellation
-                    if remote_node.id not in constellation.star_dict:
+                    if not constellation.has_star(remote_row):
                         continue
 
-                    if remote_node.count_connected_nodes() == 0:
-                        node.connect_to(remote_node)
+                    if graph.count_connected(remote_row) == 0:
+                        graph.connect(row, remote_row)
                     
                     # just in case we needed, keep a list of local nodes
-                    c = remote_node.count_connected_nodes()
+                    c = graph.count_connected(remote_row)
                     if c not in remote_nodes: remote_nodes[c] = []
-                    remote_nodes[c].append(remote_node)
+                    remote_nodes[c].append(remote_row)
                     
-                    if node.count_connected_nodes() >= 2:
+                    if graph.count_connected(row) >= 2:
                         break
 
             # Did not find a remote node with no connection
@@ -372,52 +349,116 @@ def _add_2_connections_per_node(constellations):
                 sorted_remote_nodes.extend(remote_nodes[c])
 
             index = 0
-            while node.count_connected_nodes() <= 2 and index < len(sorted_remote_nodes):
+            while graph.count_connected(row) <= 2 and index < len(sorted_remote_nodes):
                 # Then just chose a random node to connect to
-                remote_node = sorted_remote_nodes[index]
-                node.connect_to(remote_node)
+                remote_row = sorted_remote_nodes[index]
+                graph.connect(row, remote_row)
                 index += 1
 
 
 
-class Node:
-    def __init__(self, star):
-        self.star = star
-        self._valid_nodes = {}
-        self.id = self.star.id
-        self._connected_nodes = {}
+class _StarGraph:
+    # Adjacency of the triangulated stars in compressed sparse row (CSR) arrays: the neighbors of
+    # vertex v (the v-th row) are indices[indptr[v]:indptr[v + 1]], with the length of every edge in
+    # lengths. pairs are the (row, neighbor row) links in order, the neighbors of a star are kept in the
+    # order they were first linked, which decides what is tried first.
+    #
+    # Every edge is stored in both directions, twin is the index of the opposite one. The connections
+    # (drawn segments) are a number per edge, 0 when not connected, otherwise the order in which it
+    # was connected, so the connected neighbors of a star come in that order.
+    def __init__(self, star_table, rows, pairs):
+        self.rows = numpy.asarray(rows, dtype = numpy.int64)
+        vertex_count = len(self.rows)
+        self._vertex = numpy.full(star_table.count, -1, dtype = numpy.int64)
+        self._vertex[self.rows] = numpy.arange(vertex_count)
+        
+        pairs = self._vertex[numpy.asarray(pairs, dtype = numpy.int64).reshape(-1, 2)]
+        # a link goes both ways, only the first link of a pair of vertices counts
+        links = numpy.stack((pairs, pairs[:, ::-1]), axis = 1).reshape(-1, 2)
+        keys = links[:, 0] * vertex_count + links[:, 1]
+        first_links = numpy.sort(numpy.unique(keys, return_index = True)[1])
+        links = links[first_links]
+        links = links[numpy.argsort(links[:, 0], kind = "stable")]
+        
+        self.indptr = numpy.zeros(vertex_count + 1, dtype = numpy.int64)
+        self.indptr[1:] = numpy.cumsum(numpy.bincount(links[:, 0], minlength = vertex_count))
+        self.indices = links[:, 1]
+        src_rows = self.rows[links[:, 0]]
+        dst_rows = self.rows[self.indices]
+        self.lengths = numpy.sqrt((star_table.w[src_rows].astype(numpy.float64) - star_table.w[dst_rows].astype(numpy.float64))**2 + 
+                                  (star_table.h[src_rows].astype(numpy.float64) - star_table.h[dst_rows].astype(numpy.float64))**2)
+        keys = links[:, 0] * vertex_count + links[:, 1]
+        key_order = numpy.argsort(keys)
+        self.twin = key_order[numpy.searchsorted(keys, links[:, 1] * vertex_count + links[:, 0], sorter = key_order)]
+        
+        self.connections = numpy.zeros(len(links), dtype = numpy.int64)
+        self._connection_count = 0
     
-    def is_valid_node(self, node):
-        return node.id in self._valid_nodes
+    def get_edges_between(self, rows):
+        # index of the edges between the given rows, one per pair of stars (from the lower vertex)
+        vertices = self._vertex[numpy.asarray(rows, dtype = numpy.int64)]
+        vertices = vertices[vertices >= 0]
+        inside = numpy.zeros(len(self.rows), dtype = bool)
+        inside[vertices] = True
+        counts = self.indptr[vertices + 1] - self.indptr[vertices]
+        first_edges = numpy.repeat(self.indptr[vertices] - numpy.cumsum(counts) + counts, counts)
+        edges = first_edges + numpy.arange(counts.sum())
+        src = numpy.repeat(vertices, counts)
+        dst = self.indices[edges]
+        return edges[inside[dst] & (src < dst)]
     
-    def add_valid_node(self, node):
-        if node.id not in self._valid_nodes:
-            self._valid_nodes[node.id] = node
-            node.add_valid_node(self)
+    def get_source_vertices(self, edges):
+        return numpy.searchsorted(self.indptr, edges, side = "right") - 1
     
-    def disconnect_from(self, node):
-        assert node.id in self._valid_nodes
-        if node.id in self._connected_nodes:
-            log.debug("Disconnectin node %s from %s"%(self.id, node.id))
-            self._connected_nodes.pop(node.id)
-            node.disconnect_from(self)
-        #else:
-        #    log.warning("Node %s is already connected to node %s"%(self.id, node.id))
+    def _get_edges(self, row):
+        # range of the edges of row
+        vertex = self._vertex[row] if row < len(self._vertex) else -1
+        if vertex < 0:
+            return 0, 0
+        return self.indptr[vertex], self.indptr[vertex + 1]
     
-    def connect_to(self, node):
-        assert node.id in self._valid_nodes
-        if node.id not in self._connected_nodes:
-            log.debug("Connecting node %s to %s"%(self.id, node.id))
-            self._connected_nodes[node.id] = node
-            node.connect_to(self)
-        #else:
-        #    log.warning("Node %s is already connected to node %s"%(self.id, node.id))
+    def _get_edge(self, row, remote_row):
+        start, end = self._get_edges(row)
+        edges = numpy.flatnonzero(self.indices[start:end] == self._vertex[remote_row])
+        return None if len(edges) == 0 else start + edges[0]
     
-    def count_connected_nodes(self):
-        return len(self._connected_nodes)
-
-    def connected_nodes(self):
-        return list(self._connected_nodes.values())    
+    def valid_rows(self, row):
+        start, end = self._get_edges(row)
+        return self.rows[self.indices[start:end]].tolist()
+    
+    def valid_edges(self, row):
+        # neighbor rows and the length of the edges to them
+        start, end = self._get_edges(row)
+        return self.rows[self.indices[start:end]].tolist(), self.lengths[start:end].tolist()
+    
+    def is_valid(self, row, remote_row):
+        return self._get_edge(row, remote_row) != None
+    
+    def connect(self, row, remote_row):
+        edge = self._get_edge(row, remote_row)
+        assert edge != None
+        if self.connections[edge] == 0:
+            log.debug("Connecting node %s to %s"%(row, remote_row))
+            self._connection_count += 1
+            self.connections[edge] = self._connection_count
+            self.connections[self.twin[edge]] = self._connection_count
+    
+    def disconnect(self, row, remote_row):
+        edge = self._get_edge(row, remote_row)
+        assert edge != None
+        if self.connections[edge] != 0:
+            log.debug("Disconnectin node %s from %s"%(row, remote_row))
+            self.connections[edge] = 0
+            self.connections[self.twin[edge]] = 0
+    
+    def count_connected(self, row):
+        start, end = self._get_edges(row)
+        return int(numpy.count_nonzero(self.connections[start:end]))
     
-    def valid_nodes(self):
-        return list(self._valid_nodes.values())
\ No newline at end of file
+    def connected_rows(self, row):
+        # in the order they were connected
+        start, end = self._get_edges(row)
+        connections = self.connections[start:end]
+        edges = numpy.flatnonzero(connections)
+        edges = edges[numpy.argsort(connections[edges])]
+        return self.rows[self.indices[start + edges]].tolist()
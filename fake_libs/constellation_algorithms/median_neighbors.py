@@ -1,12 +1,11 @@
 from ..log_stuff import init_logger
-from ..constellations_common import Constellation, get_distances_to_stars, get_random_star
+from ..constellations_common import Constellation, AvailableStars, get_star_distances, get_star_index, NearestStarQueue
 import math
-import operator
 import random
 
 log = init_logger()
 
-def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
+def get_constellations(config, star_table, sorted_master_rows, quadrants, **kwargs):
         
     # Determine the number of stars to use per constellation
     star_counts = []
@@ -17,13 +16,16 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         star_counts.append(star_count)
 
     total_star_count = sum(star_counts)
-    selected_master_stars = sorted_master_stars[-total_star_count:]
+    selected_master_rows = sorted_master_rows[-total_star_count:]
     
     # Add all child stars into the mix
-    selected_all_stars = []
-    for ms in selected_master_stars:
-        selected_all_stars.append(ms)
-        selected_all_stars.extend(ms.childs)
+    selected_all_rows = []
+    for master_row in selected_master_rows:
+        selected_all_rows.append(int(master_row))
+        selected_all_rows.extend(star_table.get_child_rows(master_row))
+    
+    star_index = get_star_index(star_table, selected_all_rows)
+    available_stars = AvailableStars(star_table, selected_all_rows)
     
     constellations = []
     # fun beggins here
@@ -31,55 +33,50 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         log.info("Creating constellation %i"%(const_num,))
         
         # pick a random star to start with
-        base_star = get_random_star(selected_all_stars, must_be_master = True)
-        if base_star == None:
+        base_row = available_stars.get_random_star(must_be_master = True)
+        if base_row == None:
             break
-        log.debug("base star: %s"%(base_star,))
-        constellation = Constellation(quadrants = quadrants, name_display_style = config.constellation_name_display_style)
+        log.debug("base star: %s"%(star_table.get_star(base_row),))
+        constellation = Constellation(star_table = star_table, quadrants = quadrants, name_display_style = config.constellation_name_display_style)
         constellations.append(constellation)
-        constellation.add_star(base_star)
+        constellation.add_star(base_row)
         
-        while len(constellation.stars) < star_counts[const_num]:
-            # Calculate the distances to the rest of stars
-            distances = get_distances_to_stars(constellation, selected_all_stars, skip_taken_stars = True)
-            if len(distances) == 0:
+        nearest_queue = NearestStarQueue(star_table, selected_all_rows, *constellation.get_mean_position())
+        while len(constellation.star_rows) < star_counts[const_num]:
+            # Find the nearest stars to the mean center
+            min_distance, nearest_rows = nearest_queue.get_nearest()
+            if len(nearest_rows) == 0:
                 break
             
-            d_keys = list(distances.keys())
-            d_keys.sort()
-            star = random.choice(distances[d_keys[0]])
+            row = random.choice(nearest_rows)
             
-            star.take()
-            log.debug("star %i: %s"%(len(constellation.stars), star))
+            star_table.take(row)
+            log.debug("star %i: %s"%(len(constellation.star_rows), star_table.get_star(row)))
             
-            constellation.add_star(star)
+            constellation.add_star(row)
+            nearest_queue.move_center(*constellation.get_mean_position())
         
         # Now, check if there's stars close enough to the constellation as to also anex them
         # get the man distance of all the stars to the mean center
-        distances = get_distances_to_stars(constellation, constellation.stars, skip_taken_stars = False)
-        values = []
-        for d, stars in distances.items():
-            for i in range(0, len(stars)):
-                values.append(d)
+        values = get_star_distances(star_table, constellation, constellation.star_rows).tolist()
         avg_dist = sum(values) / len(values)
         
-        distances = get_distances_to_stars(constellation, selected_all_stars, skip_taken_stars = True)
-        for distance, star_list in distances.items():
-            if distance > avg_dist*2.2:
-                continue
-            for star in star_list:
-                star.take()
-                constellation.add_star(star)
+        center_w, center_h = constellation.get_mean_position()
+        rows, distances = star_index.query_radius(center_w, center_h, avg_dist*2.2, skip_taken = True)
+        for row in rows.tolist():
+            star_table.take(row)
+            constellation.add_star(row)
                 
     
         # now, lets sort the stars by angle from the mean center
         center_w, center_h = constellation.get_mean_position()
         
-        for star in constellation.stars:
-            angle = 360*math.atan2(star.h - center_h, star.w - center_w)/(2*math.pi)
-            star.tag = angle
+        angles = {}
+        for row in constellation.star_rows:
+            angle = 360*math.atan2(float(star_table.h[row]) - center_h, float(star_table.w[row]) - center_w)/(2*math.pi)
+            angles[row] = angle
     
         # Sort the stars by angle
-        constellation.stars = list(sorted(constellation.stars, key=operator.attrgetter('tag')))
+        constellation.sort_stars(key = angles.get)
     
     return constellations
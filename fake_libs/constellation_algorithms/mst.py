@@ -0,0 +1,198 @@
+from ..log_stuff import init_logger
+from ..constellations_common import *
+import collections
+import random
+import numpy
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+log = init_logger()
+
+# Constellations from the Euclidean minimum spanning tree of the selected stars: the tree is built
+# from the (periodic) Delaunay edges and cut into constellations by dropping its longest edges,
+# keeping the constellations within the star count range. Every constellation is a piece of the
+# tree, so it is always connected, and it may get a few extra short segments closing a loop.
+
+# extra segments per constellation closing a loop, and how long they can be compared with the mean
+# segment of its tree
+_max_loop_segments = 2
+_loop_segment_length_factor = 1.5
+
+def get_constellations(config, star_table, sorted_master_rows, quadrants, **kwargs):
+        
+    # Determine the number of stars to use per constellation
+    star_counts = []
+    const_count = random.randint(config.constellation_count_range[0], config.constellation_count_range[1])
+    log.debug("Constellation count: %s"%(const_count,))
+    for i in range(0, const_count):
+        star_count = random.randint(config.constellation_star_count_range[0], config.constellation_star_count_range[1])
+        star_counts.append(star_count)
+
+    total_star_count = sum(star_counts)
+    master_rows = numpy.asarray(sorted_master_rows[-total_star_count:], dtype = numpy.int64)
+    if len(master_rows) < 2:
+        log.warning("Not enough stars to build constellations")
+        return []
+    
+    width = float(config.box_size.width)
+    height = float(config.box_size.height)
+    w, h = get_box_positions(star_table, master_rows)
+    if config.add_neighbor_quadrants:
+        neighbors = get_periodic_delaunay_neighbors(config, star_table, master_rows)
+    else:
+        neighbors = get_delaunay_neighbors(w, h)
+    
+    src, dst, dx, dy, lengths = _get_edges(neighbors, w, h, width, height)
+    tree_edges = _get_tree_edges(src, dst, lengths, len(master_rows))
+    log.info("Minimum spanning tree of %i stars from %i edges"%(len(master_rows), len(src)))
+    
+    groups = _cut_tree(src, dst, tree_edges, len(master_rows), const_count, config.constellation_star_count_range)
+    loop_edges = _get_loop_edges(src, dst, lengths, tree_edges, groups)
+    
+    # stars of every constellation, by its smallest master index
+    members = collections.OrderedDict()
+    for index in range(len(master_rows)):
+        members.setdefault(groups.find(index), []).append(index)
+    group_edges = collections.defaultdict(list)
+    for edge in tree_edges.tolist():
+        group = groups.find(int(src[edge]))
+        if group == groups.find(int(dst[edge])):
+            group_edges[group].append(edge)
+    log.info("Cut the tree into %i constellations"%(len(members), ))
+    
+    constellations = []
+    for group, indexes in members.items():
+        if len(indexes) < 2:
+            continue
+        constellation = Constellation(star_table = star_table, quadrants = quadrants, name_display_style = config.constellation_name_display_style)
+        rows = _place_stars(star_table, master_rows, indexes, group_edges[group], src, dst, dx, dy)
+        for index in indexes:
+            star_table.take(rows[index])
+            constellation.add_star(rows[index])
+        for edge in group_edges[group] + loop_edges[group]:
+            row_a = rows[int(src[edge])]
+            row_b = rows[int(dst[edge])]
+            # a loop segment which would wrap around the chart in a different way than the tree
+            if edge not in group_edges[group] and not _is_edge_placed(star_table, row_a, row_b, dx[edge], dy[edge]):
+                continue
+            constellation.draw_segment(sorted([row_a, row_b]), False)
+        constellations.append(constellation)
+    
+    return constellations
+
+def _get_edges(neighbors, w, h, width, height):
+    # Every Delaunay edge once (src < dst), the shortest one if it appears with several offsets.
+    # Returns the arrays src, dst, dx, dy (box offset of the dst copy) and lengths
+    edges = [(src, dst, dx, dy) for src, src_neighbors in enumerate(neighbors) for dst, dx, dy in src_neighbors if src < dst]
+    edges = numpy.array(edges, dtype = numpy.int64).reshape(-1, 4)
+    src, dst, dx, dy = edges.T
+    lengths = numpy.hypot(w[dst] + dx * width - w[src], h[dst] + dy * height - h[src])
+    order = numpy.lexsort((lengths, dst, src))
+    first = numpy.ones(len(order), dtype = bool)
+    first[1:] = (src[order][1:] != src[order][:-1]) | (dst[order][1:] != dst[order][:-1])
+    order = numpy.sort(order[first])
+    return src[order], dst[order], dx[order], dy[order], lengths[order]
+
+def _get_tree_edges(src, dst, lengths, count):
+    # indexes of the edges of the minimum spanning tree, shortest first
+    # coincident stars are kept linked, an edge of length 0 would be no edge for the sparse matrix
+    weights = numpy.maximum(lengths, numpy.finfo(numpy.float64).tiny)
+    tree = minimum_spanning_tree(coo_matrix((weights, (src, dst)), shape = (count, count)).tocsr()).tocoo()
+    edge_ids = dict([(key, edge) for edge, key in enumerate(zip(src.tolist(), dst.tolist()))])
+    tree_edges = numpy.array([edge_ids[(min(a, b), max(a, b))] for a, b in zip(tree.row.tolist(), tree.col.tolist())], dtype = numpy.int64)
+    return tree_edges[numpy.lexsort((tree_edges, lengths[tree_edges]))]
+
+def _cut_tree(src, dst, tree_edges, count, const_count, star_count_range):
+    # Joins the stars along the tree edges, shortest first, which is the same as dropping the longest
+    # ones: first up to the max stars per constellation, then the groups under the min are joined to
+    # their nearest group, then the nearest groups until there are const_count of them
+    min_count, max_count = star_count_range
+    groups = DisjointSets(count)
+    left_edges = []
+    for edge in tree_edges.tolist():
+        a = int(src[edge])
+        b = int(dst[edge])
+        if groups.get_size(a) + groups.get_size(b) <= max_count:
+            groups.union(a, b)
+        else:
+            left_edges.append(edge)
+    
+    edges = []
+    for edge in left_edges:
+        a = int(src[edge])
+        b = int(dst[edge])
+        if groups.get_size(a) < min_count or groups.get_size(b) < min_count:
+            groups.union(a, b)
+        else:
+            edges.append(edge)
+    
+    for edge in edges:
+        if groups.count <= const_count:
+            break
+        groups.union(int(src[edge]), int(dst[edge]))
+    return groups
+
+def _get_loop_edges(src, dst, lengths, tree_edges, groups):
+    # group -> a few short edges which are not in the tree, both ends in the group
+    in_tree = numpy.zeros(len(src), dtype = bool)
+    in_tree[tree_edges] = True
+    tree_lengths = collections.defaultdict(list)
+    for edge in tree_edges.tolist():
+        group = groups.find(int(src[edge]))
+        if group == groups.find(int(dst[edge])):
+            tree_lengths[group].append(float(lengths[edge]))
+    
+    candidates = collections.defaultdict(list)
+    for edge in numpy.argsort(lengths, kind = "stable").tolist():
+        if in_tree[edge]:
+            continue
+        group = groups.find(int(src[edge]))
+        if group == groups.find(int(dst[edge])):
+            candidates[group].append(edge)
+    
+    loop_edges = collections.defaultdict(list)
+    for group, segment_lengths in tree_lengths.items():
+        max_length = _loop_segment_length_factor * sum(segment_lengths) / len(segment_lengths)
+        for edge in candidates[group][:random.randint(0, _max_loop_segments)]:
+            if lengths[edge] <= max_length:
+                loop_edges[group].append(edge)
+    return loop_edges
+
+def _place_stars(star_table, master_rows, indexes, edges, src, dst, dx, dy):
+    # The copy (row) of every star of the constellation which keeps its tree edges together. The
+    # first star is the master one, the rest follow the tree and may be copies on neighbor quadrants
+    adjacency = collections.defaultdict(list)
+    for edge in edges:
+        adjacency[int(src[edge])].append((int(dst[edge]), int(dx[edge]), int(dy[edge])))
+        adjacency[int(dst[edge])].append((int(src[edge]), -int(dx[edge]), -int(dy[edge])))
+    
+    root = indexes[0]
+    quadrant = star_table.get_quadrant(master_rows[root])
+    offsets = {root : (0, 0)}
+    pending = collections.deque([root])
+    while len(pending) > 0:
+        index = pending.popleft()
+        for neighbor, offset_x, offset_y in adjacency[index]:
+            if neighbor not in offsets:
+                offsets[neighbor] = (offsets[index][0] + offset_x, offsets[index][1] + offset_y)
+                pending.append(neighbor)
+    
+    rows = {}
+    for index, (offset_x, offset_y) in offsets.items():
+        master_row = int(master_rows[index])
+        row = master_row
+        if quadrant != None and (offset_x, offset_y) != (0, 0):
+            row = star_table.get_peer_row(master_row, quadrant.x + offset_x, quadrant.y + offset_y)
+            if row == None:
+                log.warning("No quadrant for the copy of %s, using the master star"%(star_table.get_star(master_row), ))
+                row = master_row
+        rows[index] = row
+    return rows
+
+def _is_edge_placed(star_table, row_a, row_b, dx, dy):
+    # True if the copy row_b is at the box offset dx, dy from row_a
+    quadrant_a = star_table.get_quadrant(row_a)
+    quadrant_b = star_table.get_quadrant(row_b)
+    if quadrant_a == None or quadrant_b == None:
+        return (dx, dy) == (0, 0)
+    return (quadrant_b.x - quadrant_a.x, quadrant_b.y - quadrant_a.y) == (dx, dy)
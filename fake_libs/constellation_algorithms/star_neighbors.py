@@ -2,7 +2,6 @@ from ..log_stuff import init_logger
 from ..color import  Color, debug_colors
 from ..constellations_common import *
 import math
-import operator
 import random
 
 add_debug_colors = False
@@ -10,7 +9,7 @@ debug_color_index = 0
 
 log = init_logger()
 
-def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
+def get_constellations(config, star_table, sorted_master_rows, quadrants, **kwargs):
     global debug_color_index
         
     # Determine the number of stars to use per constellation
@@ -22,28 +21,25 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
         star_counts.append(star_count)
 
     total_star_count = sum(star_counts)
-    selected_master_stars = sorted_master_stars[-total_star_count:]
+    selected_master_rows = sorted_master_rows[-total_star_count:]
     
     # Add all child stars into the mix
-    all_available_stars = []
-    for ms in selected_master_stars:
-        all_available_stars.append(ms)
-        all_available_stars.extend(ms.childs)
+    all_available_rows = []
+    for master_row in selected_master_rows:
+        all_available_rows.append(int(master_row))
+        all_available_rows.extend(star_table.get_child_rows(master_row))
         
     if add_debug_colors:
-        for star in all_available_stars:
-            star.color.set_rgb_val("#00FF00FF")
-            star.size = config.star_size_range[1]
+        star_table.palette_id[all_available_rows] = star_table.palette.add_color(Color("#00FF00FF"))
+        star_table.size[all_available_rows] = config.star_size_range[1]
     
-    available_stars = all_available_stars
+    star_index = get_star_index(star_table, all_available_rows)
+    available_stars = AvailableStars(star_table, all_available_rows)
     
     constellations = []
     # fun beggins here
     for const_num in range(0, const_count):
-        # Filter out taken stars
-        available_stars = get_available_stars(available_stars)
-        
-        master_av_stars = count_available_master_stars(available_stars)
+        master_av_stars = available_stars.count_masters()
         
         log.info("Creating constellation %i out of %i possible stars"%(const_num, master_av_stars))
         
@@ -56,91 +52,78 @@ def get_constellations(config, sorted_master_stars, quadrants, **kwargs):
             # need to make sure the proper copy of the star is added to the proper constellation, otherwise 
             # weird things happen
             # The easiest way to do that is to compare only against stars which have been assigned to a constellation
-            assigned_stars = []
-            for star in all_available_stars:
-                if star.taken and star.constellation != None:
-                    assigned_stars.append(star)
+            assigned_rows = []
+            for row in all_available_rows:
+                if star_table.is_taken(row) and star_table.get_constellation(row) != None:
+                    assigned_rows.append(row)
             
+            assigned_index = get_star_index(star_table, assigned_rows)
             min_d = None
             min_const = None
-            min_star = None
-            for star in available_stars:
-                d = get_distances_to_stars(star, assigned_stars, skip_taken_stars = False)
-                d_keys = list(d.keys())
-                d_keys.sort()
-                if min_d == None or d_keys[0] < min_d:
-                    min_d = d_keys[0]
-                    min_const = d[d_keys[0]][0].constellation
-                    min_star = star
+            min_row = None
+            for row in available_stars.get_rows().tolist():
+                d, nearest_rows = assigned_index.get_nearest(star_table.w[row], star_table.h[row], exclude_row = row)
+                if min_d == None or d < min_d:
+                    min_d = d
+                    min_const = star_table.get_constellation(nearest_rows[0])
+                    min_row = row
             
-            min_star.take()
-            min_const.add_star(min_star)
+            star_table.take(min_row)
+            min_const.add_star(min_row)
             break
                 
         # pick a random star to start with
-        base_star = get_random_star(available_stars, must_be_master = True)
-        log.debug("base star: %s"%(base_star,))
-        constellation = Constellation(quadrants = quadrants, name_display_style = config.constellation_name_display_style)
+        base_row = available_stars.get_random_star(must_be_master = True)
+        log.debug("base star: %s"%(star_table.get_star(base_row),))
+        constellation = Constellation(star_table = star_table, quadrants = quadrants, name_display_style = config.constellation_name_display_style)
         constellations.append(constellation)
-        constellation.add_star(base_star)
+        constellation.add_star(base_row)
         
         if add_debug_colors:
             constellation.custom_color = Color(debug_colors[debug_color_index])
             debug_color_index = (debug_color_index + 1) % len(debug_colors)
         
-        while len(constellation.stars) < star_counts[const_num]:
-            # Calculate the distances to the rest of stars
-            distances = get_distances_to_stars(constellation, available_stars, skip_taken_stars = True)
-            if len(distances) == 0:
+        nearest_queue = NearestStarQueue(star_table, all_available_rows, *constellation.get_mean_position())
+        while len(constellation.star_rows) < star_counts[const_num]:
+            # Find the nearest stars to the mean center
+            min_distance, nearest_rows = nearest_queue.get_nearest()
+            if len(nearest_rows) == 0:
                 break
             
-            d_keys = list(distances.keys())
-            d_keys.sort()
-            star = random.choice(distances[d_keys[0]])
+            row = random.choice(nearest_rows)
             
-            star.take()
-            log.debug("star %i: %s"%(len(constellation.stars), star))
+            star_table.take(row)
+            log.debug("star %i: %s"%(len(constellation.star_rows), star_table.get_star(row)))
             
-            constellation.add_star(star)
-        
-        # Filter out taken stars
-        available_stars = get_available_stars(available_stars)
+            constellation.add_star(row)
+            nearest_queue.move_center(*constellation.get_mean_position())
         
         # Now, check if there's stars close enough to any of the constellation´s stars
         # get the man distance of all the stars to the mean center
-        distances_to_mean_center = get_distances_to_stars(constellation, constellation.stars, skip_taken_stars = False)
-        
-        values = []
-        for d, stars in distances_to_mean_center.items():
-            for i in range(0, len(stars)):
-                values.append(d)
+        values = get_star_distances(star_table, constellation, constellation.star_rows).tolist()
         avg_dist = sum(values) / len(values)
         
         # now, for every star in the constellation, check distances to the available stars
         index = 0
-        while index < len(constellation.stars):
-            const_star = constellation.stars[index]
+        while index < len(constellation.star_rows):
+            const_row = constellation.star_rows[index]
             index += 1
-            distances = get_distances_to_stars(const_star, available_stars, skip_taken_stars = True)
-            for distance, star_list in distances.items():
-                if distance > (avg_dist/1.5):
-                    continue
-                for star in star_list:
-                    star.take()
-                    constellation.add_star(star)
+            rows, distances = star_index.query_radius(star_table.w[const_row], star_table.h[const_row], avg_dist/1.5, skip_taken = True, exclude_row = const_row)
+            for row in rows.tolist():
+                star_table.take(row)
+                constellation.add_star(row)
     
     for constellation in constellations:
         # now, lets sort the stars by angle from the mean center
         center_w, center_h = constellation.get_mean_position()
         
-        for star in constellation.stars:
-            angle = 360*math.atan2(star.h - center_h, star.w - center_w)/(2*math.pi)
-            star.tag = angle
+        angles = {}
+        for row in constellation.star_rows:
+            angle = 360*math.atan2(float(star_table.h[row]) - center_h, float(star_table.w[row]) - center_w)/(2*math.pi)
+            angles[row] = angle
     
         # Sort the stars by angle
-        star_ids = []
-        for star in sorted(constellation.stars, key=operator.attrgetter('tag')):
-            star_ids.append(star.id)
+        star_ids = list(sorted(constellation.star_rows, key = angles.get))
         
         constellation.draw_segment(star_ids, is_closed = True if random.randint(0,1) == 0 else False)
     
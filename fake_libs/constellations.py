@@ -1,9 +1,7 @@
 from .log_stuff import init_logger
-from .stars import Star
 from .constellations_common import *
 from .constellation_algorithms.algorithms import call_algorithm
 import random
-import operator
 import math
 import os
 
@@ -12,17 +10,20 @@ log = init_logger()
 _my_path = os.path.abspath(os.path.dirname(__file__))
 _default_constellation_names_file = os.path.join(_my_path, "..", "doc", "constellation_names.txt")
 
-def get_constellations(config, master_stars, quadrants):
-    sorted_stars = list(sorted(master_stars, key=operator.attrgetter('size')))
+# filename -> ConstellationNames shared by all the charts which use unique names
+_shared_constellation_names = {}
+
+def get_constellations(config, star_table, quadrants):
+    sorted_master_rows = star_table.get_sorted_master_rows()
     
     if config.constellation_random_seed != None:
         random.seed(config.constellation_random_seed)
     
     log.info("Constellations algorithm: %s"%(config.constellation_algorithm, ))
-    constellations = call_algorithm(config.constellation_algorithm, config, sorted_stars, quadrants)
+    constellations = call_algorithm(config.constellation_algorithm, config, star_table, sorted_master_rows, quadrants)
     
     # name constellations
-    const_names = ConstellationNames(filename = _default_constellation_names_file if config.constellation_name_custom_source == None else config.constellation_name_custom_source)
+    const_names = _get_constellation_names(config)
     if config.constellation_name_random_seed != None:
         random.seed(config.constellation_name_random_seed)
     for const in constellations:
@@ -37,3 +38,16 @@ def get_constellations(config, master_stars, quadrants):
 
     return constellations        
         
+def reset_unique_constellation_names():
+    # Makes all the names available again for the charts with unique names, e.g. for a new batch
+    _shared_constellation_names.clear()
+
+def _get_constellation_names(config):
+    filename = _default_constellation_names_file if config.constellation_name_custom_source == None else config.constellation_name_custom_source
+    if not config.constellation_name_unique_across_charts:
+        return ConstellationNames(filename = filename)
+    key = os.path.abspath(filename)
+    if key not in _shared_constellation_names:
+        _shared_constellation_names[key] = ConstellationNames(filename = filename)
+    return _shared_constellation_names[key]
+        
@@ -1,6 +1,7 @@
 from .log_stuff import init_logger
-from .stars import Star
+from .spatial_index import StarIndex, NearestStarQueue, get_delaunay_neighbors
 import random
+import numpy
 import operator
 import math
 import os
@@ -8,6 +9,9 @@ import collections
 
 log = init_logger()
 
+# width of the wrapped margin of the periodic triangulations, in average distances between stars
+_periodic_margin_spacings = 3.0
+
 
 NAME_DISPLAY_STYLE_NAME = "name"
 NAME_DISPLAY_STYLE_NAME_ID = "name+id"
@@ -20,6 +24,7 @@ class Constellation:
     _id_next = 0
     
     def __init__(self, 
+                 star_table,
                  quadrants,
                  name_display_style,
                  id = None,
@@ -35,14 +40,25 @@ class Constellation:
         
         self.name_display_style = name_display_style
         
+        self.star_table = star_table
         self._quadrants = quadrants
-        self.stars = []
-        self.star_dict = {}
+        # rows of self.star_table
+        self.star_rows = []
+        self._star_row_set = set()
         self.segments = []
         self.custom_color = custom_color
+        # the constellation this one is a copy of, None for the original ones
+        self.master_constellation = None
         
     def __str__(self):
-        return "Constellation %s%s (%i stars)"%(self.id, "" if (self.name == None or self.id == self.name) else (" (%s)"%(self.name)), len(self.stars))
+        return "Constellation %s%s (%i stars)"%(self.id, "" if (self.name == None or self.id == self.name) else (" (%s)"%(self.name)), len(self.star_rows))
+    
+    @property
+    def stars(self):
+        return self.star_table.get_stars(self.star_rows)
+    
+    def has_star(self, row):
+        return row in self._star_row_set
     
     def get_display_name(self):
         if self.name_display_style == NAME_DISPLAY_STYLE_NAME:
@@ -51,28 +67,34 @@ class Constellation:
             return "%s (%s)"%(self.name, self.id) if self.name != self.id else self.name
         raise Exception("Not implemented style: %s"%(self.name_display_style, ))
     
-    def add_star(self, star):
-        self.star_dict[star.id] = star
-        self.stars.append(star)
-        star.constellation = self
+    def add_star(self, row):
+        row = int(row)
+        self._star_row_set.add(row)
+        self.star_rows.append(row)
+        self.star_table.set_constellation(row, self)
+        
+    def sort_stars(self, key):
+        self.star_rows = list(sorted(self.star_rows, key = key))
         
     def get_copies(self):
         # need to find out how many extra quadrants are added
         log.info("Getting constellation copies for constellation %s (%s)"%(self.name, self.id))
         
-        master_star = None
+        table = self.star_table
+        master_row = None
         # get any master star
-        for star in self.stars:
-            if star.is_master:
-                master_star = star
+        for row in self.star_rows:
+            if table.is_master(row):
+                master_row = row
                 break
         # There should be at least one master star
-        assert master_star != None, "Constelation %s does not have any master star"%(self.id)
+        assert master_row != None, "Constelation %s does not have any master star"%(self.id)
         
+        quadrant_x = numpy.array([0 if q == None else q.x for q in table.quadrants], dtype = numpy.int64)[table.quadrant[self.star_rows]]
+        quadrant_y = numpy.array([0 if q == None else q.y for q in table.quadrants], dtype = numpy.int64)[table.quadrant[self.star_rows]]
+        master_quadrant = table.get_quadrant(master_row)
         req_quadrant_copies = []
-        for star in self.stars:
-            if star.id == master_star.id: continue
-            rel_quad = master_star.get_rel_quadrant_to_other_star(star)
+        for rel_quad in zip((master_quadrant.x - quadrant_x).tolist(), (master_quadrant.y - quadrant_y).tolist()):
             if rel_quad != (0, 0) and rel_quad not in req_quadrant_copies:
                 req_quadrant_copies.append(rel_quad)
         
@@ -80,22 +102,23 @@ class Constellation:
         
         copies = []
         for index, req_quad in enumerate(req_quadrant_copies):
-            const_copy = Constellation(quadrants = self._quadrants, 
+            const_copy = Constellation(star_table = table,
+                                       quadrants = self._quadrants, 
                                        name_display_style = self.name_display_style,
                                        id = "%s.%s"%(self.id, index + 1),
                                        name = self.name,
                                        custom_color = self.custom_color)
+            const_copy.master_constellation = self
             star_xlation_dict = {}
             copies.append(const_copy)
             
-            for base_star in self.stars:
-                # need to find an star which has the same relative position to req_quad
-                star_peers = base_star.get_peers()
-                for peer_star in star_peers:
-                    if peer_star.get_rel_quadrant_to_other_star(base_star) == req_quad:
-                        const_copy.add_star(peer_star)
-                        star_xlation_dict[base_star.id] = peer_star.id
-                        break
+            # need to find the copy of every star which has the same relative position to req_quad,
+            # it may not exist yet if it falls outside of the neighbor band
+            peer_rows = table.get_peer_rows_at(self.star_rows, req_quad[0], req_quad[1]).tolist()
+            for base_row, peer_row in zip(self.star_rows, peer_rows):
+                if peer_row >= 0:
+                    const_copy.add_star(peer_row)
+                    star_xlation_dict[base_row] = peer_row
         
             # Finally, copy the segments
             for segment in self.segments:
@@ -107,103 +130,304 @@ class Constellation:
         return copies
         
     def get_mean_position(self):
-        assert len(self.stars) >= 1
-        x = []
-        y = []
-        for star in self.stars:
-            x.append(star.w)
-            y.append(star.h)
-        
-        return (sum(x)/len(x), sum(y)/len(y))
+        assert len(self.star_rows) >= 1
+        return (float(numpy.mean(self.star_table.w[self.star_rows], dtype = numpy.float64)), 
+                float(numpy.mean(self.star_table.h[self.star_rows], dtype = numpy.float64)))
 
     def draw_segment(self, star_ids, is_closed):
-        segment = []
         for star_id in star_ids:
-            assert star_id in self.star_dict, "Star %s is not part of this constellation"%(star_id,)
-            segment.append(star_id)
+            assert star_id in self._star_row_set, "Star %s is not part of this constellation"%(star_id,)
         self.segments.append(Segment(star_ids, is_closed))
         
+    def get_chains(self):
+        # The segments merged into the fewest possible segments
+        return get_segment_chains(self.segments)
+        
+# filename -> names, every name file is only read once
+_loaded_constellation_names = {}
+
 class ConstellationNames:
+    # Pool of names to pick from at random, every name can only be picked once until the pool is reset.
+    # The names left keep the order of the file, so a random seed always picks the same names.
     def __init__(self, filename = None):
         self._filename = filename
-        self._load()
+        self.constellation_names = load_constellation_names(filename)
         self.reset_used_constellation_name()
         
-    def _load(self):
-        log.info("Loading constellation names from %s"%(self._filename, ))
-        
-        assert os.path.isfile(self._filename), "Constelation name does not exist: %s"%(self._filename, )
-        
-        with open(self._filename, "r") as fh:
-            self.constellation_names = [l.replace("\n", "").strip() for l in fh.readlines()]
-        
     def get_random_constellation_name(self):
-        assert len(self._available_constellation_names) > 0, "No more constellation names available to use"
-        index = random.randint(0, len(self._available_constellation_names) - 1)
-        return self._available_constellation_names.pop(index)
+        assert self._available_constellation_names.total > 0, "No more constellation names available to use, all the %i names of %s have been used"%(len(self.constellation_names), self._filename)
+        index = self._available_constellation_names.find(random.randint(0, self._available_constellation_names.total - 1))
+        self._available_constellation_names.add(index, -1)
+        return self.constellation_names[index]
             
     def reset_used_constellation_name(self):
-        self._available_constellation_names = []
-        self._available_constellation_names.extend(self.constellation_names)
-        
-def get_available_stars(stars):
-    av_stars = []
-    for star in stars:
-        if star.taken: continue
-        av_stars.append(star)
-    return av_stars
-        
-def count_available_master_stars(stars):
-    c = 0
-    for s in stars:
-        if s.is_master and not s.taken:
-            c += 1
-    return c
-        
-def get_distances_to_stars(ref_obj, star_list, skip_taken_stars):
-    base_star = None
-    if isinstance(ref_obj, Star):
-        ref_w = ref_obj.w
-        ref_h = ref_obj.h
-        base_star = ref_obj
-    elif isinstance(ref_obj, Constellation):
-        ref_w,ref_h = ref_obj.get_mean_position()
-    else:
-        raise Exception("Can't get distance to object type %s"%(type(ref_obj)))
-    
-    #log.debug("Getting distance measurement to %s"%(ref_obj,))
-    distances = {}
-    #assert len(star_list) > 0, "no stars to measure distance to"
-    for star in star_list:
-        if (skip_taken_stars and star.taken) or (base_star != None and star.id == base_star.id): 
+        self._available_constellation_names = _FenwickTree(numpy.ones(len(self.constellation_names), dtype = bool))
+        
+def load_constellation_names(filename):
+    key = os.path.abspath(filename)
+    if key not in _loaded_constellation_names:
+        log.info("Loading constellation names from %s"%(filename, ))
+        
+        assert os.path.isfile(filename), "Constelation name does not exist: %s"%(filename, )
+        
+        with open(filename, "r") as fh:
+            _loaded_constellation_names[key] = tuple([l.replace("\n", "").strip() for l in fh.readlines()])
+    return _loaded_constellation_names[key]
+        
+        
+def get_segment_chains(segments):
+    # Decomposes the lines drawn by the segments into the fewest chains which draw every line once.
+    #
+    # A connected group of lines with 2k stars of odd degree needs k chains (one closed chain when k = 0).
+    # The odd stars are paired with virtual lines except for two of them, the Eulerian path which
+    # goes through every line is then cut at the virtual lines. Lines which are drawn twice are
+    # just drawn once.
+    edges = []
+    edge_set = set()
+    adjacency = collections.OrderedDict()
+    for segment in segments:
+        star_ids = list(segment.star_ids)
+        pairs = list(zip(star_ids[:-1], star_ids[1:]))
+        if segment.is_closed and len(star_ids) > 2:
+            pairs.append((star_ids[-1], star_ids[0]))
+        for a, b in pairs:
+            key = (a, b) if a < b else (b, a)
+            if a == b or key in edge_set:
+                continue
+            edge_set.add(key)
+            _add_chain_edge(edges, adjacency, a, b, virtual = False)
+    
+    # connected groups of stars, in order of appearance
+    groups = []
+    group_of = {}
+    for star_id in adjacency:
+        if star_id in group_of:
             continue
-        d = math.sqrt((ref_w - star.w)**2 + (ref_h - star.h)**2)
-        #log.debug("d = %.3f for %s"%(d, star))
-        if d not in distances:
-            distances[d] = []
-        distances[d].append(star)
+        group = []
+        group_of[star_id] = len(groups)
+        pending = [star_id]
+        while len(pending) > 0:
+            current = pending.pop()
+            group.append(current)
+            for other, _ in adjacency[current]:
+                if other not in group_of:
+                    group_of[other] = len(groups)
+                    pending.append(other)
+        groups.append(group)
     
-    #assert len(distances) > 0, "no stars meet criteria to measure distance to from %i provide stars"%(len(star_list))
+    chains = []
+    for group in groups:
+        odd = [star_id for star_id in group if len(adjacency[star_id]) % 2 == 1]
+        for index in range(2, len(odd), 2):
+            _add_chain_edge(edges, adjacency, odd[index], odd[index + 1], virtual = True)
+        start = odd[0] if len(odd) > 0 else group[0]
+        
+        # Hierholzer
+        used = set()
+        next_edge = {}
+        stack = [(start, None)]
+        path = []
+        while len(stack) > 0:
+            star_id, _ = stack[-1]
+            star_edges = adjacency[star_id]
+            index = next_edge.get(star_id, 0)
+            while index < len(star_edges) and star_edges[index][1] in used:
+                index += 1
+            next_edge[star_id] = index
+            if index < len(star_edges):
+                other, edge_id = star_edges[index]
+                used.add(edge_id)
+                stack.append((other, edge_id))
+            else:
+                path.append(stack.pop())
+        
+        # split at the virtual lines
+        path.reverse()
+        chain = [path[0][0]]
+        for star_id, edge_id in path[1:]:
+            if edges[edge_id]:
+                chains.append(chain)
+                chain = [star_id]
+            else:
+                chain.append(star_id)
+        chains.append(chain)
+    
+    result = []
+    for chain in chains:
+        if len(chain) > 3 and chain[0] == chain[-1]:
+            result.append(Segment(chain[:-1], True))
+        else:
+            result.append(Segment(chain, False))
+    return result
     
-    return distances
+def _add_chain_edge(edges, adjacency, a, b, virtual):
+    edge_id = len(edges)
+    edges.append(virtual)
+    adjacency.setdefault(a, []).append((b, edge_id))
+    adjacency.setdefault(b, []).append((a, edge_id))
         
-def get_distance_star_to_star(star_a, star_b):
-    return math.sqrt((star_a.w - star_b.w)**2 + (star_a.h - star_b.h)**2)
+class AvailableStars:
+    # Stars of rows (master and child stars) which are not taken yet, kept up to date by
+    # StarTable.take/untake: taking or untaking a star changes all its copies in rows.
+    #
+    # The available stars keep the order of rows, so the random picks are the same ones as choosing
+    # from a list of the available stars. Counting is O(1), picking or updating a star O(log N).
+    def __init__(self, star_table, rows):
+        self.star_table = star_table
+        self.rows = numpy.asarray(rows, dtype = numpy.int64)
+        masters = star_table.master[self.rows]
+        self._available = ~star_table.get_taken_mask(self.rows)
+        self._is_master = masters == self.rows
+        # master row -> positions of its copies in rows
+        self._positions = collections.defaultdict(list)
+        for position, master_row in enumerate(masters.tolist()):
+            self._positions[master_row].append(position)
+        self._all = _FenwickTree(self._available)
+        self._masters = _FenwickTree(self._available & self._is_master)
+        star_table.add_availability_index(self)
+    
+    def __len__(self):
+        return self._all.total
+    
+    def count_masters(self):
+        return self._masters.total
+    
+    def get_rows(self):
+        return self.rows[self._available]
+    
+    def get_random_star(self, must_be_master = False):
+        # picks and takes a random available star
+        tree = self._masters if must_be_master else self._all
+        if tree.total == 0:
+            log.warning("Ran out of stars to chose from")
+            return None
+        
+        row = int(self.rows[tree.find(random.randint(0, tree.total - 1))])
+        self.star_table.take(row)
         
-def get_random_star(star_list, must_be_master = False):
-    # make a list of stars which are still available
-    av_stars = []
-    for star in star_list:
-        if not star.taken and (must_be_master == False or star.is_master):
-            av_stars.append(star)
-    #assert len(av_stars) > 0, "ran out of stars to chose from"
-    if len(av_stars) == 0:
-        log.warning("Ran out of stars to chose from")
-        return None
+        return row
+    
+    def _set_available(self, master_row, available):
+        delta = 1 if available else -1
+        for position in self._positions.get(master_row, ()):
+            if self._available[position] != available:
+                self._available[position] = available
+                self._all.add(position, delta)
+                if self._is_master[position]:
+                    self._masters.add(position, delta)
+
+class _FenwickTree:
+    # Counts of 0/1 values by position (binary indexed tree)
+    def __init__(self, values):
+        values = numpy.asarray(values, dtype = numpy.int64).tolist()
+        self._tree = [0] + values
+        size = len(values)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+        self.total = sum(values)
+        self._top_bit = 1 << (size.bit_length() - 1) if size > 0 else 0
+    
+    def add(self, position, delta):
+        self.total += delta
+        i = position + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+    
+    def find(self, k):
+        # position of the k-th (from 0) value set
+        position = 0
+        bit = self._top_bit
+        while bit > 0:
+            next_position = position + bit
+            if next_position < len(self._tree) and self._tree[next_position] <= k:
+                position = next_position
+                k -= self._tree[next_position]
+            bit >>= 1
+        return position
+
+class DisjointSets:
+    # Union-find of the items 0 to count - 1, count is the number of sets left
+    def __init__(self, count):
+        self._parent = list(range(count))
+        self._size = [1] * count
+        self.count = count
     
-    star_index = random.randint(0, len(av_stars) - 1)
+    def find(self, item):
+        parent = self._parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
     
-    star = av_stars[star_index]
-    star.take()
+    def get_size(self, item):
+        return self._size[self.find(item)]
     
-    return star
\ No newline at end of file
+    def union(self, item_a, item_b):
+        # False if both were already in the same set
+        root_a = self.find(item_a)
+        root_b = self.find(item_b)
+        if root_a == root_b:
+            return False
+        if self._size[root_a] < self._size[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._size[root_a] += self._size[root_b]
+        self.count -= 1
+        return True
+
+def get_box_positions(star_table, rows):
+    # positions of the stars relative to their quadrant
+    rows = numpy.asarray(rows, dtype = numpy.int64)
+    quadrant_w = numpy.array([0 if q == None else q.w for q in star_table.quadrants], dtype = numpy.float64)
+    quadrant_h = numpy.array([0 if q == None else q.h for q in star_table.quadrants], dtype = numpy.float64)
+    return (star_table.w[rows].astype(numpy.float64) - quadrant_w[star_table.quadrant[rows]],
+            star_table.h[rows].astype(numpy.float64) - quadrant_h[star_table.quadrant[rows]])
+
+def get_periodic_delaunay_neighbors(config, star_table, master_rows):
+    # Periodic Delaunay neighbors of the master stars (see get_delaunay_neighbors), by master index
+    width = float(config.box_size.width)
+    height = float(config.box_size.height)
+    margin = min(_periodic_margin_spacings * math.sqrt(width * height / len(master_rows)), width, height)
+    w, h = get_box_positions(star_table, master_rows)
+    return get_delaunay_neighbors(w, h, box_size = (width, height), margin = margin)
+
+def get_reference_position(star_table, ref_obj):
+    # position of a star row or of the mean center of a constellation
+    if isinstance(ref_obj, Constellation):
+        return ref_obj.get_mean_position()
+    if isinstance(ref_obj, (int, numpy.integer)):
+        return float(star_table.w[ref_obj]), float(star_table.h[ref_obj])
+    raise Exception("Can't get distance to object type %s"%(type(ref_obj)))
+
+def get_star_distances(star_table, ref_obj, rows):
+    # distance from ref_obj to every row
+    ref_w, ref_h = get_reference_position(star_table, ref_obj)
+    rows = numpy.asarray(rows, dtype = numpy.int64)
+    return numpy.sqrt((ref_w - star_table.w[rows].astype(numpy.float64))**2 + (ref_h - star_table.h[rows].astype(numpy.float64))**2)
+
+def get_nearest_stars(star_table, ref_obj, rows, skip_taken_stars):
+    # (distance, rows at that distance) of the nearest stars to ref_obj out of rows, (None, []) if there
+    # are none. For a short list of rows, use a StarIndex to search many of them
+    rows = numpy.asarray(rows, dtype = numpy.int64)
+    mask = numpy.ones(len(rows), dtype = bool)
+    if skip_taken_stars:
+        mask &= ~star_table.get_taken_mask(rows)
+    if isinstance(ref_obj, (int, numpy.integer)):
+        mask &= rows != ref_obj
+    rows = rows[mask]
+    if len(rows) == 0:
+        return None, []
+    d = get_star_distances(star_table, ref_obj, rows)
+    min_distance = d.min()
+    return float(min_distance), rows[d == min_distance].tolist()
+
+def get_star_index(star_table, rows):
+    # index over rows, for the algorithms which work with the child stars of the neighbor band
+    return StarIndex(star_table, rows)
+        
+def get_distance_star_to_star(star_table, row_a, row_b):
+    return math.sqrt((float(star_table.w[row_a]) - float(star_table.w[row_b]))**2 + (float(star_table.h[row_a]) - float(star_table.h[row_b]))**2)
+        
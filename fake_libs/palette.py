@@ -0,0 +1,89 @@
+import numpy
+from .log_stuff import init_logger
+from .color import COLORS_FROM_START_INDEX, color_from_packed_rgba, get_star_color_index_rgb
+
+log = init_logger()
+
+# ci <-0.4,+2.0>
+_color_index_min = -0.4
+_color_index_max = 2.0
+
+class Palette:
+    # Table of interned colors.
+    #
+    # Stars refer to their color by palette id, identical colors share the same id, the same
+    # Color object and the same cached SVG strings.
+    _max_colors = 0x10000
+
+    def __init__(self):
+        self._ids = {}
+        self.rgba = []
+        self._colors = []
+        self._hex_rgb = []
+        self._opacity = []
+        self._color_index_luts = {}
+
+    def __len__(self):
+        return len(self.rgba)
+
+    def add_packed_rgba(self, rgba):
+        rgba = int(rgba)
+        if rgba not in self._ids:
+            assert len(self.rgba) < self._max_colors, "Too many colors in palette"
+            self._ids[rgba] = len(self.rgba)
+            self.rgba.append(rgba)
+            self._colors.append(None)
+            self._hex_rgb.append("#%06X"%(rgba >> 8, ))
+            self._opacity.append(str((rgba & 0xFF) / 255.0))
+        return self._ids[rgba]
+
+    def add_packed_rgba_array(self, rgba):
+        unique_rgba, inverse = numpy.unique(numpy.asarray(rgba, dtype = numpy.uint32), return_inverse = True)
+        unique_ids = numpy.array([self.add_packed_rgba(v) for v in unique_rgba.tolist()], dtype = numpy.uint16)
+        return unique_ids[inverse.reshape(-1)]
+
+    def add_color(self, color):
+        palette_id = self.add_packed_rgba(color.get_packed_rgba())
+        if self._colors[palette_id] == None:
+            self._colors[palette_id] = color
+        return palette_id
+
+    def get_color(self, palette_id):
+        # Colors are shared, they should not be modified
+        if self._colors[palette_id] == None:
+            self._colors[palette_id] = color_from_packed_rgba(self.rgba[palette_id])
+        return self._colors[palette_id]
+
+    def get_hex_rgb(self, palette_id):
+        return self._hex_rgb[palette_id]
+
+    def get_opacity(self, palette_id):
+        return self._opacity[palette_id]
+
+    def get_color_index_ids(self, color_name, color_index, resolution = 0):
+        # Palette ids for an array of star color indexes.
+        #
+        # With resolution 0 every color index is evaluated exactly, otherwise the color indexes are
+        # quantized to a lookup table of the given number of entries.
+        assert color_name in COLORS_FROM_START_INDEX
+        color_index = numpy.asarray(color_index, dtype = numpy.float64)
+        if resolution == 0:
+            return self.add_packed_rgba_array(_get_packed_rgba(get_star_color_index_rgb(color_name, color_index)))
+
+        lut = self._get_color_index_lut(color_name, resolution)
+        lut_index = numpy.rint((numpy.clip(color_index, _color_index_min, _color_index_max) - _color_index_min) *
+                               ((resolution - 1) / (_color_index_max - _color_index_min))).astype(numpy.int64)
+        return lut[lut_index]
+
+    def _get_color_index_lut(self, color_name, resolution):
+        assert resolution >= 2, "Color index resolution must be 0 or >= 2, not %s"%(resolution, )
+        key = (color_name, resolution)
+        if key not in self._color_index_luts:
+            log.debug("Creating color index lookup table for %s with %i entries"%(color_name, resolution))
+            lut_color_index = numpy.linspace(_color_index_min, _color_index_max, resolution)
+            self._color_index_luts[key] = self.add_packed_rgba_array(_get_packed_rgba(get_star_color_index_rgb(color_name, lut_color_index)))
+        return self._color_index_luts[key]
+
+def _get_packed_rgba(rgb, alpha = 0xFF):
+    rgb = numpy.asarray(rgb, dtype = numpy.uint32)
+    return (rgb[:, 0] << 24) | (rgb[:, 1] << 16) | (rgb[:, 2] << 8) | alpha
@@ -10,14 +10,11 @@ class Quadrant:
         self.w = self.x * self.config.box_size.width
         self.h = self.y * self.config.box_size.height
         self.id = id
-        self.stars = []
-    
-    def add_star(self, star):
-        self.stars.append(star)
+        self.star_count = 0
     
     def adjust_coordinates(self, w, h):
         return w + self.w, h + self.h
     
     def __str__(self):
-        return "Quadrant %s at %i,%i (with %i stars)"%(self.id, self.w, self.h, len(self.stars))
+        return "Quadrant %s at %i,%i (with %i stars)"%(self.id, self.w, self.h, self.star_count)
     
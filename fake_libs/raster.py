@@ -0,0 +1,635 @@
+import os
+import math
+import re
+import struct
+import zlib
+import numpy
+from .log_stuff import init_logger
+from .renderers import Renderer, STAR_PATHS_DOTS, SVG_DENSITY, _inherited_attribs, _get_style_key
+
+log = init_logger()
+
+# user units per inch of the SVG document, the DPI resolution scales the chart as ImageMagick does
+_svg_density = SVG_DENSITY
+_png_compression_level = 6
+# coverage of the polygon fills is computed on this number of lines per pixel row
+_polygon_subrows = 4
+# colors which are not given as #RRGGBB
+_named_colors = {"black" : (0.0, 0.0, 0.0),
+                 "white" : (1.0, 1.0, 1.0),
+                }
+_transform_re = re.compile(r"(matrix|translate|scale|rotate)\s*\(([^)]*)\)")
+_identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+DEFAULT_TILE_SIZE = 256
+
+class RasterRenderer(Renderer):
+    # Draws the chart with NumPy and writes it as a PNG file, without any SVG in between.
+    #
+    # The elements are recorded (in chart units, with their style resolved) while the chart is
+    # written, and drawn once the whole image or a part of it is requested with render(). Every
+    # element is anti-aliased by its coverage of each pixel, which is derived from the distance
+    # of the pixel center to the edge of the shape. Texts are not drawn.
+    def __init__(self, filename, size, resolution = 72):
+        Renderer.__init__(self, filename, size)
+        self.resolution = resolution
+        self.scale = resolution / _svg_density
+        self._open_groups = []
+        self._definitions = {}
+        # elements of the glyph which is being defined
+        self._definition = None
+        self._skipped_texts = 0
+        # (kind, geometry, paint, matrix) in drawing order and their boxes (x0, y0, x1, y1)
+        self._shapes = []
+        self._shape_boxes = []
+        # disks of all the "disks" shapes, built when they are drawn
+        self._disk_index = None
+
+    def get_image_size(self, scale = None):
+        scale = self.scale if scale == None else scale
+        return max(1, int(round(self.size[0] * scale))), max(1, int(round(self.size[1] * scale)))
+
+    def render(self, scale, x0 = 0, y0 = 0, width = None, height = None, wrap = False):
+        # (height, width, 4) RGBA array with the pixels from (x0, y0) of the chart drawn at scale
+        # (pixels per chart unit). With wrap, the chart repeats itself in every direction, as
+        # when it is used as a tile.
+        image_width, image_height = self.get_image_size(scale)
+        width = image_width if width == None else width
+        height = image_height if height == None else height
+        canvas = _Canvas(width, height)
+        chart_width, chart_height = float(self.size[0]), float(self.size[1])
+
+        if wrap:
+            periods = [(px, py) for px in range(int(math.floor(x0 / (chart_width * scale))), int(math.floor((x0 + width) / (chart_width * scale))) + 1)
+                                for py in range(int(math.floor(y0 / (chart_height * scale))), int(math.floor((y0 + height) / (chart_height * scale))) + 1)]
+        else:
+            periods = [(0, 0)]
+
+        shape_boxes = numpy.array(self._shape_boxes, dtype = numpy.float64).reshape(-1, 4)
+        if self._disk_index == None or self._disk_index.shape_count != len(self._shapes):
+            self._disk_index = _DiskIndex(self._shapes)
+        disk_index = self._disk_index
+        is_disks = numpy.zeros(len(self._shapes), dtype = bool)
+        is_disks[disk_index.shape_ids] = True
+        shifts = [(sx, sy) for sx in (-chart_width, 0.0, chart_width) for sy in (-chart_height, 0.0, chart_height)] if wrap else [(0.0, 0.0)]
+        shift_x = numpy.array([sx for sx, sy in shifts])
+        shift_y = numpy.array([sy for sx, sy in shifts])
+        for px, py in periods:
+            offset_x = px * chart_width
+            offset_y = py * chart_height
+            # visible part of the chart, in chart units
+            view = [x0 / scale - offset_x, y0 / scale - offset_y, (x0 + width) / scale - offset_x, (y0 + height) / scale - offset_y]
+            if wrap:
+                view = [max(view[0], 0.0), max(view[1], 0.0), min(view[2], chart_width), min(view[3], chart_height)]
+                canvas.clip = (offset_x * scale - x0, offset_y * scale - y0, (offset_x + chart_width) * scale - x0, (offset_y + chart_height) * scale - y0)
+            to_pixels = (scale, 0.0, 0.0, scale, offset_x * scale - x0, offset_y * scale - y0)
+
+            visible = ((shape_boxes[:, 0] <= view[2]) & (shape_boxes[:, 2] >= view[0]) &
+                       (shape_boxes[:, 1] <= view[3]) & (shape_boxes[:, 3] >= view[1]) & ~is_disks)
+            # stars have no copies, they are repeated here so they are not cut at the borders. The
+            # disks are grouped by shape, and by shift in their original order within a shape
+            disks = [disk_index.query(view, sx, sy) for sx, sy in shifts]
+            disk_shifts = numpy.repeat(numpy.arange(len(shifts)), [len(d) for d in disks])
+            disks = numpy.concatenate(disks)
+            order = numpy.lexsort((disks, disk_shifts, disk_index.shape_ids[disks]))
+            disks = disks[order]
+            disk_shifts = disk_shifts[order]
+            disk_shape_ids, disk_starts = numpy.unique(disk_index.shape_ids[disks], return_index = True)
+            disk_ranges = dict(zip(disk_shape_ids.tolist(), zip(disk_starts.tolist(), disk_starts[1:].tolist() + [len(disks)])))
+
+            for index in sorted(numpy.nonzero(visible)[0].tolist() + list(disk_ranges.keys())):
+                kind, geometry, paint, matrix = self._shapes[index]
+                if kind != "disks":
+                    canvas.draw_shape(kind, geometry, paint, _multiply(to_pixels, matrix))
+                    continue
+                start, end = disk_ranges[index]
+                selected = disks[start:end]
+                canvas.fill_disks((disk_index.cx[selected] + shift_x[disk_shifts[start:end]]) * scale + to_pixels[4],
+                                  (disk_index.cy[selected] + shift_y[disk_shifts[start:end]]) * scale + to_pixels[5],
+                                  disk_index.r[selected] * scale,
+                                  paint["fill"], paint["fill_opacity"])
+        return canvas.get_rgba()
+
+    def add_circles(self, cx, cy, r, fill, fill_opacity):
+        # stars with the same color are drawn together
+        style = self._styles[-1]
+        colors = {}
+        for index, color in enumerate(zip(fill, fill_opacity)):
+            colors.setdefault(color, []).append(index)
+        cx = numpy.asarray(cx, dtype = numpy.float64)
+        cy = numpy.asarray(cy, dtype = numpy.float64)
+        r = numpy.asarray(r, dtype = numpy.float64)
+        for (color, opacity), indexes in colors.items():
+            rgb = _get_rgb(style["fill"] if color is None else _get_style_key(color))
+            if rgb == None:
+                continue
+            opacity = style["fill_opacity"] if opacity is None else float(opacity)
+            self._add_disks(cx[indexes], cy[indexes], r[indexes], rgb, opacity)
+
+    def add_dots(self, x, y, r, color, opacity, mode = STAR_PATHS_DOTS):
+        rgb = _get_rgb(_get_style_key(color))
+        if rgb != None:
+            self._add_disks(numpy.asarray(x, dtype = numpy.float64),
+                            numpy.asarray(y, dtype = numpy.float64),
+                            numpy.full(len(x), r, dtype = numpy.float64),
+                            rgb, float(opacity))
+
+    def add_star_image(self, x, y, r, fill, fill_opacity, resolution):
+        # the stars are drawn as they are, at the resolution of this renderer
+        self.add_circles(x, y, r, fill, fill_opacity)
+
+    def add_path(self, chains, **attribs):
+        for points, is_closed in chains:
+            self._add_element("polygon" if is_closed else "polyline", dict(points = points), attribs)
+
+    def _begin_group(self, attribs):
+        if "defs" in self._open_groups and self._definition == None and "id" in attribs:
+            self._definition = []
+            self._definitions[attribs["id"]] = self._definition
+            self._open_groups.append("glyph")
+        else:
+            self._open_groups.append("group")
+
+    def _end_group(self):
+        if self._open_groups.pop() == "glyph":
+            self._definition = None
+
+    def _begin_definitions(self):
+        self._open_groups.append("defs")
+
+    def _add_circle(self, center, r, attribs):
+        self._add_element("ellipse", dict(center = center, r = (r, r)), attribs)
+
+    def _add_ellipse(self, center, r, attribs):
+        self._add_element("ellipse", dict(center = center, r = r), attribs)
+
+    def _add_line(self, start, end, attribs):
+        self._add_element("line", dict(points = (start, end)), attribs)
+
+    def _add_polyline(self, points, attribs):
+        self._add_element("polyline", dict(points = points), attribs)
+
+    def _add_polygon(self, points, attribs):
+        self._add_element("polygon", dict(points = points), attribs)
+
+    def _add_text(self, text, insert, attribs):
+        self._skipped_texts += 1
+
+    def _add_image(self, href, insert, size, attribs):
+        log.warning("Images are not drawn by the raster renderer")
+
+    def _add_use(self, href, insert, attribs):
+        assert href in self._definitions, "Unknown glyph: %s"%(href, )
+        # x, y of a use element are a translation after its transform
+        matrix = _parse_transform(attribs.get("transform"))
+        if insert != None:
+            matrix = _multiply(matrix, (1.0, 0.0, 0.0, 1.0, float(insert[0]), float(insert[1])))
+        style = _get_element_style(self._styles[-1], attribs)
+        for kind, geometry, element_attribs in self._definitions[href]:
+            self._add_shape(kind, geometry,
+                            _get_element_style(style, element_attribs),
+                            _multiply(matrix, _parse_transform(element_attribs.get("transform"))))
+
+    def _add_element(self, kind, geometry, attribs):
+        if "defs" in self._open_groups:
+            element = (kind, geometry, attribs)
+            if self._definition != None:
+                self._definition.append(element)
+            elif "id" in attribs:
+                self._definitions[attribs["id"]] = [element]
+            return
+        self._add_shape(kind, geometry, _get_element_style(self._styles[-1], attribs), _parse_transform(attribs.get("transform")))
+
+    def _add_shape(self, kind, geometry, style, matrix):
+        paint = dict(fill = _get_rgb(style["fill"]),
+                     fill_opacity = float(style["fill_opacity"]),
+                     stroke = _get_rgb(style["stroke"]),
+                     stroke_opacity = float(style["stroke_opacity"]),
+                     stroke_width = float(style["stroke_width"]),
+                     dasharray = _get_dasharray(style["stroke_dasharray"]))
+        if kind == "line":
+            paint["fill"] = None
+        if paint["stroke_width"] <= 0:
+            paint["stroke"] = None
+        if paint["fill"] == None and paint["stroke"] == None:
+            return
+
+        if kind == "ellipse":
+            geometry = (float(geometry["center"][0]), float(geometry["center"][1]), float(geometry["r"][0]), float(geometry["r"][1]))
+            corners = [_transform_point(matrix, geometry[0] + sx * geometry[2], geometry[1] + sy * geometry[3]) for sx in (-1, 1) for sy in (-1, 1)]
+        else:
+            geometry = [(float(x), float(y)) for x, y in geometry["points"]]
+            corners = [_transform_point(matrix, x, y) for x, y in geometry]
+        margin = (0.0 if paint["stroke"] == None else paint["stroke_width"] * _get_matrix_scale(matrix)) + 1.0
+        self._shapes.append((kind, geometry, paint, matrix))
+        self._shape_boxes.append((min([c[0] for c in corners]) - margin, min([c[1] for c in corners]) - margin,
+                                  max([c[0] for c in corners]) + margin, max([c[1] for c in corners]) + margin))
+
+    def _add_disks(self, cx, cy, r, rgb, opacity):
+        # disks of the same color, they are culled one by one with the disk index when they are drawn
+        if len(cx) > 0:
+            self._shapes.append(("disks", (cx, cy, r), dict(fill = rgb, fill_opacity = opacity), None))
+            self._shape_boxes.append((float((cx - r).min()), float((cy - r).min()), float((cx + r).max()), float((cy + r).max())))
+
+    def _save(self):
+        if self._skipped_texts > 0:
+            log.warning("%i texts are not drawn by the raster renderer"%(self._skipped_texts, ))
+        self.write(self.filename, self.resolution)
+
+    def write(self, filename, resolution):
+        # PNG of the whole chart at any resolution, the elements are recorded only once
+        scale = resolution / _svg_density
+        width, height = self.get_image_size(scale)
+        log.info("Rasterizing %ix%i pixels"%(width, height))
+        write_png(filename, self.render(scale), resolution)
+
+    def get_png_data(self):
+        # PNG file contents of the whole chart at the resolution of the renderer
+        return get_png_data(self.render(self.scale), self.resolution)
+
+class _DiskIndex:
+    # The disks of all the "disks" shapes of a renderer, bucketed by their center in a grid of cells,
+    # so a tile only visits the disks which can reach it instead of every disk of every color.
+    # Disks are the indexes of the concatenated disks of the shapes, in drawing order
+    _disks_per_cell = 16
+
+    def __init__(self, shapes):
+        self.shape_count = len(shapes)
+        groups = [(index, geometry) for index, (kind, geometry, paint, matrix) in enumerate(shapes) if kind == "disks"]
+        self.shape_ids = numpy.repeat(numpy.array([index for index, geometry in groups], dtype = numpy.int64),
+                                      [len(geometry[0]) for index, geometry in groups])
+        self.cx = numpy.concatenate([numpy.asarray(geometry[0], dtype = numpy.float64) for index, geometry in groups] + [numpy.empty(0)])
+        self.cy = numpy.concatenate([numpy.asarray(geometry[1], dtype = numpy.float64) for index, geometry in groups] + [numpy.empty(0)])
+        self.r = numpy.concatenate([numpy.asarray(geometry[2], dtype = numpy.float64) for index, geometry in groups] + [numpy.empty(0)])
+        if len(self.cx) == 0:
+            return
+        self._max_r = float(self.r.max())
+        self._box = (float(self.cx.min()), float(self.cy.min()), float(self.cx.max()), float(self.cy.max()))
+        self._columns = self._rows = max(1, int(math.sqrt(len(self.cx) / self._disks_per_cell)))
+        self._cell_w = max(self._box[2] - self._box[0], 1e-9) / self._columns
+        self._cell_h = max(self._box[3] - self._box[1], 1e-9) / self._rows
+        cells = (_get_grid_cells(self.cy, self._box[1], self._cell_h, self._rows) * self._columns +
+                 _get_grid_cells(self.cx, self._box[0], self._cell_w, self._columns))
+        self._order = numpy.argsort(cells, kind = "stable")
+        self._starts = numpy.searchsorted(cells[self._order], numpy.arange(self._columns * self._rows + 1))
+
+    def query(self, view, sx, sy):
+        # disks which touch the view once shifted by (sx, sy)
+        if len(self.cx) == 0:
+            return numpy.empty(0, dtype = numpy.int64)
+        x0 = view[0] - sx - self._max_r
+        y0 = view[1] - sy - self._max_r
+        x1 = view[2] - sx + self._max_r
+        y1 = view[3] - sy + self._max_r
+        if x1 < self._box[0] or x0 > self._box[2] or y1 < self._box[1] or y0 > self._box[3]:
+            return numpy.empty(0, dtype = numpy.int64)
+        c0, c1 = _get_grid_cells(numpy.array((x0, x1)), self._box[0], self._cell_w, self._columns).tolist()
+        r0, r1 = _get_grid_cells(numpy.array((y0, y1)), self._box[1], self._cell_h, self._rows).tolist()
+        disks = numpy.concatenate([self._order[self._starts[row * self._columns + c0]:self._starts[row * self._columns + c1 + 1]]
+                                   for row in range(r0, r1 + 1)])
+        cx = self.cx[disks]
+        cy = self.cy[disks]
+        r = self.r[disks]
+        selected = ((cx + sx + r >= view[0]) & (cx + sx - r <= view[2]) &
+                    (cy + sy + r >= view[1]) & (cy + sy - r <= view[3]))
+        return disks[selected]
+
+class _Canvas:
+    # Pixels of an image (or of a tile), the colors are premultiplied by alpha. Only the pixels with
+    # their center inside of clip (x0, y0, x1, y1) are drawn
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.clip = None
+        self._rgb = numpy.zeros((width * height, 3), dtype = numpy.float32)
+        self._alpha = numpy.zeros(width * height, dtype = numpy.float32)
+
+    def get_rgba(self):
+        alpha = self._alpha[:, None]
+        rgb = numpy.where(alpha > 0, self._rgb / numpy.where(alpha > 0, alpha, 1), 0)
+        rgba = numpy.concatenate((rgb, alpha), axis = 1)
+        return numpy.rint(numpy.clip(rgba, 0, 1) * 255).astype(numpy.uint8).reshape(self.height, self.width, 4)
+
+    def draw_shape(self, kind, geometry, paint, matrix):
+        # matrix maps the shape to pixels
+        if kind == "ellipse":
+            if paint["fill"] != None:
+                self._composite(self._get_ellipse_coverage(geometry, matrix), paint["fill"], paint["fill_opacity"])
+            if paint["stroke"] != None:
+                self._composite(self._get_ellipse_coverage(geometry, matrix, paint["stroke_width"], paint["dasharray"]),
+                                paint["stroke"], paint["stroke_opacity"])
+            return
+
+        points = [_transform_point(matrix, x, y) for x, y in geometry]
+        if paint["fill"] != None and len(points) > 2:
+            self._composite(self._get_polygon_coverage(points), paint["fill"], paint["fill_opacity"])
+        if paint["stroke"] != None and len(points) > 1:
+            self._composite(self._get_polyline_coverage(points, paint["stroke_width"] * _get_matrix_scale(matrix) / 2, kind == "polygon"),
+                            paint["stroke"], paint["stroke_opacity"])
+
+    def fill_disks(self, cx, cy, r, rgb, opacity):
+        # Disks of the same color (in pixels), composited at once. With the same color the order does
+        # not matter, the remaining transparency of every pixel is the product of those of the disks
+        if len(cx) == 0:
+            return
+        i0, j0, i1, j1 = self._get_bounds()
+        half_sizes = numpy.ceil(r + 1).astype(numpy.int64)
+        all_indexes = []
+        all_alpha = []
+        for half_size in numpy.unique(half_sizes).tolist():
+            selected = half_sizes == half_size
+            offsets = numpy.arange(-half_size, half_size + 1)
+            px = (numpy.floor(cx[selected]).astype(numpy.int64)[:, None, None] + offsets[None, None, :])
+            py = (numpy.floor(cy[selected]).astype(numpy.int64)[:, None, None] + offsets[None, :, None])
+            selected_r = r[selected][:, None, None]
+            distance = numpy.hypot(px + 0.5 - cx[selected][:, None, None], py + 0.5 - cy[selected][:, None, None])
+            alpha = numpy.clip(selected_r + 0.5 - distance, 0, 1) * numpy.minimum(1.0, 4 * selected_r**2) * opacity
+            px, py, alpha = numpy.broadcast_arrays(px, py, alpha)
+            inside = (alpha > 0) & (px >= i0) & (px < i1) & (py >= j0) & (py < j1)
+            all_indexes.append((py[inside] * self.width + px[inside]).ravel())
+            all_alpha.append(alpha[inside].ravel())
+        indexes, inverse = numpy.unique(numpy.concatenate(all_indexes), return_inverse = True)
+        transparency = numpy.bincount(inverse.reshape(-1), weights = numpy.log1p(-numpy.minimum(numpy.concatenate(all_alpha), 0.999999)))
+        self._composite((indexes, -numpy.expm1(transparency)), rgb, 1.0)
+
+    def _get_bounds(self):
+        # pixels which can be drawn, [i0, i1) x [j0, j1)
+        if self.clip == None:
+            return 0, 0, self.width, self.height
+        return (max(0, int(math.ceil(self.clip[0] - 0.5))), max(0, int(math.ceil(self.clip[1] - 0.5))),
+                min(self.width, int(math.ceil(self.clip[2] - 0.5))), min(self.height, int(math.ceil(self.clip[3] - 0.5))))
+
+    def _get_pixels(self, x0, y0, x1, y1):
+        # flat indexes and centers of the pixels in the box, None if nothing can be drawn there
+        bounds = self._get_bounds()
+        i0 = max(bounds[0], int(math.floor(x0)))
+        i1 = min(bounds[2], int(math.ceil(x1)) + 1)
+        j0 = max(bounds[1], int(math.floor(y0)))
+        j1 = min(bounds[3], int(math.ceil(y1)) + 1)
+        if i0 >= i1 or j0 >= j1:
+            return None
+        px, py = numpy.meshgrid(numpy.arange(i0, i1), numpy.arange(j0, j1))
+        px = px.ravel()
+        py = py.ravel()
+        return py * self.width + px, px + 0.5, py + 0.5
+
+    def _get_ellipse_coverage(self, geometry, matrix, stroke_width = None, dasharray = None):
+        # coverage of the fill (stroke_width None) or of the stroke of the ellipse
+        cx, cy, rx, ry = geometry
+        if rx <= 0 or ry <= 0:
+            return None
+        scale = _get_matrix_scale(matrix)
+        margin = (0 if stroke_width == None else stroke_width / 2) + 1 / scale
+        corners = [_transform_point(matrix, cx + sx * (rx + margin), cy + sy * (ry + margin)) for sx in (-1, 1) for sy in (-1, 1)]
+        pixels = self._get_pixels(min([c[0] for c in corners]), min([c[1] for c in corners]),
+                                  max([c[0] for c in corners]), max([c[1] for c in corners]))
+        if pixels == None:
+            return None
+        indexes, px, py = pixels
+
+        inverse = _invert(matrix)
+        u = inverse[0] * px + inverse[2] * py + inverse[4] - cx
+        v = inverse[1] * px + inverse[3] * py + inverse[5] - cy
+        # distance to the edge, in pixels: (f - 1) / |grad f|, exact for circles
+        dx = u / rx
+        dy = v / ry
+        f = numpy.sqrt(dx * dx + dy * dy)
+        g = numpy.sqrt((dx / rx)**2 + (dy / ry)**2)
+        distance = numpy.where(g > 0, (f - 1) * f / numpy.where(g > 0, g, 1), -min(rx, ry)) * scale
+
+        if stroke_width == None:
+            # small disks are dimmed by their area, the coverage of the center pixel would be too high
+            coverage = numpy.clip(0.5 - distance, 0, 1) * min(1.0, 4 * (min(rx, ry) * scale)**2)
+        else:
+            coverage = _get_stroke_coverage(numpy.abs(distance), stroke_width * scale / 2)
+            if dasharray != None:
+                # the dashes start at (cx + rx, cy) and go in the direction of the positive angles
+                position = numpy.mod(numpy.arctan2(v, u), 2 * math.pi) * ((rx + ry) / 2)
+                coverage = coverage * numpy.clip(0.5 + _get_dash_distance(position, dasharray) * scale, 0, 1)
+        return indexes, coverage
+
+    def _get_polyline_coverage(self, points, half_width, is_closed):
+        # union of the segments, the joins are squared and the ends of open lines are butt
+        segments = list(zip(points[:-1], points[1:]))
+        if is_closed and points[0] != points[-1]:
+            segments.append((points[-1], points[0]))
+        all_indexes = []
+        all_coverage = []
+        for index, (start, end) in enumerate(segments):
+            start_cap = half_width if (is_closed or index > 0) else 0.0
+            end_cap = half_width if (is_closed or index < len(segments) - 1) else 0.0
+            segment = self._get_segment_coverage(start, end, half_width, start_cap, end_cap)
+            if segment != None:
+                all_indexes.append(segment[0])
+                all_coverage.append(segment[1])
+        if len(all_indexes) == 0:
+            return None
+        if len(all_indexes) == 1:
+            return all_indexes[0], all_coverage[0]
+        indexes, inverse = numpy.unique(numpy.concatenate(all_indexes), return_inverse = True)
+        coverage = numpy.zeros(len(indexes))
+        numpy.maximum.at(coverage, inverse.reshape(-1), numpy.concatenate(all_coverage))
+        return indexes, coverage
+
+    def _get_segment_coverage(self, start, end, half_width, start_cap, end_cap):
+        margin = half_width + max(start_cap, end_cap) + 1
+        pixels = self._get_pixels(min(start[0], end[0]) - margin, min(start[1], end[1]) - margin,
+                                  max(start[0], end[0]) + margin, max(start[1], end[1]) + margin)
+        if pixels == None:
+            return None
+        indexes, px, py = pixels
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return None
+        along = ((px - start[0]) * dx + (py - start[1]) * dy) / length
+        across = numpy.abs((px - start[0]) * dy - (py - start[1]) * dx) / length
+        coverage = (_get_stroke_coverage(across, half_width) *
+                    numpy.clip(0.5 + start_cap + along, 0, 1) *
+                    numpy.clip(0.5 + end_cap + length - along, 0, 1))
+        return indexes, coverage
+
+    def _get_polygon_coverage(self, points):
+        # even-odd fill, the coverage of every pixel is the mean of the covered length of some
+        # horizontal lines through it
+        xs = numpy.array([p[0] for p in points])
+        ys = numpy.array([p[1] for p in points])
+        bounds = self._get_bounds()
+        pixels_x0 = max(bounds[0], int(math.floor(xs.min())))
+        pixels_x1 = min(bounds[2], int(math.ceil(xs.max())))
+        pixels_y0 = max(bounds[1], int(math.floor(ys.min())))
+        pixels_y1 = min(bounds[3], int(math.ceil(ys.max())))
+        if pixels_x0 >= pixels_x1 or pixels_y0 >= pixels_y1:
+            return None
+        xa, ya = xs, ys
+        xb, yb = numpy.roll(xs, -1), numpy.roll(ys, -1)
+        columns = numpy.arange(pixels_x0, pixels_x1)
+        coverage = numpy.zeros((pixels_y1 - pixels_y0, pixels_x1 - pixels_x0))
+        for subrow in range(_polygon_subrows):
+            y = numpy.arange(pixels_y0, pixels_y1)[:, None] + (subrow + 0.5) / _polygon_subrows
+            crosses = ((ya <= y) & (y < yb)) | ((yb <= y) & (y < ya))
+            with numpy.errstate(divide = "ignore", invalid = "ignore"):
+                x = numpy.where(crosses, xa + (y - ya) * (xb - xa) / (yb - ya), numpy.inf)
+            x.sort(axis = 1)
+            for pair in range(0, x.shape[1] - 1, 2):
+                span_start = x[:, pair][:, None]
+                span_end = x[:, pair + 1][:, None]
+                valid = numpy.isfinite(span_end)
+                overlap = numpy.minimum(span_end, columns + 1) - numpy.maximum(span_start, columns)
+                coverage += numpy.where(valid, numpy.clip(overlap, 0, 1), 0)
+        coverage /= _polygon_subrows
+        px, py = numpy.meshgrid(columns, numpy.arange(pixels_y0, pixels_y1))
+        return (py * self.width + px).ravel(), coverage.ravel()
+
+    def _composite(self, coverage, rgb, opacity):
+        # source over, coverage is (flat indexes without repetitions, coverage)
+        if coverage == None:
+            return
+        indexes, alpha = coverage
+        alpha = (alpha * float(opacity)).astype(numpy.float32)
+        keep = alpha > 0
+        indexes = indexes[keep]
+        alpha = alpha[keep]
+        self._rgb[indexes] = self._rgb[indexes] * (1 - alpha)[:, None] + numpy.array(rgb, dtype = numpy.float32)[None, :] * alpha[:, None]
+        self._alpha[indexes] = self._alpha[indexes] * (1 - alpha) + alpha
+
+def write_tiles(renderer, directory, tile_size = DEFAULT_TILE_SIZE):
+    # XYZ tile pyramid (directory/zoom/x/y.png) of the chart recorded by renderer. The deepest zoom
+    # level draws the chart at the renderer resolution, every level above halves it. The tiles
+    # at the right and bottom borders continue with the chart from the other side. Memory use
+    # only depends on the tile size.
+    image_width, image_height = renderer.get_image_size()
+    max_zoom = max(0, int(math.ceil(math.log2(max(image_width, image_height) / float(tile_size)))))
+    count = 0
+    for zoom in range(0, max_zoom + 1):
+        scale = renderer.scale / 2**(max_zoom - zoom)
+        width, height = renderer.get_image_size(scale)
+        columns = int(math.ceil(width / float(tile_size)))
+        rows = int(math.ceil(height / float(tile_size)))
+        log.info("Zoom level %i: %ix%i tiles"%(zoom, columns, rows))
+        for x in range(columns):
+            tile_directory = os.path.join(directory, str(zoom), str(x))
+            if not os.path.isdir(tile_directory):
+                os.makedirs(tile_directory)
+            for y in range(rows):
+                rgba = renderer.render(scale, x * tile_size, y * tile_size, tile_size, tile_size, wrap = True)
+                write_png(os.path.join(tile_directory, "%i.png"%(y, )), rgba, scale * _svg_density)
+                count += 1
+    return count
+
+def write_png(filename, rgba, resolution = None):
+    # rgba is a (height, width, 4) uint8 array
+    with open(filename, "wb") as fh:
+        fh.write(get_png_data(rgba, resolution))
+
+def get_png_data(rgba, resolution = None):
+    height, width = rgba.shape[:2]
+    rows = numpy.empty((height, width * 4 + 1), dtype = numpy.uint8)
+    # filter type 0 (none) for every row
+    rows[:, 0] = 0
+    rows[:, 1:] = rgba.reshape(height, width * 4)
+
+    chunks = [_get_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))]
+    if resolution != None:
+        pixels_per_meter = int(round(resolution / 0.0254))
+        chunks.append(_get_png_chunk(b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1)))
+    chunks.append(_get_png_chunk(b"IDAT", zlib.compress(rows.tobytes(), _png_compression_level)))
+    chunks.append(_get_png_chunk(b"IEND", b""))
+
+    return b"\x89PNG\r\n\x1a\n" + b"".join(chunks)
+
+def _get_png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+def _get_element_style(style, attribs):
+    style = dict(style)
+    for name, value in attribs.items():
+        if name in _inherited_attribs and value is not None:
+            style[name] = _get_style_key(value)
+    return style
+
+def _get_rgb(value):
+    # None is the initial fill (black)
+    if value == None:
+        return _named_colors["black"]
+    if value == "none":
+        return None
+    if value in _named_colors:
+        return _named_colors[value]
+    assert isinstance(value, str) and value.startswith("#") and len(value) == 7, "Unsupported color: %s"%(value, )
+    return tuple([int(value[i:i+2], 16) / 255.0 for i in (1, 3, 5)])
+
+def _get_dasharray(value):
+    if value == "none":
+        return None
+    dashes = [float(v) for v in re.split(r"[\s,]+", str(value).strip()) if v]
+    if len(dashes) % 2 == 1:
+        dashes = dashes * 2
+    return dashes if sum(dashes) > 0 else None
+
+def _get_dash_distance(position, dashes):
+    # signed distance (positive inside) to the nearest dash, for positions along the path
+    period = sum(dashes)
+    position = numpy.mod(position, period)
+    distance = numpy.full(position.shape, -numpy.inf)
+    start = 0.0
+    for index, length in enumerate(dashes):
+        if index % 2 == 0:
+            for shift in (-period, 0, period):
+                distance = numpy.maximum(distance, numpy.minimum(position - (start + shift), (start + shift + length) - position))
+        start += length
+    return distance
+
+def _get_grid_cells(values, start, size, count):
+    # cells of a grid of count cells of size from start, the values outside are in the first or last one
+    return numpy.clip(numpy.floor((values - start) / size), 0, count - 1).astype(numpy.int64)
+
+def _get_stroke_coverage(distance, half_width):
+    # thin strokes are dimmed by their width
+    return numpy.clip(numpy.minimum(half_width + 0.5 - distance, 2 * half_width), 0, 1)
+
+def _parse_transform(text):
+    matrix = _identity
+    if text == None:
+        return matrix
+    for name, values in _transform_re.findall(text):
+        values = [float(v) for v in re.split(r"[\s,]+", values.strip()) if v]
+        if name == "matrix":
+            current = tuple(values)
+        elif name == "translate":
+            current = (1.0, 0.0, 0.0, 1.0, values[0], values[1] if len(values) > 1 else 0.0)
+        elif name == "scale":
+            current = (values[0], 0.0, 0.0, values[1] if len(values) > 1 else values[0], 0.0, 0.0)
+        elif name == "rotate":
+            angle = math.radians(values[0])
+            current = (math.cos(angle), math.sin(angle), -math.sin(angle), math.cos(angle), 0.0, 0.0)
+            if len(values) == 3:
+                current = _multiply(_multiply((1.0, 0.0, 0.0, 1.0, values[1], values[2]), current),
+                                    (1.0, 0.0, 0.0, 1.0, -values[1], -values[2]))
+        matrix = _multiply(matrix, current)
+    return matrix
+
+def _multiply(m, n):
+    # SVG matrices (a, b, c, d, e, f), m applied after n
+    return (m[0] * n[0] + m[2] * n[1],
+            m[1] * n[0] + m[3] * n[1],
+            m[0] * n[2] + m[2] * n[3],
+            m[1] * n[2] + m[3] * n[3],
+            m[0] * n[4] + m[2] * n[5] + m[4],
+            m[1] * n[4] + m[3] * n[5] + m[5])
+
+def _invert(m):
+    determinant = m[0] * m[3] - m[1] * m[2]
+    return (m[3] / determinant,
+            -m[1] / determinant,
+            -m[2] / determinant,
+            m[0] / determinant,
+            (m[2] * m[5] - m[3] * m[4]) / determinant,
+            (m[1] * m[4] - m[0] * m[5]) / determinant)
+
+def _transform_point(m, x, y):
+    return (m[0] * x + m[2] * y + m[4], m[1] * x + m[3] * y + m[5])
+
+def _get_matrix_scale(m):
+    return math.sqrt(abs(m[0] * m[3] - m[1] * m[2]))
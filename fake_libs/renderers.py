@@ -0,0 +1,615 @@
+import io
+import os
+import gzip
+import base64
+import collections
+import itertools
+import svgwrite
+import svgwrite.container
+from .log_stuff import init_logger
+
+log = init_logger()
+
+RENDERER_VALIDATED = "validated"
+RENDERER_STREAMING = "streaming"
+KNOWN_RENDERERS = (RENDERER_VALIDATED,
+                   RENDERER_STREAMING
+                  )
+
+LAYER_BOX = "box"
+LAYER_GRID = "grid"
+LAYER_CONSTELLATIONS = "constellations"
+LAYER_GALAXIES = "galaxies"
+LAYER_OPEN_CLUSTERS = "open_clusters"
+LAYER_GLOBULAR_CLUSTERS = "globular_clusters"
+LAYER_STARS = "stars"
+LAYER_NAMES = "names"
+KNOWN_LAYERS = (LAYER_BOX,
+                LAYER_GRID,
+                LAYER_CONSTELLATIONS,
+                LAYER_GALAXIES,
+                LAYER_OPEN_CLUSTERS,
+                LAYER_GLOBULAR_CLUSTERS,
+                LAYER_STARS,
+                LAYER_NAMES,
+               )
+
+# how stars are drawn as paths, see Renderer.add_dots()
+STAR_PATHS_OFF = "off"
+STAR_PATHS_DOTS = "dots"
+STAR_PATHS_ARCS = "arcs"
+KNOWN_STAR_PATHS = (STAR_PATHS_OFF,
+                    STAR_PATHS_DOTS,
+                    STAR_PATHS_ARCS,
+                   )
+
+# what is done with the stars smaller than a pixel at the level of detail resolution
+LOD_MODE_DROP = "drop"
+LOD_MODE_BACKGROUND = "background"
+KNOWN_LOD_MODES = (LOD_MODE_DROP,
+                   LOD_MODE_BACKGROUND,
+                  )
+# user units per inch, as used by the rasterizers to convert a DPI resolution to pixels
+SVG_DENSITY = 96.0
+
+SVGZ_EXTENSION = ".svgz"
+DEFAULT_COMPRESSION_LEVEL = 9
+
+_xml_header = '<?xml version="1.0" encoding="utf-8" ?>\n'
+_svg_namespaces = (("xmlns", "http://www.w3.org/2000/svg"),
+                   ("xmlns:ev", "http://www.w3.org/2001/xml-events"),
+                   ("xmlns:xlink", "http://www.w3.org/1999/xlink"),
+                  )
+
+# Inherited presentation attributes and their SVG initial values (None when there is
+# no initial value worth comparing against). An attribute which is equal to the value
+# it would inherit anyway is redundant
+_inherited_attribs = {"fill" : None,
+                      "fill_opacity" : "1",
+                      "stroke" : "none",
+                      "stroke_opacity" : "1",
+                      "stroke_width" : "1",
+                      "stroke_dasharray" : "none",
+                      "font_size" : None,
+                      "font_family" : None,
+                      "text_anchor" : "start",
+                     }
+# with minify, opacities are written with the decimals that an 8 bit alpha needs
+_opacity_attribs = ("opacity", "fill_opacity", "stroke_opacity")
+_opacity_precision = 3
+# with minify, other numbers without leading or trailing zeros
+_number_attribs = ("stroke_width", "font_size")
+
+def get_renderer(renderer, filename, size, precision = None, minify = False, compression_level = DEFAULT_COMPRESSION_LEVEL, keep_document = False):
+    # Files with the .svgz extension are written gzip compressed. With keep_document the
+    # (uncompressed) document is also kept in memory as renderer.document once it is saved
+    assert renderer in KNOWN_RENDERERS, "Invalid renderer: %s (known %s)"%(renderer, ", ".join(KNOWN_RENDERERS))
+    log.info("Writting %s using the %s renderer"%(filename, renderer))
+    if renderer == RENDERER_VALIDATED:
+        return ValidatedRenderer(filename, size, precision = precision, minify = minify, compression_level = compression_level, keep_document = keep_document)
+    if renderer == RENDERER_STREAMING:
+        return StreamingRenderer(filename, size, precision = precision, minify = minify, compression_level = compression_level, keep_document = keep_document)
+    raise Exception("Internal error, unimplemented renderer: %s"%(renderer, ))
+
+class Renderer:
+    # Interface used to write the layers of a chart. Elements are added to the last group
+    # which was started. Attribute names follow the svgwrite convention, that is,
+    # underscores are written as hyphens (fill_opacity -> fill-opacity).
+    #
+    # precision is a dict layer -> number of decimals (None for full precision) used for the
+    # coordinates and sizes of the elements of each layer. With minify, attributes which are
+    # equal to the inherited value are not written.
+    def __init__(self, filename, size, precision = None, minify = False, compression_level = DEFAULT_COMPRESSION_LEVEL, keep_document = False):
+        self.filename = filename
+        self.size = size
+        self.compressed = is_svgz(filename)
+        self.compression_level = compression_level
+        # uncompressed size of the document, known once it is saved
+        self.written_size = None
+        self.keep_document = keep_document
+        # document as utf-8 bytes, known once it is saved if keep_document is set
+        self.document = None
+        self.precision = {} if precision == None else precision
+        self.minify = minify
+        self.layer = None
+        self.layer_sizes = collections.OrderedDict()
+        self._format = None
+        self._format_opacity = _get_number_formatter(_opacity_precision, True) if minify else None
+        self._format_number = _get_number_formatter(None, True) if minify else None
+        self._styles = [{name : None if value == None else _get_style_key(value) for name, value in _inherited_attribs.items()}]
+
+    def begin_layer(self, layer, **attribs):
+        assert layer in KNOWN_LAYERS, "Invalid layer: %s"%(layer, )
+        assert self.layer == None, "Layer %s was not ended"%(self.layer, )
+        self.layer = layer
+        self._format = _get_number_formatter(self.precision.get(layer), self.minify)
+        self.begin_group(**attribs)
+
+    def end_layer(self):
+        assert self.layer != None, "No layer to end"
+        self.end_group()
+        self.layer = None
+        self._format = None
+
+    def begin_group(self, **attribs):
+        style = dict(self._styles[-1])
+        for name, value in attribs.items():
+            if name in _inherited_attribs and value is not None:
+                style[name] = _get_style_key(self._get_minified_value(name, value))
+        attribs = self._get_attribs(attribs)
+        self._styles.append(style)
+        self._begin_group(attribs)
+
+    def end_group(self):
+        assert len(self._styles) > 1, "No group to end"
+        self._styles.pop()
+        self._end_group()
+
+    def add_circle(self, center, r, **attribs):
+        self._add_circle(self._format_point(center), self._format_value(r), self._get_attribs(attribs))
+
+    def add_circles(self, cx, cy, r, fill, fill_opacity):
+        # One circle per item of the given sequences
+        if self._format != None:
+            cx = [self._format(v) for v in cx]
+            cy = [self._format(v) for v in cy]
+            r = [self._format(v) for v in r]
+        if self.minify:
+            fill = self._strip_inherited_values("fill", fill)
+            fill_opacity = self._strip_inherited_values("fill_opacity", fill_opacity)
+        self._add_circles(cx, cy, r, fill, fill_opacity)
+
+    def begin_definitions(self):
+        # Elements added until end_definitions() are not drawn, they are glyphs for add_use(). They
+        # inherit the style from where they are used
+        self._styles.append(dict(self._styles[-1]))
+        self._begin_definitions()
+
+    def end_definitions(self):
+        self.end_group()
+
+    def add_use(self, href, insert, rotate = None, scale = None, **attribs):
+        # Instance of the glyph with id href at insert, optionally rotated (degrees) and scaled
+        x, y = self._format_point(insert)
+        if rotate == None and scale == None:
+            self._add_use(href, (x, y), self._get_attribs(attribs))
+            return
+        transform = "translate(%s %s)"%(x, y)
+        if rotate != None:
+            transform += " rotate(%s)"%(rotate, )
+        if scale != None:
+            transform += " scale(%s)"%(self._format_value(scale), )
+        self._add_use(href, None, self._get_attribs(dict(attribs, transform = transform)))
+
+    def add_uses(self, href, x, y, fill, fill_opacity):
+        # One glyph instance per item of the given sequences
+        if self._format != None:
+            x = [self._format(v) for v in x]
+            y = [self._format(v) for v in y]
+        if self.minify:
+            fill = self._strip_inherited_values("fill", fill)
+            fill_opacity = self._strip_inherited_values("fill_opacity", fill_opacity)
+        self._add_uses(href, x, y, fill, fill_opacity)
+
+    def add_path(self, chains, **attribs):
+        # A single path of (points, is_closed) chains
+        format_value = str if self._format == None else self._format
+        d = []
+        for points, is_closed in chains:
+            d.append("M%s %sL"%(format_value(points[0][0]), format_value(points[0][1])))
+            d.append(" ".join(["%s %s"%(format_value(x), format_value(y)) for x, y in points[1:]]))
+            if is_closed:
+                d.append("Z")
+        self._add_path("".join(d), self._get_attribs(attribs))
+
+    def add_dots(self, x, y, r, color, opacity, mode = STAR_PATHS_DOTS):
+        # All the points as dots of radius r in a single path. With STAR_PATHS_DOTS every dot is a
+        # zero length subpath stroked with round caps, with STAR_PATHS_ARCS every dot is a filled
+        # circle made of two arcs (bigger, but drawn by every rasterizer)
+        assert mode in (STAR_PATHS_DOTS, STAR_PATHS_ARCS), "Invalid mode for dots: %s"%(mode, )
+        format_value = str if self._format == None else self._format
+        if mode == STAR_PATHS_DOTS:
+            d = "".join(["M%s %sh0"%(format_value(px), format_value(py)) for px, py in zip(x, y)])
+            attribs = dict(fill = "none",
+                           stroke = color,
+                           stroke_opacity = opacity,
+                           stroke_width = format_value(r * 2),
+                           stroke_linecap = "round")
+        else:
+            radius = format_value(r)
+            diameter = format_value(r * 2)
+            arcs = "a%s %s 0 1 0 %s 0a%s %s 0 1 0 -%s 0"%(radius, radius, diameter, radius, radius, diameter)
+            d = "".join(["M%s %s%s"%(format_value(px - r), format_value(py), arcs) for px, py in zip(x, y)])
+            attribs = dict(fill = color,
+                           fill_opacity = opacity)
+        self._add_path(d, self._get_attribs(attribs))
+
+    def add_ellipse(self, center, r, **attribs):
+        self._add_ellipse(self._format_point(center), self._format_point(r), self._get_attribs(attribs))
+
+    def add_line(self, start, end, **attribs):
+        self._add_line(self._format_point(start), self._format_point(end), self._get_attribs(attribs))
+
+    def add_polyline(self, points, **attribs):
+        self._add_polyline([self._format_point(p) for p in points], self._get_attribs(attribs))
+
+    def add_polygon(self, points, **attribs):
+        self._add_polygon([self._format_point(p) for p in points], self._get_attribs(attribs))
+
+    def add_text(self, text, insert, **attribs):
+        self._add_text(text, self._format_point(insert), self._get_attribs(attribs))
+
+    def add_image(self, href, insert, size, **attribs):
+        self._add_image(href, self._format_point(insert), self._format_point(size), self._get_attribs(attribs))
+
+    def add_star_image(self, x, y, r, fill, fill_opacity, resolution):
+        # Stars merged into a single PNG image of the whole chart at resolution (DPI), for the stars
+        # which are too small to be worth an element each
+        from .raster import RasterRenderer
+        raster = RasterRenderer(None, self.size, resolution = resolution)
+        raster.add_circles(x, y, r, fill, fill_opacity)
+        href = "data:image/png;base64," + base64.b64encode(raster.get_png_data()).decode("ascii")
+        self.add_image(href, (0, 0), self.size, preserveAspectRatio = "none")
+
+    def save(self):
+        assert self.layer == None, "Layer %s was not ended"%(self.layer, )
+        assert len(self._styles) == 1, "There are groups which were not ended"
+        self._save()
+
+    def _add_layer_size(self, layer, size):
+        self.layer_sizes[layer] = self.layer_sizes.get(layer, 0) + size
+
+    def _format_value(self, value):
+        return value if self._format == None else self._format(value)
+
+    def _format_point(self, point):
+        if self._format == None:
+            return point
+        return (self._format(point[0]), self._format(point[1]))
+
+    def _get_attribs(self, attribs):
+        # None values are not written, neither (with minify) values which are already inherited
+        style = self._styles[-1]
+        result = {}
+        for name, value in attribs.items():
+            if value is None:
+                continue
+            value = self._get_minified_value(name, value)
+            if self.minify and name in _inherited_attribs and style[name] == _get_style_key(value):
+                continue
+            result[name] = value
+        return result
+
+    def _get_minified_value(self, name, value):
+        if self._format_opacity != None and name in _opacity_attribs:
+            return self._format_opacity(value)
+        if self._format_number != None and name in _number_attribs:
+            return self._format_number(value)
+        return value
+
+    def _strip_inherited_values(self, name, values):
+        inherited = self._styles[-1][name]
+        stripped = {}
+        result = []
+        for value in values:
+            if value not in stripped:
+                minified = self._get_minified_value(name, value)
+                stripped[value] = None if _get_style_key(minified) == inherited else minified
+            result.append(stripped[value])
+        return result
+
+    def _add_circles(self, cx, cy, r, fill, fill_opacity):
+        for circle in zip(cx, cy, r, fill, fill_opacity):
+            self._add_circle((circle[0], circle[1]), circle[2], self._get_attribs({"fill" : circle[3], "fill_opacity" : circle[4]}))
+
+    def _add_uses(self, href, x, y, fill, fill_opacity):
+        for use in zip(href, x, y, fill, fill_opacity):
+            self._add_use(use[0], (use[1], use[2]), self._get_attribs({"fill" : use[3], "fill_opacity" : use[4]}))
+
+    def _begin_definitions(self):
+        raise NotImplementedError()
+
+    def _add_use(self, href, insert, attribs):
+        raise NotImplementedError()
+
+    def _add_path(self, d, attribs):
+        raise NotImplementedError()
+
+    def _begin_group(self, attribs):
+        raise NotImplementedError()
+
+    def _end_group(self):
+        raise NotImplementedError()
+
+    def _add_circle(self, center, r, attribs):
+        raise NotImplementedError()
+
+    def _add_ellipse(self, center, r, attribs):
+        raise NotImplementedError()
+
+    def _add_line(self, start, end, attribs):
+        raise NotImplementedError()
+
+    def _add_polyline(self, points, attribs):
+        raise NotImplementedError()
+
+    def _add_polygon(self, points, attribs):
+        raise NotImplementedError()
+
+    def _add_text(self, text, insert, attribs):
+        raise NotImplementedError()
+
+    def _add_image(self, href, insert, size, attribs):
+        raise NotImplementedError()
+
+    def _save(self):
+        raise NotImplementedError()
+
+class ValidatedRenderer(Renderer):
+    # Builds the whole document as a svgwrite DOM, every element and attribute is validated.
+    # Nothing is written until save() is called.
+    def __init__(self, filename, size, precision = None, minify = False, compression_level = DEFAULT_COMPRESSION_LEVEL, keep_document = False):
+        Renderer.__init__(self, filename, size, precision = precision, minify = minify, compression_level = compression_level, keep_document = keep_document)
+        self._dwg = svgwrite.Drawing(filename = filename, debug = True, size = size)
+        self._groups = [self._dwg]
+        self._layers = []
+
+    def begin_layer(self, layer, **attribs):
+        Renderer.begin_layer(self, layer, **attribs)
+        self._layers.append((layer, self._groups[-1]))
+
+    def _begin_group(self, attribs):
+        self._groups.append(self._groups[-1].add(self._dwg.g(**attribs)))
+
+    def _end_group(self):
+        self._groups.pop()
+
+    def _begin_definitions(self):
+        self._groups.append(self._groups[-1].add(svgwrite.container.Defs()))
+
+    def _add_use(self, href, insert, attribs):
+        self._groups[-1].add(self._dwg.use("#" + href, insert = insert, **attribs))
+
+    def _add_path(self, d, attribs):
+        self._groups[-1].add(self._dwg.path(d = d, **attribs))
+
+    def _add_circle(self, center, r, attribs):
+        self._groups[-1].add(self._dwg.circle(center = center, r = r, **attribs))
+
+    def _add_ellipse(self, center, r, attribs):
+        self._groups[-1].add(self._dwg.ellipse(center = center, r = r, **attribs))
+
+    def _add_line(self, start, end, attribs):
+        self._groups[-1].add(self._dwg.line(start = start, end = end, **attribs))
+
+    def _add_polyline(self, points, attribs):
+        self._groups[-1].add(self._dwg.polyline(points = points, **attribs))
+
+    def _add_polygon(self, points, attribs):
+        self._groups[-1].add(self._dwg.polygon(points = points, **attribs))
+
+    def _add_text(self, text, insert, attribs):
+        self._groups[-1].add(self._dwg.text(text, insert = insert, **attribs))
+
+    def _add_image(self, href, insert, size, attribs):
+        self._groups[-1].add(self._dwg.image(href, insert = insert, size = size, **attribs))
+
+    def _save(self):
+        fh = _OutputFile(self.filename, self.compression_level, self.keep_document)
+        self._dwg.write(fh)
+        fh.close()
+        self.written_size = fh.written_size
+        self.document = fh.document
+        for layer, group in self._layers:
+            self._add_layer_size(layer, len(group.tostring().encode("utf-8")))
+
+class StreamingRenderer(Renderer):
+    # Writes every element to the output file as soon as it is added, without building
+    # a DOM and without validation. The output is the same the validated renderer writes.
+    _chunk_size = 10000
+
+    def __init__(self, filename, size, precision = None, minify = False, compression_level = DEFAULT_COMPRESSION_LEVEL, keep_document = False):
+        Renderer.__init__(self, filename, size, precision = precision, minify = minify, compression_level = compression_level, keep_document = keep_document)
+        self._fh = _OutputFile(filename, compression_level, keep_document)
+        self._layer_start = 0
+        self._end_tags = []
+        attribs = dict(_svg_namespaces)
+        attribs.update(baseProfile = "full", version = "1.1", width = size[0], height = size[1])
+        self._write(_xml_header)
+        self._write(_get_start_tag("svg", attribs))
+        self._write("<defs />")
+
+    def _write(self, text):
+        self._fh.write(text)
+
+    def begin_layer(self, layer, **attribs):
+        self._layer_start = self._fh.written_size
+        Renderer.begin_layer(self, layer, **attribs)
+
+    def end_layer(self):
+        layer = self.layer
+        Renderer.end_layer(self)
+        self._add_layer_size(layer, self._fh.written_size - self._layer_start)
+
+    def _write_element(self, tag, attribs):
+        self._write(_get_start_tag(tag, attribs, close = True))
+
+    def _begin_group(self, attribs):
+        self._write(_get_start_tag("g", attribs))
+        self._end_tags.append("</g>")
+
+    def _end_group(self):
+        self._write(self._end_tags.pop())
+
+    def _begin_definitions(self):
+        self._write("<defs>")
+        self._end_tags.append("</defs>")
+
+    def _add_use(self, href, insert, attribs):
+        if insert != None:
+            attribs = dict(attribs, x = insert[0], y = insert[1])
+        attribs["xlink:href"] = "#" + href
+        self._write_element("use", attribs)
+
+    def _add_path(self, d, attribs):
+        self._write_element("path", dict(attribs, d = d))
+
+    def _add_uses(self, href, x, y, fill, fill_opacity):
+        # Fast path for the star layer, attributes in the same (sorted) order as _get_start_tag
+        self._write_fast_elements('<use%s%s x="%s" xlink:href="#%s" y="%s" />',
+                                  zip(_get_attrib_strings("fill", fill), _get_attrib_strings("fill-opacity", fill_opacity), x, href, y))
+
+    def _add_circle(self, center, r, attribs):
+        self._write_element("circle", dict(attribs, cx = center[0], cy = center[1], r = r))
+
+    def _add_circles(self, cx, cy, r, fill, fill_opacity):
+        # Fast path for the star layer, attributes in the same (sorted) order as _get_start_tag
+        self._write_fast_elements('<circle cx="%s" cy="%s"%s%s r="%s" />',
+                                  zip(cx, cy, _get_attrib_strings("fill", fill), _get_attrib_strings("fill-opacity", fill_opacity), r))
+
+    def _write_fast_elements(self, template, elements):
+        while True:
+            chunk = [template%e for e in itertools.islice(elements, self._chunk_size)]
+            if len(chunk) == 0:
+                break
+            self._write("".join(chunk))
+
+    def _add_ellipse(self, center, r, attribs):
+        self._write_element("ellipse", dict(attribs, cx = center[0], cy = center[1], rx = r[0], ry = r[1]))
+
+    def _add_line(self, start, end, attribs):
+        self._write_element("line", dict(attribs, x1 = start[0], y1 = start[1], x2 = end[0], y2 = end[1]))
+
+    def _add_polyline(self, points, attribs):
+        self._write_element("polyline", dict(attribs, points = _get_points_string(points)))
+
+    def _add_polygon(self, points, attribs):
+        self._write_element("polygon", dict(attribs, points = _get_points_string(points)))
+
+    def _add_text(self, text, insert, attribs):
+        self._write(_get_start_tag("text", dict(attribs, x = insert[0], y = insert[1])))
+        self._write(_escape_text(text))
+        self._write("</text>")
+
+    def _add_image(self, href, insert, size, attribs):
+        attribs = dict(attribs, x = insert[0], y = insert[1], width = size[0], height = size[1])
+        attribs["xlink:href"] = href
+        self._write_element("image", attribs)
+
+    def _save(self):
+        self._write("</svg>")
+        self._fh.close()
+        self.written_size = self._fh.written_size
+        self.document = self._fh.document
+
+class _OutputFile:
+    # Text output file, gzip compressed on the fly for .svgz files. Keeps the count of
+    # the (uncompressed) bytes written and, with keep_document, the text itself
+    def __init__(self, filename, compression_level = DEFAULT_COMPRESSION_LEVEL, keep_document = False):
+        self.written_size = 0
+        self.document = None
+        self._chunks = [] if keep_document else None
+        if is_svgz(filename):
+            assert 1 <= compression_level <= 9, "Invalid compression level: %s"%(compression_level, )
+            # mtime = 0, the same chart is always compressed to the same file
+            self._fh = io.TextIOWrapper(gzip.GzipFile(filename, mode = "wb", compresslevel = compression_level, mtime = 0),
+                                        encoding = "utf-8")
+        else:
+            self._fh = io.open(filename, mode = "w", encoding = "utf-8")
+
+    def write(self, text):
+        self._fh.write(text)
+        self.written_size += len(text.encode("utf-8"))
+        if self._chunks != None:
+            self._chunks.append(text)
+
+    def close(self):
+        self._fh.close()
+        if self._chunks != None:
+            self.document = "".join(self._chunks).encode("utf-8")
+            self._chunks = None
+
+def is_svgz(filename):
+    return filename != None and os.path.splitext(filename)[1].lower() == SVGZ_EXTENSION
+
+def read_svg(filename):
+    # SVG document as bytes, either from a plain or from a gzip compressed (.svgz) file
+    with open(filename, "rb") as fh:
+        magic = fh.read(2)
+    if magic == b"\x1f\x8b":
+        with gzip.open(filename, "rb") as fh:
+            return fh.read()
+    with open(filename, "rb") as fh:
+        return fh.read()
+
+def log_layer_sizes(renderer):
+    # Per layer byte breakdown of the written file, before compression
+    total = renderer.written_size
+    log.info("Size of %s: %i bytes"%(renderer.filename, total))
+    if renderer.compressed:
+        compressed = os.path.getsize(renderer.filename)
+        log.info("Compressed size of %s: %i bytes (%.1f%%)"%(renderer.filename, compressed, 100.0 * compressed / total))
+    rest = total
+    for layer, size in renderer.layer_sizes.items():
+        log.info("    %-20s %10i bytes %5.1f%%"%(layer, size, 100.0 * size / total))
+        rest -= size
+    log.info("    %-20s %10i bytes %5.1f%%"%("other", rest, 100.0 * rest / total))
+
+def _get_number_formatter(precision, minify):
+    # None when the numbers are written as they are
+    if precision == None and not minify:
+        return None
+
+    def format_number(value):
+        value = float(value)
+        if precision != None:
+            value = round(value, precision)
+        text = repr(value)
+        if text.endswith(".0"):
+            text = text[:-2]
+        if minify:
+            if text.startswith("0."):
+                text = text[1:]
+            elif text.startswith("-0."):
+                text = "-" + text[2:]
+        if text == "-0":
+            text = "0"
+        return text
+    return format_number
+
+def _get_style_key(value):
+    # Normalized value used to compare style attributes, 1, 1.0 and "1.0" are the same value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value).strip().lower()
+
+def _get_attrib_strings(name, values):
+    # ' name="value"' for every value, an empty string for None values
+    attrib_strings = {}
+    for value in set(values):
+        attrib_strings[value] = "" if value is None else ' %s="%s"'%(name, _escape_attrib(str(value)))
+    return [attrib_strings[v] for v in values]
+
+def _get_points_string(points):
+    return " ".join(["%s,%s"%(x, y) for x, y in points])
+
+def _get_start_tag(tag, attribs, close = False):
+    items = []
+    for name, value in attribs.items():
+        if value is None:
+            continue
+        value = str(value)
+        # just add not empty attributes, as svgwrite does
+        if value:
+            items.append((name.replace("_", "-"), value))
+    items.sort()
+    return "<%s%s%s>"%(tag,
+                       "".join([' %s="%s"'%(name, _escape_attrib(value)) for name, value in items]),
+                       " /" if close else "")
+
+def _escape_text(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _escape_attrib(value):
+    return _escape_text(value).replace('"', "&quot;").replace("\r", "&#13;").replace("\n", "&#10;").replace("\t", "&#09;")
@@ -0,0 +1,159 @@
+import collections
+import gzip
+import json
+import numpy
+from .log_stuff import init_logger
+from .charts import get_drawn_star_rows, get_star_colors, get_constellation_chains
+
+log = init_logger()
+
+# Compact description of a chart, to be drawn by a client (e.g. in a <canvas>) instead of the SVG.
+#
+# The scene is a JSON object:
+#   format, version  "fake_sky_scene", SCENE_VERSION
+#   width, height    size of the chart
+#   scale            coordinates and sizes are integers, in 1/scale chart units
+#   palette          colors as "#RRGGBBAA", every other color is an index of this table (null for none)
+#   styles           per layer stroke, fill, stroke_width (and dash, font), as in the SVG
+#   box              [x0, y0, x1, y1], grid: lines {"x": [...], "y": [...]}
+#   stars            {"x", "y", "r", "color"}: one entry per star, "hidden" lists the stars
+#                    which are not drawn (copies only used by the constellations)
+#   constellations   [{"name", "color", "labels": [[x, y], ...], "chains": [...], "closed": [...]}],
+#                    every chain is a list of star indexes, the first one absolute and the rest
+#                    as the difference to the previous one
+#   galaxies         {"x", "y", "r", "eccentricity" (1/1000), "rotate" (degrees)}
+#   open_clusters, globular_clusters  {"x", "y", "r"}
+SCENE_FORMAT = "fake_sky_scene"
+SCENE_VERSION = 1
+DEFAULT_SCENE_PRECISION = 1
+
+_eccentricity_scale = 1000
+
+def export_scene(chart, filename, precision = DEFAULT_SCENE_PRECISION):
+    # chart is the object returned by charts.generate_chart. Returns the written document (bytes)
+    log.info("Exporting scene %s"%(filename, ))
+    document = json.dumps(get_scene(chart, precision), separators = (",", ":")).encode("utf-8")
+    with open(filename, "wb") as fh:
+        fh.write(document)
+    return document
+
+def log_scene_size(scene_document, svg_document):
+    # Size of the scene compared with the SVG, both plain and gzip compressed
+    sizes = []
+    for name, document in (("SVG", svg_document), ("scene", scene_document)):
+        sizes.append((name, len(document), len(gzip.compress(document, 9, mtime = 0))))
+    svg_size, svg_compressed_size = sizes[0][1:]
+    for name, size, compressed_size in sizes:
+        log.info("    %-6s %10i bytes %6.1f%%, gzip %10i bytes %6.1f%%"%(name, size, 100.0 * size / svg_size,
+                                                                        compressed_size, 100.0 * compressed_size / svg_compressed_size))
+
+def get_scene(chart, precision = DEFAULT_SCENE_PRECISION):
+    config = chart.config
+    star_table = chart.star_table
+    scale = 10**precision
+    palette = _ScenePalette()
+
+    scene = collections.OrderedDict()
+    scene["format"] = SCENE_FORMAT
+    scene["version"] = SCENE_VERSION
+    scene["width"] = chart.width
+    scene["height"] = chart.height
+    scene["scale"] = scale
+    scene["palette"] = palette.colors
+    scene["styles"] = _get_styles(config, palette)
+
+    q_w = 0 if chart.central_quadrant == None else chart.central_quadrant.w
+    q_h = 0 if chart.central_quadrant == None else chart.central_quadrant.h
+    scene["box"] = _quantize([q_w, q_h, q_w + config.box_size.width, q_h + config.box_size.height], scale)
+    if config.add_grid:
+        scene["grid"] = {"x" : _quantize([q_w + config.box_size.width / (1 + config.grid_line_count_horizontal) * (i + 1)
+                                          for i in range(config.grid_line_count_horizontal)], scale),
+                         "y" : _quantize([q_h + config.box_size.height / (1 + config.grid_line_count_vertical) * (i + 1)
+                                          for i in range(config.grid_line_count_vertical)], scale)}
+
+    # stars of the constellations go first, in the order of the chains, so the differences
+    # between consecutive star indexes are small
+    star_index = collections.OrderedDict()
+    constellations = []
+    if config.add_constellations:
+        labels = collections.OrderedDict()
+        for constellation in chart.constellations:
+            master = constellation if constellation.master_constellation == None else constellation.master_constellation
+            labels.setdefault(master, []).append(_quantize(constellation.get_mean_position(), scale))
+        for constellation, chains in get_constellation_chains(chart.constellations).items():
+            encoded_chains = []
+            for star_ids, is_closed in chains:
+                indexes = [star_index.setdefault(int(star_id), len(star_index)) for star_id in star_ids]
+                encoded_chains.append(numpy.diff(indexes, prepend = 0).tolist())
+            constellations.append(collections.OrderedDict((("name", constellation.get_display_name() if config.constellation_name_enable else None),
+                                                           ("color", None if constellation.custom_color == None else palette.add_color(constellation.custom_color)),
+                                                           ("labels", labels[constellation]),
+                                                           ("chains", encoded_chains),
+                                                           ("closed", [int(is_closed) for star_ids, is_closed in chains]))))
+    drawn_rows = get_drawn_star_rows(chart)
+    drawn_set = set(drawn_rows)
+    for row in drawn_rows:
+        star_index.setdefault(int(row), len(star_index))
+    rows = list(star_index.keys())
+    fills, fill_opacities = get_star_colors(star_table, rows)
+    scene["stars"] = collections.OrderedDict((("x", _quantize(star_table.w[rows], scale)),
+                                              ("y", _quantize(star_table.h[rows], scale)),
+                                              ("r", _quantize(star_table.size[rows], scale)),
+                                              ("color", [palette.add(fill, opacity) for fill, opacity in zip(fills, fill_opacities)]),
+                                              ("hidden", [index for index, row in enumerate(rows) if row not in drawn_set])))
+    scene["constellations"] = constellations
+
+    if config.add_galaxies:
+        galaxies = chart.galaxies
+        scene["galaxies"] = collections.OrderedDict((("x", _quantize([galaxy.w for galaxy in galaxies], scale)),
+                                                     ("y", _quantize([galaxy.h for galaxy in galaxies], scale)),
+                                                     ("r", _quantize([galaxy.size for galaxy in galaxies], scale)),
+                                                     ("eccentricity", _quantize([galaxy.params["eccentricity"] for galaxy in galaxies], _eccentricity_scale)),
+                                                     ("rotate", [int(galaxy.params["rotate"]) for galaxy in galaxies])))
+    for name, enabled, dsos in (("open_clusters", config.add_open_clusters, chart.open_clusters),
+                                ("globular_clusters", config.add_globular_clusters, chart.globular_clusters)):
+        if enabled:
+            scene[name] = collections.OrderedDict((("x", _quantize([dso.w for dso in dsos], scale)),
+                                                   ("y", _quantize([dso.h for dso in dsos], scale)),
+                                                   ("r", _quantize([dso.size for dso in dsos], scale))))
+    log.info("Scene with %i stars (%i hidden), %i constellations"%(len(rows), len(scene["stars"]["hidden"]), len(constellations)))
+    return scene
+
+def _get_styles(config, palette):
+    styles = collections.OrderedDict()
+    styles["box"] = _get_style(palette, config.box_stroke_color, config.box_stroke_width, config.box_fill_color)
+    styles["grid"] = _get_style(palette, config.grid_stroke_color, config.grid_stroke_width)
+    styles["constellations"] = _get_style(palette, config.constellation_stroke_color, config.constellation_stroke_width)
+    styles["galaxies"] = _get_style(palette, config.galaxies_stroke_color, config.galaxies_stroke_width, config.galaxies_fill_color)
+    styles["open_clusters"] = _get_style(palette, config.open_clusters_stroke_color, config.open_clusters_stroke_width, config.open_clusters_fill_color)
+    styles["open_clusters"]["dash"] = config.open_clusters_stroke_dash_size
+    styles["globular_clusters"] = _get_style(palette, config.globular_clusters_stroke_color, config.globular_clusters_stroke_width, config.globular_clusters_fill_color)
+    font = config.constellation_name_font
+    styles["names"] = collections.OrderedDict((("fill", palette.add_color(font.color)),
+                                               ("font_size", font.size),
+                                               ("font_family", font.font_family)))
+    return styles
+
+def _get_style(palette, stroke, stroke_width, fill = None):
+    return collections.OrderedDict((("stroke", palette.add_color(stroke)),
+                                    ("stroke_width", stroke_width),
+                                    ("fill", None if fill == None else palette.add_color(fill))))
+
+def _quantize(values, scale):
+    return numpy.rint(numpy.asarray(values, dtype = numpy.float64) * scale).astype(numpy.int64).tolist()
+
+class _ScenePalette:
+    # Colors of the scene, "#RRGGBBAA" -> index
+    def __init__(self):
+        self.colors = []
+        self._ids = {}
+
+    def add(self, hex_rgb, opacity):
+        color = "%s%02X"%(hex_rgb.upper(), int(round(float(opacity) * 255)))
+        if color not in self._ids:
+            self._ids[color] = len(self.colors)
+            self.colors.append(color)
+        return self._ids[color]
+
+    def add_color(self, color):
+        return self.add(color.get_hex_rgb(), color.get_float_alpha())
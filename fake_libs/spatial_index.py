@@ -0,0 +1,219 @@
+import heapq
+import math
+import numpy
+from scipy.spatial import cKDTree, Delaunay
+from .log_stuff import init_logger
+
+log = init_logger()
+
+class StarIndex:
+    # Spatial index (k-d tree) over a fixed list of rows of a StarTable, shared by the constellation
+    # algorithms to find the nearest stars without measuring the distance to every star.
+    #
+    # With box_size (width, height) the metric is periodic: the chart wraps around like a torus and
+    # the distance between two stars is the one to the nearest copy. Without it the rows are taken
+    # as they are, including the child stars in the neighbor band.
+    #
+    # Results are rows, in the order of the indexed rows, and the distances to them are computed
+    # exactly as get_star_distances() does, so exact ties are kept. Queries can skip the taken stars,
+    # which are checked when the query is done.
+    _first_k = 8
+
+    def __init__(self, star_table, rows, box_size = None):
+        self.star_table = star_table
+        self.rows = numpy.asarray(rows, dtype = numpy.int64)
+        self.box_size = None if box_size == None else (float(box_size[0]), float(box_size[1]))
+        self._w = star_table.w[self.rows].astype(numpy.float64)
+        self._h = star_table.h[self.rows].astype(numpy.float64)
+        points = numpy.column_stack((self._w, self._h))
+        if self.box_size != None:
+            points = numpy.mod(points, self.box_size)
+        self._tree = cKDTree(points, boxsize = self.box_size) if len(self.rows) > 0 else None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_nearest(self, w, h, skip_taken = False, exclude_row = None):
+        # (distance, rows at that distance), (None, []) if there is no star
+        if self._tree == None:
+            return None, []
+        k = self._first_k
+        while True:
+            k = min(k, len(self.rows))
+            distances, positions = self._tree.query(self._get_point(w, h), k = k)
+            positions = numpy.atleast_1d(positions)
+            distances = numpy.atleast_1d(distances)
+            valid = self._get_valid_mask(positions, skip_taken, exclude_row)
+            if valid.any() or k == len(self.rows):
+                break
+            k *= 4
+        if not valid.any():
+            return None, []
+        # every star which may be at the same distance
+        radius = distances[valid].min()
+        rows, exact_distances = self.query_radius(w, h, radius, skip_taken, exclude_row)
+        min_distance = exact_distances.min()
+        return float(min_distance), rows[exact_distances == min_distance].tolist()
+
+    def query_radius(self, w, h, radius, skip_taken = False, exclude_row = None):
+        # rows within radius and their distances
+        if self._tree == None:
+            return numpy.empty(0, dtype = numpy.int64), numpy.empty(0)
+        # the tree is searched a bit further, the exact distance decides
+        positions = numpy.array(sorted(self._tree.query_ball_point(self._get_point(w, h), radius * (1 + 1e-9) + 1e-9)), dtype = numpy.int64)
+        positions = positions[self._get_valid_mask(positions, skip_taken, exclude_row)]
+        distances = self._get_distances(w, h, positions)
+        keep = distances <= radius
+        return self.rows[positions[keep]], distances[keep]
+
+    def query_nearest(self, w, h, k, skip_taken = False, exclude_row = None):
+        # up to k rows sorted by distance and their distances
+        if self._tree == None:
+            return numpy.empty(0, dtype = numpy.int64), numpy.empty(0)
+        query_k = k
+        while True:
+            query_k = min(query_k, len(self.rows))
+            positions = numpy.atleast_1d(self._tree.query(self._get_point(w, h), k = query_k)[1])
+            positions = positions[self._get_valid_mask(positions, skip_taken, exclude_row)]
+            if len(positions) >= k or query_k == len(self.rows):
+                break
+            query_k *= 4
+        distances = self._get_distances(w, h, positions)
+        order = numpy.argsort(distances, kind = "stable")[:k]
+        return self.rows[positions[order]], distances[order]
+
+    def _get_point(self, w, h):
+        point = numpy.array((float(w), float(h)))
+        return point if self.box_size == None else numpy.mod(point, self.box_size)
+
+    def _get_valid_mask(self, positions, skip_taken, exclude_row):
+        # positions past the end are the missing neighbors of a k-d tree query
+        valid = positions < len(self.rows)
+        rows = self.rows[numpy.where(valid, positions, 0)]
+        if skip_taken:
+            valid &= ~self.star_table.get_taken_mask(rows)
+        if exclude_row != None:
+            valid &= rows != exclude_row
+        return valid
+
+    def _get_distances(self, w, h, positions):
+        dw = w - self._w[positions]
+        dh = h - self._h[positions]
+        if self.box_size != None:
+            dw = numpy.mod(dw, self.box_size[0])
+            dh = numpy.mod(dh, self.box_size[1])
+            dw = numpy.minimum(dw, self.box_size[0] - dw)
+            dh = numpy.minimum(dh, self.box_size[1] - dh)
+        return numpy.sqrt(dw**2 + dh**2)
+
+def get_delaunay_neighbors(w, h, box_size = None, margin = 0.0):
+    # Neighbors of every point (w, h) in a Delaunay triangulation, as a list of {(index, dx, dy): None}
+    # in the order they are found.
+    #
+    # With box_size (width, height) the triangulation is periodic, the points are in the box and it
+    # wraps around: the points are triangulated together with their copies in a margin around the box
+    # and dx, dy is the box offset of the copy of the neighbor (-1, 0 or 1). Otherwise they are 0.
+    # Points at the same position as another one are left out of the triangulation, they get the
+    # neighbors of that one.
+    w = numpy.asarray(w, dtype = numpy.float64)
+    h = numpy.asarray(h, dtype = numpy.float64)
+    offsets = [(0, 0)]
+    if box_size != None:
+        offsets.extend([(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)])
+    
+    # the points go first, then their copies in the margin
+    point_index = []
+    point_offset = []
+    points = []
+    for dx, dy in offsets:
+        if (dx, dy) == (0, 0):
+            in_margin = numpy.arange(len(w))
+            copy_w = w
+            copy_h = h
+        else:
+            copy_w = w + dx * box_size[0]
+            copy_h = h + dy * box_size[1]
+            in_margin = numpy.flatnonzero((copy_w >= -margin) & (copy_w <= box_size[0] + margin) & (copy_h >= -margin) & (copy_h <= box_size[1] + margin))
+        point_index.extend(in_margin.tolist())
+        point_offset.extend([(dx, dy)] * len(in_margin))
+        points.append(numpy.column_stack((copy_w[in_margin], copy_h[in_margin])))
+    points = numpy.concatenate(points)
+    tri = Delaunay(points)
+    log.info("Delaunay triangulation of %i points and %i copies in a margin of %.1f"%(len(w), len(points) - len(w), margin))
+    
+    count = len(w)
+    neighbors = [{} for i in range(count)]
+    for triangle in tri.simplices.tolist():
+        for a, b in ((triangle[0], triangle[1]), (triangle[1], triangle[2]), (triangle[2], triangle[0])):
+            for src, dst in ((a, b), (b, a)):
+                if src < count:
+                    neighbors[src][(point_index[dst], point_offset[dst][0], point_offset[dst][1])] = None
+    
+    for index, simplex, vertex in tri.coplanar.tolist():
+        if index >= count:
+            continue
+        vertex_dx, vertex_dy = point_offset[vertex]
+        for neighbor, dx, dy in list(neighbors[point_index[vertex]].keys()):
+            if neighbor != index or dx + vertex_dx != 0 or dy + vertex_dy != 0:
+                neighbors[index][(neighbor, dx + vertex_dx, dy + vertex_dy)] = None
+    return neighbors
+
+class NearestStarQueue:
+    # Priority queue of rows by their distance to a center which moves a little at a time (the mean
+    # position of a growing constellation), so the nearest stars are found without measuring the
+    # distance to every row on every step.
+    #
+    # The keys are the distance to the center when it was measured plus the total distance the center
+    # had moved until then. As the center moves, key - moved is a lower bound of the current distance,
+    # only the rows whose bound is not beyond the nearest one are measured again. The taken stars are
+    # dropped from the queue when they come up, so the queue must not be used after untaking a star.
+    #
+    # Distances are exact (as get_star_distances() computes them) and the ties are in the order of rows.
+    _tolerance = 1e-9
+
+    def __init__(self, star_table, rows, w, h):
+        self.star_table = star_table
+        self.rows = numpy.asarray(rows, dtype = numpy.int64)
+        self._w = star_table.w[self.rows].astype(numpy.float64).tolist()
+        self._h = star_table.h[self.rows].astype(numpy.float64).tolist()
+        self._center = (float(w), float(h))
+        self._moved = 0.0
+        available = numpy.flatnonzero(~star_table.get_taken_mask(self.rows))
+        distances = numpy.sqrt((self._center[0] - star_table.w[self.rows[available]].astype(numpy.float64))**2 +
+                               (self._center[1] - star_table.h[self.rows[available]].astype(numpy.float64))**2)
+        self._heap = list(zip(distances.tolist(), available.tolist()))
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def move_center(self, w, h):
+        w = float(w)
+        h = float(h)
+        self._moved += math.hypot(w - self._center[0], h - self._center[1])
+        self._center = (w, h)
+
+    def get_nearest(self):
+        # (distance, rows at that distance) of the nearest stars which are not taken, (None, []) if
+        # there are none. The rows stay in the queue until they are taken.
+        min_distance = None
+        measured = []
+        while len(self._heap) > 0:
+            if min_distance != None and self._heap[0][0] - self._moved > min_distance * (1 + self._tolerance) + self._tolerance:
+                break
+            key, position = heapq.heappop(self._heap)
+            if self.star_table.is_taken(self.rows[position]):
+                continue
+            distance = self._get_distance(position)
+            measured.append((distance, position))
+            if min_distance == None or distance < min_distance:
+                min_distance = distance
+        for distance, position in measured:
+            heapq.heappush(self._heap, (distance + self._moved, position))
+        nearest_positions = sorted([position for distance, position in measured if distance == min_distance])
+        return min_distance, self.rows[nearest_positions].tolist()
+
+    def _get_distance(self, position):
+        dw = self._center[0] - self._w[position]
+        dh = self._center[1] - self._h[position]
+        return math.sqrt(dw*dw + dh*dh)
@@ -1,55 +1,349 @@
 import random
+import weakref
+import numpy
 from .log_stuff import init_logger
-from .color import COLORS_FROM_START_INDEX
+from .color import Color, COLORS_FROM_START_INDEX
+from .palette import Palette
 
 log = init_logger()
 
-class Star:
-    _id_next = 0
-    _star_db = {}
-    
-    def __init__(self, 
-                 size = None, 
-                 w = None, 
-                 h = None, 
-                 color = None,
-                 master_star = None,
-                 quadrant = None):
-        self.constellation = None
-        self.id = Star._id_next
-        Star._id_next += 1
-        self._star_db[self.id] = self
+STAR_RNG_LEGACY = "legacy"
+STAR_RNG_NUMPY = "numpy"
+KNOWN_STAR_RNGS = (STAR_RNG_LEGACY,
+                   STAR_RNG_NUMPY
+                  )
+
+class StarTable:
+    # Structure of arrays store for all the stars of a chart.
+    #
+    # Every star is a row, master stars go first and child stars (ghost copies of a master
+    # star in a neighbor quadrant) are appended afterwards. Child stars are only created
+    # when needed and only when they fall inside the neighbor band around the central box.
+    # The taken flag is only meaningful on master rows, child rows share the flag of their master.
+    #
+    # w, h and size are float32 unless float_dtype says otherwise. The legacy RNG stars are kept
+    # as float64, so they are written exactly as the older charts were.
+    _no_constellation = -1
+    
+    def __init__(self, float_dtype = numpy.float32):
+        self.count = 0
+        self.master_count = 0
+        self.w             = numpy.empty(0, dtype = float_dtype)
+        self.h             = numpy.empty(0, dtype = float_dtype)
+        self.size          = numpy.empty(0, dtype = float_dtype)
+        self.quadrant      = numpy.empty(0, dtype = numpy.uint8)
+        self.master        = numpy.empty(0, dtype = numpy.int32)
+        self.taken         = numpy.empty(0, dtype = bool)
+        self.constellation = numpy.empty(0, dtype = numpy.int32)
+        self.palette_id    = numpy.empty(0, dtype = numpy.uint16)
         
-        self.master_star = master_star
-        self.is_master = master_star == None
-        self.quadrant = quadrant
-        self.quadrant.add_star(self)
-        if not self.is_master:
-            self.size     = self.master_star.size
-            self.w        = self.master_star.base_w + self.quadrant.w
-            self.h        = self.master_star.base_h + self.quadrant.h
-            self.color    = self.master_star.color
-            self.childs   = None
-            self.master_star.add_child(self)
-        else:
-            self.master_star = self
-            self.size     = size
-            self.w        = w + (0 if self.quadrant == None else self.quadrant.w)
-            self.h        = h + (0 if self.quadrant == None else self.quadrant.h)
-            self.base_w   = w
-            self.base_h   = h
-            self.color    = color
-            self.childs   = []
-        self.taken = False
-        self.tag = None
+        self.palette = Palette()
         
+        # index -> Quadrant, the index is the value stored in the quadrant column
+        self.quadrants = []
+        self._quadrant_index = {}
+        # (x, y) -> quadrant index
+        self._quadrant_xy = {}
+        # quadrant index of the neighbor quadrants, in creation order
+        self._neighbor_quadrants = []
+        self.neighbor_band = None
+        self._band_box = None
+        # quadrant index -> array of child rows, indexed by master row (-1 if no child)
+        self._child_rows = {}
+        # master rows whose band children have already been created
+        self._children_created = numpy.empty(0, dtype = bool)
+        # index -> Constellation, the index is the value stored in the constellation column
+        self.constellations = []
+        self._constellation_index = {}
+        # indexes of the available stars (constellations_common.AvailableStars) to update on take/untake
+        self._availability_indexes = weakref.WeakSet()
         
-    def set_color_index(self, color_index):
-        self.color.set_star_color_index(color_index)
-        return self.color.get_hex_rgb()
+    def __len__(self):
+        return self.count
+    
+    def _get_quadrant_index(self, quadrant):
+        key = id(quadrant)
+        if key not in self._quadrant_index:
+            assert len(self.quadrants) < 0xFF, "Too many quadrants"
+            self._quadrant_index[key] = len(self.quadrants)
+            self.quadrants.append(quadrant)
+            if quadrant != None:
+                self._quadrant_xy[(quadrant.x, quadrant.y)] = self._quadrant_index[key]
+        return self._quadrant_index[key]
+    
+    def _get_quadrant_offset(self, quadrant):
+        if quadrant == None:
+            return 0, 0
+        return quadrant.w, quadrant.h
+    
+    def _append_rows(self, count):
+        first_row = self.count
+        new_count = self.count + count
+        if new_count > len(self.w):
+            capacity = max(new_count, 2*len(self.w))
+            for column in ("w", "h", "size", "quadrant", "master", "taken", "constellation", "palette_id"):
+                old = getattr(self, column)
+                new = numpy.empty(capacity, dtype = old.dtype)
+                new[:self.count] = old[:self.count]
+                setattr(self, column, new)
+        self.count = new_count
+        return numpy.arange(first_row, new_count)
+    
+    def add_master_stars(self, w, h, size, palette_id, quadrant = None):
+        assert self.count == self.master_count, "Master stars must be added before any child star"
+        rows = self._append_rows(len(w))
+        q_w, q_h = self._get_quadrant_offset(quadrant)
+        self.w[rows]             = numpy.asarray(w) + q_w
+        self.h[rows]             = numpy.asarray(h) + q_h
+        self.size[rows]          = size
+        self.quadrant[rows]      = self._get_quadrant_index(quadrant)
+        self.master[rows]        = rows
+        self.taken[rows]         = False
+        self.constellation[rows] = self._no_constellation
+        self.palette_id[rows]    = palette_id
+        self.master_count = self.count
+        if quadrant != None:
+            quadrant.star_count += len(rows)
+        return rows
+    
+    def set_neighbor_quadrants(self, central_quadrant, quadrants, band = None):
+        # Register the neighbor quadrants. Child stars will only be created inside
+        # a band of the given width around the central quadrant (None means no limit)
+        assert len(self._neighbor_quadrants) == 0, "Neighbor quadrants already set"
+        box_size = central_quadrant.config.box_size
+        self.neighbor_band = band
+        if band != None:
+            self._band_box = (central_quadrant.w - band, 
+                              central_quadrant.h - band, 
+                              central_quadrant.w + box_size.width + band, 
+                              central_quadrant.h + box_size.height + band)
+        for quadrant in quadrants:
+            q_index = self._get_quadrant_index(quadrant)
+            self._neighbor_quadrants.append(q_index)
+            self._child_rows[q_index] = numpy.full(self.master_count, -1, dtype = numpy.int32)
+        self._children_created = numpy.zeros(self.master_count, dtype = bool)
+        
+    def _add_child_stars(self, master_rows, q_index, in_band_only):
+        quadrant = self.quadrants[q_index]
+        q_child_rows = self._child_rows[q_index]
+        master_rows = master_rows[q_child_rows[master_rows] < 0]
+        
+        master_q_index = self.quadrant[master_rows]
+        master_q_w = numpy.array([self._get_quadrant_offset(q)[0] for q in self.quadrants])[master_q_index]
+        master_q_h = numpy.array([self._get_quadrant_offset(q)[1] for q in self.quadrants])[master_q_index]
+        w = self.w[master_rows] - master_q_w + quadrant.w
+        h = self.h[master_rows] - master_q_h + quadrant.h
+        if in_band_only and self._band_box != None:
+            min_w, min_h, max_w, max_h = self._band_box
+            in_band = (w >= min_w) & (w <= max_w) & (h >= min_h) & (h <= max_h)
+            master_rows = master_rows[in_band]
+            w = w[in_band]
+            h = h[in_band]
+        
+        rows = self._append_rows(len(master_rows))
+        self.w[rows]             = w
+        self.h[rows]             = h
+        self.size[rows]          = self.size[master_rows]
+        self.quadrant[rows]      = q_index
+        self.master[rows]        = master_rows
+        self.taken[rows]         = False
+        self.constellation[rows] = self._no_constellation
+        self.palette_id[rows]    = self.palette_id[master_rows]
+        
+        q_child_rows[master_rows] = rows
+        quadrant.star_count += len(rows)
+        return rows
+    
+    def add_child_stars(self, master_rows, in_band_only = True):
+        # Create the child stars of the given master stars on every neighbor quadrant
+        master_rows = numpy.asarray(master_rows)
+        assert numpy.all(self.master[master_rows] == master_rows), "Child stars can only be created from master stars"
+        child_rows = [self._add_child_stars(master_rows, q_index, in_band_only) for q_index in self._neighbor_quadrants]
+        if in_band_only:
+            self._children_created[master_rows] = True
+        return numpy.concatenate(child_rows) if len(child_rows) > 0 else numpy.empty(0, dtype = numpy.int64)
+    
+    def get_child_rows(self, master_row):
+        if len(self._neighbor_quadrants) > 0 and not self._children_created[master_row]:
+            self.add_child_stars([master_row])
+        child_rows = []
+        for q_index in self._neighbor_quadrants:
+            child_row = self._child_rows[q_index][master_row]
+            if child_row >= 0:
+                child_rows.append(int(child_row))
+        return child_rows
+    
+    def get_peer_row(self, row, x, y):
+        # Row of the copy of the given star on quadrant x,y. The copy is created if it did
+        # not exist yet, regardless of the neighbor band. None if there is no such quadrant
+        master_row = int(self.master[row])
+        q_index = self._quadrant_xy.get((x, y))
+        if q_index == None:
+            return None
+        if q_index == self.quadrant[master_row]:
+            return master_row
+        q_child_rows = self._child_rows[q_index]
+        if q_child_rows[master_row] < 0:
+            self._add_child_stars(numpy.array([master_row]), q_index, in_band_only = False)
+        return int(q_child_rows[master_row])
+    
+    def get_peer_rows_at(self, rows, x_offset, y_offset):
+        # Rows of the copies of the given stars on the quadrants at x_offset,y_offset of their own
+        # quadrant, -1 where there is no such quadrant. The child rows are looked up by master row,
+        # the missing ones are created in order, regardless of the neighbor band
+        rows = numpy.asarray(rows, dtype = numpy.int64)
+        masters = self.master[rows].astype(numpy.int64)
+        quadrant_xy = [(0, 0) if q == None else (q.x, q.y) for q in self.quadrants]
+        targets = numpy.array([self._quadrant_xy.get((x + x_offset, y + y_offset), -1) for x, y in quadrant_xy], dtype = numpy.int64)[self.quadrant[rows]]
+        
+        peer_rows = numpy.full(len(rows), -1, dtype = numpy.int64)
+        for q_index in numpy.unique(targets[targets >= 0]).tolist():
+            selected = targets == q_index
+            own = selected & (self.quadrant[masters] == q_index)
+            peer_rows[own] = masters[own]
+            if q_index in self._child_rows:
+                children = selected & ~own
+                peer_rows[children] = self._child_rows[q_index][masters[children]]
+        for index in numpy.flatnonzero((peer_rows < 0) & (targets >= 0)).tolist():
+            quadrant_x, quadrant_y = quadrant_xy[self.quadrant[rows[index]]]
+            peer_rows[index] = self.get_peer_row(rows[index], quadrant_x + x_offset, quadrant_y + y_offset)
+        return peer_rows
+    
+    def get_peer_rows(self, row):
+        master_row = int(self.master[row])
+        peer_rows = [master_row]
+        peer_rows.extend(self.get_child_rows(master_row))
+        return peer_rows
+    
+    def is_master(self, row):
+        return self.master[row] == row
+    
+    def is_taken(self, row):
+        return bool(self.taken[self.master[row]])
+    
+    def get_taken_mask(self, rows):
+        return self.taken[self.master[rows]]
+    
+    def take(self, row):
+        master_row = int(self.master[row])
+        if not self.taken[master_row]:
+            self.taken[master_row] = True
+            for index in self._availability_indexes:
+                index._set_available(master_row, False)
+    
+    def untake(self, row):
+        master_row = int(self.master[row])
+        self.constellation[row] = self._no_constellation
+        self.constellation[master_row] = self._no_constellation
+        if self.taken[master_row]:
+            self.taken[master_row] = False
+            for index in self._availability_indexes:
+                index._set_available(master_row, True)
+    
+    def add_availability_index(self, index):
+        self._availability_indexes.add(index)
+    
+    def get_quadrant(self, row):
+        return self.quadrants[self.quadrant[row]]
+    
+    def get_rel_quadrant(self, row, other_row):
+        quadrant = self.get_quadrant(row)
+        other_quadrant = self.get_quadrant(other_row)
+        return (quadrant.x - other_quadrant.x, quadrant.y - other_quadrant.y)
+    
+    def get_constellation_mask(self, rows):
+        return self.constellation[rows] != self._no_constellation
+    
+    def get_constellation(self, row):
+        index = self.constellation[row]
+        return None if index == self._no_constellation else self.constellations[index]
+    
+    def set_constellation(self, row, constellation):
+        if constellation == None:
+            self.constellation[row] = self._no_constellation
+            return
+        key = id(constellation)
+        if key not in self._constellation_index:
+            self._constellation_index[key] = len(self.constellations)
+            self.constellations.append(constellation)
+        self.constellation[row] = self._constellation_index[key]
+    
+    def get_sorted_master_rows(self):
+        return numpy.argsort(self.size[:self.master_count], kind = "stable")
+    
+    def get_star(self, row):
+        return Star(self, row)
+    
+    def get_stars(self, rows):
+        return [Star(self, row) for row in rows]
+    
+class Star:
+    # Thin view of a single row of a StarTable
+    __slots__ = ("_table", "id")
+    
+    def __init__(self, table, row):
+        self._table = table
+        self.id = int(row)
+    
+    def __eq__(self, other):
+        return isinstance(other, Star) and other._table is self._table and other.id == self.id
+    
+    def __hash__(self):
+        return hash(self.id)
+    
+    @property
+    def w(self):
+        return float(self._table.w[self.id])
+    
+    @property
+    def h(self):
+        return float(self._table.h[self.id])
+    
+    @property
+    def size(self):
+        return float(self._table.size[self.id])
+    
+    @property
+    def quadrant(self):
+        return self._table.get_quadrant(self.id)
+    
+    @property
+    def is_master(self):
+        return self._table.is_master(self.id)
+    
+    @property
+    def master_star(self):
+        return Star(self._table, self._table.master[self.id])
+    
+    @property
+    def childs(self):
+        if not self.is_master:
+            return None
+        return self._table.get_stars(self._table.get_child_rows(self.id))
+    
+    @property
+    def taken(self):
+        return self._table.is_taken(self.id)
+    
+    @property
+    def constellation(self):
+        return self._table.get_constellation(self.id)
+    
+    @constellation.setter
+    def constellation(self, constellation):
+        self._table.set_constellation(self.id, constellation)
+    
+    @property
+    def color(self):
+        # shared with all the stars of the same color, do not modify
+        return self._table.palette.get_color(self._table.palette_id[self.id])
+    
+    @color.setter
+    def color(self, color):
+        self._table.palette_id[self._table.get_peer_rows(self.id)] = self._table.palette.add_color(color)
         
     def get_rel_quadrant_to_other_star(self, other_star):
-        return (self.quadrant.x - other_star.quadrant.x, self.quadrant.y - other_star.quadrant.y)
+        return self._table.get_rel_quadrant(self.id, other_star.id)
         
     def __str__(self):
         return "Star %i (%s, %s) at %i,%i, size %.3f"%(self.id, 
@@ -63,35 +357,24 @@ class Star:
         return "<%s>"%(str(self),)
     
     def get_peers(self):
-        if self.is_master:
-            peers = [self]
-            peers.extend(self.childs)
-        else:
-            peers = self.master_star.get_peers()
-        return peers
-        
-    def add_child(self, child):
-        assert self.is_master
-        self.childs.append(child)
+        return self._table.get_stars(self._table.get_peer_rows(self.id))
     
     def take(self):
-        if self.is_master:
-            self.taken = True
-            for child in self.childs:
-                child.taken = True
-        else:
-            self.master_star.take()
+        self._table.take(self.id)
             
     def untake(self):
-        self.constellation = None
-        if self.is_master:
-            self.taken = False
-            for child in self.childs:
-                child.taken = False
-        else:
-            self.master_star.untake()
+        self._table.untake(self.id)
             
-def get_random_stars(min_size, 
+def get_float_list(values):
+    # Python floats of the values of a float column, to be written. float32 values are taken as their
+    # shortest repr (584.7427 and not 584.74267578125), as they were before they were rounded
+    values = numpy.asarray(values)
+    if values.dtype == numpy.float32:
+        values = values.astype(str).astype(numpy.float64)
+    return values.tolist()
+
+def get_random_stars(star_table,
+                     min_size, 
                      max_size, 
                      max_w, 
                      max_h, 
@@ -99,34 +382,103 @@ def get_random_stars(min_size,
                      quadrant = None,
                      size_random_count = 0,
                      size_distribution_power = 1,
-                     color = None):
-                     
-                     
-    generated_stars = []
+                     color = None,
+                     rng = STAR_RNG_LEGACY,
+                     seed = None,
+                     color_index_resolution = 0):
+    assert rng in KNOWN_STAR_RNGS, "Invalid star rng: %s (known %s)"%(rng, ", ".join(KNOWN_STAR_RNGS))
+    
+    use_color_index = color != None and color.color_name in COLORS_FROM_START_INDEX
+    
+    if rng == STAR_RNG_LEGACY:
+        sizes, ws, hs, color_indices = _get_random_star_values_legacy(min_size = min_size,
+                                                                      max_size = max_size,
+                                                                      max_w = max_w,
+                                                                      max_h = max_h,
+                                                                      star_count = star_count,
+                                                                      size_random_count = size_random_count,
+                                                                      size_distribution_power = size_distribution_power,
+                                                                      use_color_index = use_color_index)
+    elif rng == STAR_RNG_NUMPY:
+        sizes, ws, hs, color_indices = _get_random_star_values_numpy(min_size = min_size,
+                                                                     max_size = max_size,
+                                                                     max_w = max_w,
+                                                                     max_h = max_h,
+                                                                     star_count = star_count,
+                                                                     size_random_count = size_random_count,
+                                                                     size_distribution_power = size_distribution_power,
+                                                                     use_color_index = use_color_index,
+                                                                     seed = seed)
+    else:
+        raise Exception("Internal error, unimplemented star rng: %s"%(rng, ))
+    
+    if use_color_index:
+        palette_id = star_table.palette.get_color_index_ids(color.color_name, color_indices, resolution = color_index_resolution)
+    else:
+        palette_id = star_table.palette.add_color(color if color != None else Color("#FFFFFF"))
+    
+    return star_table.add_master_stars(w = ws, 
+                                       h = hs,
+                                       size = sizes,
+                                       palette_id = palette_id,
+                                       quadrant = quadrant)
+
+def _get_random_star_values_legacy(min_size, 
+                                   max_size, 
+                                   max_w, 
+                                   max_h, 
+                                   star_count,
+                                   size_random_count,
+                                   size_distribution_power,
+                                   use_color_index):
+    # One star at a time out of the global python random generator. The call order 
+    # must not change, otherwise older seeds won't reproduce the same charts.
+    sizes = []
+    ws = []
+    hs = []
     size_range = max_size - min_size
     for i in range(0, star_count):
         # star size
         r = 1
         for j in range(0, size_random_count): r *= random.random()
-        star_size = (r**size_distribution_power) * size_range + min_size
-        
-        w = random.random()*max_w
-        h = random.random()*max_h
+        sizes.append((r**size_distribution_power) * size_range + min_size)
         
-        star = Star(size = star_size,
-                    w = w, 
-                    h = h,
-                    color = color.clone() if color != None else "#FFFFFF",
-                    quadrant = quadrant)
-        
-        generated_stars.append(star)
+        ws.append(random.random()*max_w)
+        hs.append(random.random()*max_h)
     
     # Split the process in two loops to keep the random behavior for the same seed when random colors are enabled            
-    for star in generated_stars:
-        if star.color.color_name in COLORS_FROM_START_INDEX:
-            star.set_color_index(_get_random_color_index())
-    return generated_stars
+    color_indices = None
+    if use_color_index:
+        color_indices = [_get_random_color_index() for i in range(0, star_count)]
+    return sizes, ws, hs, color_indices
+
+def _get_random_star_values_numpy(min_size, 
+                                  max_size, 
+                                  max_w, 
+                                  max_h, 
+                                  star_count,
+                                  size_random_count,
+                                  size_distribution_power,
+                                  use_color_index,
+                                  seed = None):
+    # All the values are drawn as arrays in one pass out of a dedicated generator, 
+    # the global python random generator is not touched
+    generator = numpy.random.default_rng(seed)
+    
+    size_range = max_size - min_size
+    r = numpy.ones(star_count)
+    for j in range(0, size_random_count): r *= generator.random(star_count)
+    sizes = (r**size_distribution_power) * size_range + min_size
+    
+    ws = generator.random(star_count)*max_w
+    hs = generator.random(star_count)*max_h
+    
+    color_indices = None
+    if use_color_index:
+        # ci <-0.4,+2.0> 
+        color_indices = generator.random(star_count) * 2.4 - 0.4
+    return sizes, ws, hs, color_indices
             
 def _get_random_color_index():
     # ci <-0.4,+2.0> 
-    return random.random() * 2.4 - 0.4
\ No newline at end of file
+    return random.random() * 2.4 - 0.4
@@ -1,37 +1,104 @@
 import sys
 import os
+import time
+import concurrent.futures
 from fake_libs.log_stuff import init_logger
+from fake_libs.renderers import read_svg
 
 log = init_logger()
 
 SVG_TO_PNG_METHOD_WAND = "wand"
-KNOWN_SVG_TO_PNG_METHODS = (SVG_TO_PNG_METHOD_WAND,)
+SVG_TO_PNG_METHOD_NUMPY = "numpy"
+KNOWN_SVG_TO_PNG_METHODS = (SVG_TO_PNG_METHOD_WAND,
+                            SVG_TO_PNG_METHOD_NUMPY,
+                           )
 
-def convert(method, svg_file, png_file = None, resolution = 72):
+def convert(method, svg_file, png_file = None, resolution = 72, chart = None, workers = None):
+    # resolution is either one DPI resolution or a list of them, which are converted in parallel
+    # by a pool of workers processes (as many as CPUs when workers is None). With several
+    # resolutions the PNG files are named <name>.<resolution>dpi.png and the list of them is
+    # returned.
+    #
+    # chart is the object returned by charts.generate_chart. The numpy method does not read the
+    # SVG file, it draws the chart again. The wand method uses chart.svg_document, when it was
+    # kept, instead of reading the SVG file.
     assert method in KNOWN_SVG_TO_PNG_METHODS
+    resolutions = list(resolution) if isinstance(resolution, (list, tuple)) else [resolution]
+    assert len(resolutions) > 0, "No resolution to convert to"
     if png_file == None:
         png_file = os.path.splitext(svg_file)[0] + ".png"
-    
-    log.info("Exporting %s to PNG as %s using method %s, resolution: %s"%(svg_file, png_file, method, resolution))
-    
+    if len(resolutions) == 1:
+        png_files = [png_file]
+    else:
+        png_files = ["%s.%sdpi.png"%(os.path.splitext(png_file)[0], r) for r in resolutions]
+
+    log.info("Exporting %s to PNG as %s using method %s, resolution: %s"%(svg_file, ", ".join(png_files), method,
+                                                                         ", ".join([str(r) for r in resolutions])))
+
     if method == SVG_TO_PNG_METHOD_WAND:
-        # do imports here, in case these modules are not installed import error won't happen unless user attempts to run this code
-        from wand.api import library
-        import wand.color
-        import wand.image
-
-        with open(svg_file, "r") as svg_file:
-            with wand.image.Image() as image:
-                with wand.color.Color('transparent') as background_color:
-                    library.MagickSetBackgroundColor(image.wand, 
-                                                     background_color.resource) 
-                svg_blob = svg_file.read().encode('utf-8')
-                image.read(blob=svg_blob, resolution = resolution)
-                png_image = image.make_blob("png32")
-
-        with open(png_file, "wb") as out:
-            out.write(png_image)
+        # plain and compressed (svgz) files
+        source = chart.svg_document if (chart != None and chart.svg_document != None) else read_svg(svg_file)
+        convert_function = _convert_with_wand
+    elif method == SVG_TO_PNG_METHOD_NUMPY:
+        assert chart != None, "The %s method needs the chart to convert"%(method, )
+        from fake_libs.charts import write_chart
+        from fake_libs.raster import RasterRenderer
+
+        # the elements are recorded once, for all the resolutions
+        source = RasterRenderer(None, size = (chart.width, chart.height))
+        write_chart(chart, source)
+        convert_function = _convert_with_numpy
     else:
         raise Exception("Internal error, unimplemented method: %s"%(method, ))
-    
-    return png_file
\ No newline at end of file
+
+    start = time.time()
+    if len(resolutions) == 1:
+        elapsed = [convert_function(source, png_files[0], resolutions[0])]
+    else:
+        workers = min(len(resolutions), os.cpu_count() or 1) if workers == None else workers
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            elapsed = list(pool.map(convert_function, [source] * len(resolutions), png_files, resolutions))
+    for file, r, seconds in zip(png_files, resolutions, elapsed):
+        log.info("Converted %s at %s dpi in %.2f s"%(file, r, seconds))
+    if len(resolutions) > 1:
+        log.info("Converted %i resolutions in %.2f s"%(len(resolutions), time.time() - start))
+
+    return png_files if isinstance(resolution, (list, tuple)) else png_files[0]
+
+def _convert_with_wand(svg_document, png_file, resolution):
+    # returns the wall time
+    start = time.time()
+    # do imports here, in case these modules are not installed import error won't happen unless user attempts to run this code
+    from wand.api import library
+    import wand.color
+    import wand.image
+
+    with wand.image.Image() as image:
+        with wand.color.Color('transparent') as background_color:
+            library.MagickSetBackgroundColor(image.wand,
+                                             background_color.resource)
+        image.read(blob=svg_document, resolution = resolution)
+        png_image = image.make_blob("png32")
+
+    with open(png_file, "wb") as out:
+        out.write(png_image)
+    return time.time() - start
+
+def _convert_with_numpy(renderer, png_file, resolution):
+    # returns the wall time
+    start = time.time()
+    renderer.write(png_file, resolution)
+    return time.time() - start
+
+def export_tiles(chart, directory, resolution = 72, tile_size = 256):
+    # Tile pyramid of the chart (the object returned by charts.generate_chart), drawn with the
+    # numpy method
+    from fake_libs.charts import write_chart
+    from fake_libs.raster import RasterRenderer, write_tiles
+
+    log.info("Exporting tiles of %i pixels to %s, resolution: %s"%(tile_size, directory, resolution))
+    renderer = RasterRenderer(None, size = (chart.width, chart.height), resolution = resolution)
+    write_chart(chart, renderer)
+    count = write_tiles(renderer, directory, tile_size)
+    log.info("Wrote %i tiles"%(count, ))
+    return count
@@ -5,7 +5,9 @@ import argparse
 from fake_libs.config_file import ConfigFile
 from fake_libs.log_stuff import init_logger
 from fake_libs.charts import generate_chart
-from fake_libs.svg_to_png import KNOWN_SVG_TO_PNG_METHODS, convert
+from fake_libs.svg_to_png import KNOWN_SVG_TO_PNG_METHODS, SVG_TO_PNG_METHOD_WAND, convert, export_tiles
+from fake_libs.renderers import SVGZ_EXTENSION
+from fake_libs.scene import DEFAULT_SCENE_PRECISION, export_scene, log_scene_size
 
 log = init_logger()
 
@@ -19,13 +21,25 @@ def _get_args():
     parser.add_argument('ini_files', metavar='N', type=str, nargs='*',
                         help='One or more ini files to describe the chart to generate.')
     parser.add_argument('-f', '--svg_filename', dest='svg_filename', metavar='<FILENAME>',
-                        default=None, help='Custom filename for the SVG file.')
+                        default=None, help='Custom filename for the SVG file, use the .svgz extension to write it compressed.')
+    parser.add_argument('-z', '--svgz', dest='svgz', action="store_true",
+                        default=False, help='Write the default SVG file compressed (.svgz).')
     parser.add_argument('-e', '--export_parameters', dest='export_parameters', metavar='<FILENAME>',
                         default=None, help='Export parameters in text format.')
     parser.add_argument('-p', '--convert_to_png', dest='convert_to_png', metavar='<METHOD>',
                         default=None, help='Convert the generated SVG to PNG using the specified method.')
-    parser.add_argument('-r', '--png_resolution', dest='png_resolution', metavar='<int>(dpi)', type=int,
-                        default=_default_png_resolution, help='DPI resolution for PNG conversion. Default: %(default)s.')
+    parser.add_argument('-r', '--png_resolution', dest='png_resolution', metavar='<int>(dpi)', type=int, nargs='+',
+                        default=[_default_png_resolution], help='One or more DPI resolutions for PNG conversion, several resolutions are converted in parallel. Default: %(default)s.')
+    parser.add_argument('-w', '--png_workers', dest='png_workers', metavar='<int>', type=int,
+                        default=None, help='Number of processes converting several PNG resolutions. Default: one per resolution, up to the number of CPUs.')
+    parser.add_argument('-t', '--tiles', dest='tiles', metavar='<DIRECTORY>',
+                        default=None, help='Write the chart as a pyramid of PNG tiles (DIRECTORY/zoom/x/y.png), the deepest zoom level has the PNG resolution.')
+    parser.add_argument('--tile_size', dest='tile_size', metavar='<int>(pixels)', type=int,
+                        default=256, help='Size of the PNG tiles. Default: %(default)s.')
+    parser.add_argument('-s', '--scene', dest='scene', metavar='<FILENAME>',
+                        default=None, help='Export the chart geometry as a compact JSON scene, to be drawn by a client instead of the SVG.')
+    parser.add_argument('--scene_precision', dest='scene_precision', metavar='<int>', type=int,
+                        default=DEFAULT_SCENE_PRECISION, help='Decimals kept in the coordinates of the scene. Default: %(default)s.')
     parser.add_argument('-O', '--open_png', dest='open_png', action="store_true",
                         default=False, help='Open PNG file when done')
     parser.add_argument('-o', '--open_svg', dest='open_svg', action="store_true",
@@ -39,13 +53,18 @@ def _get_args():
     args.ini_files = [os.path.abspath(f) for f in args.ini_files]
     
     if args.svg_filename == None:
-        args.svg_filename = "chart.%s.svg"%(".".join([os.path.splitext(os.path.basename(f))[0] for f in args.ini_files]))
+        args.svg_filename = "chart.%s%s"%(".".join([os.path.splitext(os.path.basename(f))[0] for f in args.ini_files]),
+                                          SVGZ_EXTENSION if args.svgz else ".svg")
     else:
-        assert os.path.splitext(args.svg_filename)[1].lower() == ".svg", "--svg_filename must have .svg extension: %s"%(args.svg_filename,)
+        assert os.path.splitext(args.svg_filename)[1].lower() in (".svg", SVGZ_EXTENSION), "--svg_filename must have .svg or .svgz extension: %s"%(args.svg_filename,)
 
     if args.convert_to_png != None:
         assert args.convert_to_png in KNOWN_SVG_TO_PNG_METHODS, "--KNOWN_SVG_TO_PNG_METHODS must be one of %s, not %s"%(",".join(KNOWN_SVG_TO_PNG_METHODS), args.convert_to_png)
         
+    assert args.png_workers == None or args.png_workers > 0, "--png_workers must be positive, not %s"%(args.png_workers,)
+    assert args.scene_precision >= 0, "--scene_precision must not be negative, not %s"%(args.scene_precision,)
+    assert args.tile_size > 0, "--tile_size must be positive, not %s"%(args.tile_size,)
+
     if args.export_parameters == "AUTO":
         args.export_parameters = os.path.splitext(args.svg_filename)[0] + ".txt"
         
@@ -63,10 +82,22 @@ def main():
         if args.export_parameters:
             config.log(file = args.export_parameters)
         
-        generate_chart(args.svg_filename, config)
+        # the SVG is handed over in memory to the PNG conversion
+        chart = generate_chart(args.svg_filename, config,
+                               keep_document = args.convert_to_png == SVG_TO_PNG_METHOD_WAND or args.scene != None)
+
+        if args.scene:
+            scene_document = export_scene(chart, args.scene, precision = args.scene_precision)
+            log_scene_size(scene_document, chart.svg_document)
         
         if args.convert_to_png:
-            png_file = convert(method = args.convert_to_png, svg_file = args.svg_filename, resolution = args.png_resolution)
+            resolution = args.png_resolution[0] if len(args.png_resolution) == 1 else args.png_resolution
+            png_files = convert(method = args.convert_to_png, svg_file = args.svg_filename, resolution = resolution,
+                                chart = chart, workers = args.png_workers)
+            png_file = png_files if len(args.png_resolution) == 1 else png_files[0]
+
+        if args.tiles:
+            export_tiles(chart, args.tiles, resolution = max(args.png_resolution), tile_size = args.tile_size)
             
         if args.open_svg:
             log.info("Opening SVG")